@@ -0,0 +1,50 @@
+"""
+Times parse_dmi_metadata on generated descriptions with thousands of states, including the optional keys byond writes.
+Run with python -m benchmarks.metadata
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+from src.dmi import dmi_description, parse_dmi_metadata
+
+
+def build_description(states: int) -> str:
+    state_dicts = []
+    for i in range(states):
+        state = {"name": f"object{i // 4}-{i % 4}", "dirs": 4 if i % 3 else 1, "frames": 1 + i % 4}
+        if state["frames"] > 1:
+            state["delay"] = [0.1 * (1 + x % 3) for x in range(state["frames"])]
+        if i % 5 == 0:
+            state.update({"loop": 1, "rewind": 1})
+        if i % 7 == 0:
+            state.update({"movement": 1, "hotspot": [16, 16, 1]})
+        state_dicts.append(state)
+    return dmi_description(state_dicts)
+
+
+def run(states: int, repeat: int = 5) -> float:
+    """
+    :return: best time in seconds
+    """
+    description = build_description(states)
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        parse_dmi_metadata(description)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--states", type=int, action="append", help="State count. Can be repeated.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for states in args.states or [1000, 5000, 20000]:
+        elapsed = run(states, args.repeat)
+        print(f"{states:>6} states: {elapsed * 1000:8.2f}ms ({elapsed / states * 1e6:.2f}us per state)")
+
+
+if __name__ == "__main__":
+    main()
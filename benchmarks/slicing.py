@@ -0,0 +1,57 @@
+"""
+Compares the pillow and numpy backends of dmi_state_images on a large animated sheet.
+Run with python -m benchmarks.slicing
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+from PIL import Image
+
+from src.dmi import dmi_state_images, sheet_array
+
+
+def build_sheet(states: int, directions: int, frames: int, size: tuple = (32, 32)) -> Image.Image:
+    frame_count = states * directions * frames
+    columns = 1
+    while columns * columns < frame_count:
+        columns += 1
+    rows = -(-frame_count // columns)
+    sheet = Image.new("RGBA", (columns * size[0], rows * size[1]))
+    for i in range(frame_count):
+        colour = ((i * 40) % 256, (i * 90) % 256, (i * 7) % 256, 255)
+        sheet.paste(Image.new("RGBA", size, colour), ((i % columns) * size[0], (i // columns) * size[1]))
+    return sheet
+
+
+def run(states: int, directions: int, frames: int) -> dict:
+    sheet = build_sheet(states, directions, frames)
+    per_state = directions * frames
+    results = {}
+
+    start = perf_counter()
+    for state in range(states):
+        dmi_state_images(sheet, state * per_state, frames=frames, directions=directions)
+    results["pillow"] = perf_counter() - start
+
+    start = perf_counter()
+    array = sheet_array(sheet)
+    for state in range(states):
+        dmi_state_images(sheet, state * per_state, frames=frames, directions=directions, backend="numpy",
+                         sheet=array)
+    results["numpy"] = perf_counter() - start
+    return results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--states", type=int, default=400)
+    parser.add_argument("--directions", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=4)
+    args = parser.parse_args()
+    results = run(args.states, args.directions, args.frames)
+    for backend, elapsed in results.items():
+        print(f"{backend}: {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
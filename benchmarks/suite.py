@@ -0,0 +1,263 @@
+"""
+Times each stage of a conversion (metadata, parse, slice, encode, save and the convert functions) over a grid of
+generated .dmi files, recording wall time and peak Python memory per stage.
+Run with python -m benchmarks.suite; --save writes a JSON baseline and --baseline fails on regressions against one.
+Memory is recorded two ways: peak_bytes comes from tracemalloc which only sees Python allocations (Pillow's image
+buffers aren't in it), peak_rss_bytes is how far the stage pushed the process's max RSS above where it started,
+measured in a fresh subprocess per stage so it does include them.
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple, Optional
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from src.corpus import generate_dmi
+from src.dmi import DMI, dmi_state_images, parse_dmi_metadata
+from src.rsi import RSI, RSIState
+from src.storage import MemoryStorage
+from src.utils import convert_dmi_to_many_rsi, convert_dmi_to_rsi
+
+BASELINE_VERSION = 1
+
+
+class BenchmarkCase(NamedTuple):
+    states: int
+    directions: int
+    frames: int
+    size: int = 32
+
+    @property
+    def name(self) -> str:
+        return f"{self.states}x{self.directions}x{self.frames}@{self.size}"
+
+
+class StageResult(NamedTuple):
+    seconds: float
+    peak_bytes: int
+    # None if it couldn't be measured on this platform (or --no-rss)
+    peak_rss_bytes: Optional[int] = None
+
+
+CASES = [
+    BenchmarkCase(states=20, directions=1, frames=1),
+    BenchmarkCase(states=100, directions=4, frames=1),
+    BenchmarkCase(states=50, directions=4, frames=8),
+    BenchmarkCase(states=50, directions=4, frames=1, size=64),
+    BenchmarkCase(states=1000, directions=4, frames=1),
+    BenchmarkCase(states=100, directions=8, frames=4, size=64),
+]
+
+QUICK_CASES = [
+    BenchmarkCase(states=4, directions=4, frames=2),
+]
+
+
+def build_dmi(case: BenchmarkCase) -> bytes:
+    # Seeded so every run (and the baseline) sees the same sheet
+    return generate_dmi(case.states, directions=case.directions, frames=case.frames, size=(case.size, case.size),
+                        seed=0)
+
+
+def measure(stage: Callable[[], object], repeat: int = 3) -> StageResult:
+    """
+    Best of repeat timings, then one more run under tracemalloc for the peak (it slows everything down so the two
+    aren't mixed)
+    :param stage: called with no arguments
+    """
+    seconds = None
+    for _ in range(repeat):
+        start = perf_counter()
+        stage()
+        elapsed = perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return StageResult(seconds=seconds, peak_bytes=peak)
+
+
+def _max_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _rss_stage(data: bytes, stage: str, connection) -> None:
+    try:
+        with TemporaryDirectory() as directory:
+            func = _stages(data, directory)[stage]
+            gc.collect()
+            # Max RSS is a high water mark so setup's own peak can hide a smaller stage; going from the current RSS
+            # where it's available gets closer
+            before = _current_rss() or _max_rss()
+            func()
+            connection.send(max(_max_rss() - before, 0))
+    except Exception:
+        connection.send(None)
+        raise
+
+
+def measure_rss(data: bytes, stage: str) -> Optional[int]:
+    """
+    Runs a single stage in a fresh spawned process so nothing else this process has done counts against it
+    :return: bytes the stage added to the process's peak RSS, None where that can't be measured
+    """
+    if resource is None:
+        return None
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_rss_stage, args=(data, stage, sender))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        return None
+    finally:
+        process.join()
+
+
+def _stages(data: bytes, directory: str) -> Dict[str, Callable[[], object]]:
+    dmi = DMI(BytesIO(data), lazy=True)
+    description = dmi.image.info.get("Description")
+    rsi = RSI(
+        size={"x": dmi.width, "y": dmi.height},
+        states=[RSIState(data=x.image, name=x.name, directions=x.dirs, delays=x.delay) for x in dmi.states],
+    )
+
+    def _slice():
+        for state in dmi.metadata["states"]:
+            dmi_state_images(dmi.image, state["offset"], frames=state["frames"], directions=state["dirs"],
+                             size=(dmi.width, dmi.height))
+
+    def _encode():
+        for state in rsi.states:
+            state.image_buffer()
+
+    return {
+        "metadata": lambda: parse_dmi_metadata(description),
+        "parse": lambda: DMI(BytesIO(data), lazy=True),
+        "slice": _slice,
+        "encode": _encode,
+        "save": lambda: rsi.save_to(os.path.join(directory, "save.rsi"), fsync=False),
+        "convert": lambda: convert_dmi_to_rsi(BytesIO(data), MemoryStorage()),
+        "convert_many": lambda: convert_dmi_to_many_rsi(BytesIO(data), MemoryStorage()),
+    }
+
+
+def run(cases: List[BenchmarkCase], repeat: int = 3, stages: List[str] = None, rss: bool = True) -> Dict[str, dict]:
+    """
+    :param stages: only run these stages
+    :param rss: also measure each stage's peak RSS in a subprocess, see measure_rss
+    :return: "<case>/<stage>" -> {"seconds": .., "peak_bytes": .., "peak_rss_bytes": ..}
+    """
+    results = {}
+    for case in cases:
+        data = build_dmi(case)
+        with TemporaryDirectory() as directory:
+            for stage, func in _stages(data, directory).items():
+                if stages and stage not in stages:
+                    continue
+                result = measure(func, repeat)
+                if rss:
+                    result = result._replace(peak_rss_bytes=measure_rss(data, stage))
+                results[f"{case.name}/{stage}"] = result._asdict()
+                rss_text = "-" if result.peak_rss_bytes is None else f"{result.peak_rss_bytes / 1024:.1f}KiB"
+                print(f"{case.name:>16} {stage:<13} {result.seconds * 1000:9.2f}ms "
+                      f"{result.peak_bytes / 1024:10.1f}KiB {rss_text:>12} RSS")
+    return results
+
+
+def save_baseline(results: Dict[str, dict], path: str) -> None:
+    baseline = {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> Dict[str, dict]:
+    with open(path, "r") as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+        raise AttributeError(f"Unsupported baseline version {baseline.get('version')}")
+    return baseline["results"]
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], time_threshold: float = 0.25,
+            memory_threshold: float = 0.25) -> List[str]:
+    """
+    :param time_threshold: allowed slowdown as a fraction, e.g. 0.25 fails anything over 25% slower
+    :param memory_threshold: same for peak memory (both tracemalloc and RSS)
+    :return: a line per regression; stages / measurements missing from either side are ignored
+    """
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for field, threshold in [("seconds", time_threshold), ("peak_bytes", memory_threshold),
+                                 ("peak_rss_bytes", memory_threshold)]:
+            if not previous.get(field) or result.get(field) is None:
+                continue
+            if result[field] > previous[field] * (1 + threshold):
+                change = result[field] / previous[field] - 1
+                regressions.append(f"{key} {field}: {previous[field]:.6g} -> {result[field]:.6g} (+{change:.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true", help="Single small case, for smoke testing")
+    parser.add_argument("--repeat", type=int, default=3, help="Timings are the best of this many runs")
+    parser.add_argument("--stage", action="append", help="Only run this stage. Can be repeated.")
+    parser.add_argument("--no-rss", action="store_true", help="Skip the per-stage subprocesses measuring RSS")
+    parser.add_argument("--save", metavar="PATH", help="Write the results as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="Fail on regressions against this baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed peak memory increase")
+    args = parser.parse_args(argv)
+    results = run(QUICK_CASES if args.quick else CASES, args.repeat, args.stage, rss=not args.no_rss)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.baseline:
+        regressions = compare(results, load_baseline(args.baseline), args.time_threshold, args.memory_threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
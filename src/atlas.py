@@ -0,0 +1,241 @@
+import json
+import os
+from logging import Logger, getLogger
+from typing import Dict, List, NamedTuple, Optional
+
+from PIL import Image
+
+from src.internal_utils import pixel_hash
+from src.rsi import RSI, RSIState
+
+logger: Logger = getLogger(__name__)
+
+ATLAS_VERSION = 1
+
+
+class Rect(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+
+    @property
+    def right(self) -> int:
+        return self.x + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.y + self.height
+
+    def intersects(self, other: "Rect") -> bool:
+        return self.x < other.right and other.x < self.right and self.y < other.bottom and other.y < self.bottom
+
+    def contains(self, other: "Rect") -> bool:
+        return self.x <= other.x and self.y <= other.y and other.right <= self.right and other.bottom <= self.bottom
+
+
+class MaxRectsPacker:
+    def __init__(self, width: int, height: int):
+        """
+        MaxRects bin packer (best short side fit): keeps every maximal free rectangle rather than a guillotine split so
+        mixed frame sizes pack tightly
+        """
+        self.width = width
+        self.height = height
+        self.free: List[Rect] = [Rect(0, 0, width, height)]
+        # Furthest right / bottom anything got placed, used to shrink the sheet afterwards
+        self.used_width = 0
+        self.used_height = 0
+
+    def insert(self, width: int, height: int) -> Optional[Rect]:
+        """
+        :return: where it got placed or None if it doesn't fit
+        """
+        best = None
+        best_fit = None
+        for free in self.free:
+            if free.width < width or free.height < height:
+                continue
+            leftover_x = free.width - width
+            leftover_y = free.height - height
+            fit = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+            if best_fit is None or fit < best_fit:
+                best = Rect(free.x, free.y, width, height)
+                best_fit = fit
+        if best is None:
+            return None
+        self._place(best)
+        return best
+
+    def _place(self, rect: Rect) -> None:
+        free_rects = []
+        for free in self.free:
+            if not free.intersects(rect):
+                free_rects.append(free)
+                continue
+            # Whatever's left of free on each side of rect
+            if rect.x > free.x:
+                free_rects.append(Rect(free.x, free.y, rect.x - free.x, free.height))
+            if rect.right < free.right:
+                free_rects.append(Rect(rect.right, free.y, free.right - rect.right, free.height))
+            if rect.y > free.y:
+                free_rects.append(Rect(free.x, free.y, free.width, rect.y - free.y))
+            if rect.bottom < free.bottom:
+                free_rects.append(Rect(free.x, rect.bottom, free.width, free.bottom - rect.bottom))
+        # Drop anything inside another free rect (the first of any exact repeats is kept)
+        self.free = [x for i, x in enumerate(free_rects)
+                     if not any(j != i and y.contains(x) and (y != x or j < i) for j, y in enumerate(free_rects))]
+        self.used_width = max(self.used_width, rect.right)
+        self.used_height = max(self.used_height, rect.bottom)
+
+
+def next_power_of_two(value: int) -> int:
+    return 1 << max(value - 1, 0).bit_length()
+
+
+class Atlas(NamedTuple):
+    sheets: List[Image.Image]
+    # Sidecar index, see pack_rsis
+    index: dict
+
+
+def _frame_size(rsi: RSI, image: Image.Image) -> tuple:
+    width, height = rsi.size.get("x"), rsi.size.get("y")
+    if width and height and image.width % width == 0 and image.height % height == 0:
+        return width, height
+    # Doesn't split evenly so treat the whole thing as one frame
+    return image.width, image.height
+
+
+def pack_rsis(rsis: Dict[str, RSI], max_size: int = 2048, padding: int = 0) -> Atlas:
+    """
+    Packs every frame of every state into as few power of two sheets as possible. Identical frames only get packed
+    once so duplicate and blank frames are free.
+    :param rsis: name (e.g. "lamp.rsi") -> RSI
+    :param max_size: largest sheet width / height
+    :param padding: transparent pixels left to the right of / below each frame
+    :return: Atlas; its index has everything needed to rebuild the RSIs with unpack_atlas
+    """
+    frames = {}
+    index = {"version": ATLAS_VERSION, "sheets": [], "rsis": {}}
+    for rsi_name, rsi in rsis.items():
+        states = []
+        for state in rsi.states:
+            if not state.name:
+                continue
+            image = state.image if state.image.mode == "RGBA" else state.image.convert("RGBA")
+            frame_width, frame_height = _frame_size(rsi, image)
+            if frame_width + padding > max_size or frame_height + padding > max_size:
+                raise AttributeError(f"{rsi_name}/{state.name} frames don't fit in a {max_size} sheet")
+            state_frames = []
+            for y in range(0, image.height, frame_height):
+                for x in range(0, image.width, frame_width):
+                    frame = image.crop((x, y, x + frame_width, y + frame_height))
+                    key = pixel_hash(frame)
+                    frames.setdefault(key, frame)
+                    state_frames.append(key)
+            states.append({
+                "name": state.name,
+                "directions": state.directions,
+                "delays": state.delays,
+                "select": state.select,
+                "flags": state.flags,
+                "size": [image.width, image.height],
+                "frame": [frame_width, frame_height],
+                "frames": state_frames,
+            })
+        index["rsis"][rsi_name] = {
+            "version": rsi.version,
+            "size": rsi.size,
+            "license": rsi.license,
+            "copyright": rsi.copyright,
+            "states": states,
+        }
+
+    # Biggest first packs better
+    order = sorted(frames, key=lambda x: (frames[x].height, frames[x].width), reverse=True)
+    packers: List[MaxRectsPacker] = []
+    placements = {}
+    for key in order:
+        frame = frames[key]
+        for sheet, packer in enumerate(packers):
+            rect = packer.insert(frame.width + padding, frame.height + padding)
+            if rect is not None:
+                break
+        else:
+            packers.append(MaxRectsPacker(max_size, max_size))
+            sheet = len(packers) - 1
+            rect = packers[sheet].insert(frame.width + padding, frame.height + padding)
+        placements[key] = (sheet, rect)
+
+    sheets = [Image.new("RGBA", (next_power_of_two(x.used_width), next_power_of_two(x.used_height)))
+              for x in packers]
+    for key, (sheet, rect) in placements.items():
+        sheets[sheet].paste(frames[key], box=(rect.x, rect.y))
+    index["sheets"] = [{"size": [x.width, x.height]} for x in sheets]
+    # Swap the hashes for [sheet, x, y]
+    for rsi_index in index["rsis"].values():
+        for state in rsi_index["states"]:
+            state["frames"] = [[placements[x][0], placements[x][1].x, placements[x][1].y] for x in state["frames"]]
+    logger.info(f"Packed {len(frames)} unique frames into {len(sheets)} sheets")
+    return Atlas(sheets=sheets, index=index)
+
+
+def unpack_atlas(atlas: Atlas) -> Dict[str, RSI]:
+    """
+    Rebuilds the RSIs that went into pack_rsis
+    """
+    rsis = {}
+    for rsi_name, rsi_index in atlas.index["rsis"].items():
+        states = []
+        for state in rsi_index["states"]:
+            image = Image.new("RGBA", tuple(state["size"]))
+            frame_width, frame_height = state["frame"]
+            columns = state["size"][0] // frame_width
+            for i, (sheet, x, y) in enumerate(state["frames"]):
+                frame = atlas.sheets[sheet].crop((x, y, x + frame_width, y + frame_height))
+                image.paste(frame, box=((i % columns) * frame_width, (i // columns) * frame_height))
+            states.append(RSIState(
+                data=image,
+                name=state["name"],
+                directions=state["directions"],
+                delays=state["delays"],
+                select=state["select"],
+                flags=state["flags"],
+            ))
+        rsis[rsi_name] = RSI(
+            rsi_version=rsi_index["version"],
+            size=rsi_index["size"],
+            rsi_license=rsi_index["license"],
+            rsi_copyright=rsi_index["copyright"],
+            states=states,
+        )
+    return rsis
+
+
+def save_atlas(atlas: Atlas, directory: str, name: str = "atlas") -> None:
+    """
+    Writes <name>-<n>.png for each sheet and the <name>.json index next to them
+    """
+    os.makedirs(directory, exist_ok=True)
+    index = dict(atlas.index)
+    index["sheets"] = []
+    for i, sheet in enumerate(atlas.sheets):
+        file = f"{name}-{i}.png"
+        sheet.save(os.path.join(directory, file), format="PNG")
+        index["sheets"].append({"file": file, "size": [sheet.width, sheet.height]})
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        # No indentation, it's only for machines
+        json.dump(index, f, separators=(",", ":"))
+
+
+def load_atlas(directory: str, name: str = "atlas") -> Atlas:
+    with open(os.path.join(directory, f"{name}.json"), "r") as f:
+        index = json.load(f)
+    if index.get("version") != ATLAS_VERSION:
+        raise AttributeError(f"Unsupported atlas version {index.get('version')}")
+    sheets = []
+    for sheet in index["sheets"]:
+        with Image.open(os.path.join(directory, sheet["file"])) as image:
+            sheets.append(image.convert("RGBA"))
+    return Atlas(sheets=sheets, index=index)
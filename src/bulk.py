@@ -0,0 +1,145 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fnmatch import fnmatch
+from functools import partial
+from logging import Logger, getLogger
+from typing import List, NamedTuple, Optional
+import os
+import traceback
+
+from src.utils import convert_dmi_to_rsi, convert_dmi_to_many_rsi
+
+logger: Logger = getLogger(__name__)
+
+
+class TreeJob(NamedTuple):
+    source: str
+    target: str
+    # None means a single .rsi, otherwise it's the convert_dmi_to_many_rsi mode ("default" being mode=None)
+    many_mode: Optional[str] = None
+
+
+class TreeJobResult(NamedTuple):
+    job: TreeJob
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class TreeConversionSummary(NamedTuple):
+    results: List[TreeJobResult]
+
+    @property
+    def succeeded(self) -> List[TreeJobResult]:
+        return [x for x in self.results if x.ok]
+
+    @property
+    def failed(self) -> List[TreeJobResult]:
+        return [x for x in self.results if not x.ok]
+
+    def __str__(self) -> str:
+        lines = [f"Converted {len(self.succeeded)}/{len(self.results)} .dmi files"]
+        for result in self.failed:
+            lines.append(f"FAILED {result.job.source}: {result.error.strip().splitlines()[-1]}")
+        return "\n".join(lines)
+
+
+def parse_many_modes(values: List[str]) -> List[tuple]:
+    """
+    Parses GLOB=MODE strings from the command line
+    :param values: e.g. ["guns/*.dmi=guns", "walls/*.dmi=wall"]
+    :return: [(glob, mode)]
+    """
+    result = []
+    for value in values or []:
+        if "=" not in value:
+            raise AttributeError(f"Expected GLOB=MODE but got {value}")
+        pattern, mode = value.rsplit("=", 1)
+        result.append((pattern, mode))
+    return result
+
+
+def find_tree_jobs(source: str, output: str, many_modes: List[tuple] = None) -> List[TreeJob]:
+    """
+    Maps every .dmi under source to where it'll be written under output, keeping the relative layout
+    :param source: directory to walk
+    :param output: directory the .rsi files go into
+    :param many_modes: [(glob, mode)]; the first glob matching a .dmi's path relative to source means it gets
+    split with convert_dmi_to_many_rsi into a directory instead of becoming a single .rsi
+    :return: jobs sorted by source path
+    """
+    if not os.path.isdir(source):
+        raise NotADirectoryError(f"{source}")
+    jobs = []
+    for root, _, files in os.walk(source):
+        for file in files:
+            if not file.endswith(".dmi"):
+                continue
+            path = os.path.join(root, file)
+            relative = os.path.relpath(path, source)
+            relative_posix = relative.replace(os.sep, "/")
+            many_mode = next((mode for pattern, mode in many_modes or [] if fnmatch(relative_posix, pattern)), None)
+            if many_mode is None:
+                target = os.path.join(output, relative[:-len(".dmi")] + ".rsi")
+            else:
+                target = os.path.join(output, relative[:-len(".dmi")])
+            jobs.append(TreeJob(source=path, target=target, many_mode=many_mode))
+    jobs.sort(key=lambda x: x.source)
+    return jobs
+
+
+def convert_tree_job(job: TreeJob, cache=None, profile: str = "default") -> TreeJobResult:
+    """
+    Runs a single job; any exception is caught and returned so one bad .dmi doesn't take out the batch
+    :param cache: ConversionCache / cache directory
+    :param profile: png profile, see encode_png
+    """
+    try:
+        # Each job only ever writes inside its own target so the only shared bit is the parent directories
+        os.makedirs(os.path.dirname(job.target) or ".", exist_ok=True)
+        if job.many_mode is None:
+            convert_dmi_to_rsi(job.source, job.target, cache=cache, profile=profile)
+        else:
+            mode = None if job.many_mode == "default" else job.many_mode
+            convert_dmi_to_many_rsi(job.source, job.target, mode=mode, cache=cache, profile=profile)
+    except Exception:
+        return TreeJobResult(job=job, error=traceback.format_exc())
+    return TreeJobResult(job=job)
+
+
+def convert_tree(source: str, output: str, many_modes: List[tuple] = None, workers: int = None, cache=None,
+                 profile: str = "default") -> TreeConversionSummary:
+    """
+    Converts every .dmi under source into output across a process pool
+    :param source: directory to walk
+    :param output: directory to write to
+    :param many_modes: see find_tree_jobs
+    :param workers: process count; defaults to the cpu count. 1 runs everything in this process.
+    :param cache: ConversionCache / cache directory shared by every worker
+    :param profile: png profile, see encode_png
+    :return: TreeConversionSummary
+    """
+    jobs = find_tree_jobs(source, output, many_modes)
+    run_job = partial(convert_tree_job, cache=cache, profile=profile)
+    total = len(jobs)
+    results = []
+
+    def _log(result: TreeJobResult):
+        results.append(result)
+        status = "ok" if result.ok else "failed"
+        logger.info(f"[{len(results)}/{total}] {result.job.source} {status}")
+        if not result.ok:
+            logger.error(result.error)
+
+    if workers == 1 or total <= 1:
+        for job in jobs:
+            _log(run_job(job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                _log(future.result())
+
+    results.sort(key=lambda x: x.job.source)
+    return TreeConversionSummary(results=results)
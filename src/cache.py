@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from logging import Logger, getLogger
+from typing import List
+
+logger: Logger = getLogger(__name__)
+
+
+# Bump whenever a change means the same .dmi would convert to different output, which invalidates every entry
+CONVERTER_VERSION = "1"
+
+
+def data_bytes(data) -> bytes:
+    """
+    Gets the raw bytes of path / BytesIO / bytes input
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    elif isinstance(data, BytesIO):
+        return data.getvalue()
+    elif os.path.isfile(data):
+        with open(data, "rb") as f:
+            return f.read()
+    else:
+        raise AttributeError(f"Unable to get bytes for {type(data)}")
+
+
+def _place_file(source: str, target: str, link: bool) -> None:
+    if os.path.lexists(target):
+        os.remove(target)
+    if link:
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            # Different filesystem / not supported, just copy it
+            pass
+    shutil.copy2(source, target)
+
+
+def _copy_tree(source: str, target: str, names: List[str] = None, link: bool = False) -> None:
+    os.makedirs(target, exist_ok=True)
+    for name in names if names is not None else os.listdir(source):
+        source_path = os.path.join(source, name)
+        target_path = os.path.join(target, name)
+        if os.path.isdir(source_path):
+            _copy_tree(source_path, target_path, link=link)
+        else:
+            _place_file(source_path, target_path, link)
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+class ConversionCache:
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = None,
+                 link: bool = False,
+                 ):
+        """
+        On-disk cache of conversion output keyed by the hash of everything that went into it
+        :param directory: where entries are kept; safe to share between processes
+        :param max_bytes: once the cache is bigger than this the least recently used entries get evicted
+        :param link: hardlink files out of the cache on a hit rather than copying them. Faster but editing the output
+        in place will then also edit the cache entry.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.link = link
+        self.entries_directory = os.path.join(directory, "entries")
+        os.makedirs(self.entries_directory, exist_ok=True)
+
+    @staticmethod
+    def key(dmi_bytes: bytes, **params) -> str:
+        """
+        :param dmi_bytes: source .dmi
+        :param params: anything else that changes the output (mode, copyright, hashes of other inputs, etc.).
+        Must be json serializable.
+        """
+        digest = hashlib.sha256()
+        digest.update(CONVERTER_VERSION.encode())
+        digest.update(hashlib.sha256(dmi_bytes).digest())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.entries_directory, key)
+
+    def restore(self, key: str, target: str, clear: bool = False) -> bool:
+        """
+        Copies a cached entry's contents into target. Anything in target with the same name as something in the entry
+        gets removed first so nothing from an earlier conversion is left mixed in with it.
+        :param clear: empty target entirely first, for when all of it is the conversion's output (e.g. a single .rsi)
+        :return: False on a miss
+        """
+        entry = self._entry_path(key)
+        if not os.path.isdir(entry):
+            logger.debug(f"Cache miss for {key}")
+            return False
+        if clear and os.path.isdir(target):
+            shutil.rmtree(target)
+        else:
+            for name in os.listdir(entry):
+                path = os.path.join(target, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+        _copy_tree(entry, target, link=self.link)
+        # mtime is what LRU eviction goes off
+        os.utime(entry)
+        logger.info(f"Restored {target} from cache")
+        return True
+
+    def store(self, key: str, source: str, names: List[str] = None) -> None:
+        """
+        Adds the contents of source to the cache
+        :param names: only store these entries of source rather than everything in it
+        """
+        entry = self._entry_path(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+        # Build it off to the side then rename so other processes never see a partial entry
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.directory)
+        try:
+            _copy_tree(source, staging, names=names)
+            os.rename(staging, entry)
+        except OSError:
+            # Someone else stored the same key first
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        self.evict()
+
+    def size(self) -> int:
+        return _tree_size(self.entries_directory)
+
+    def evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        entries = []
+        total = 0
+        for name in os.listdir(self.entries_directory):
+            path = self._entry_path(name)
+            try:
+                size = _tree_size(path)
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted {path} from cache")
+
+
+def get_cache(cache) -> ConversionCache:
+    if cache is None or isinstance(cache, ConversionCache):
+        return cache
+    return ConversionCache(cache)
@@ -0,0 +1,130 @@
+from argparse import ArgumentParser
+from logging import INFO, basicConfig
+import os
+import sys
+
+from src.atlas import pack_rsis, save_atlas
+from src.bulk import convert_tree, parse_many_modes
+from src.cache import ConversionCache
+from src.corpus import generate_corpus
+from src import instrumentation
+from src.png import PNG_PROFILES
+from src.prototypes import generate_prototypes
+from src.rsi import RSI
+
+
+def _convert_tree(args) -> int:
+    cache = None
+    if args.cache:
+        cache = ConversionCache(args.cache, max_bytes=args.cache_size, link=args.cache_link)
+    if args.trace:
+        instrumentation.enable()
+    try:
+        summary = convert_tree(
+            args.source,
+            args.output,
+            many_modes=parse_many_modes(args.many),
+            workers=args.workers,
+            cache=cache,
+            profile=args.profile,
+        )
+    finally:
+        if args.trace:
+            instrumentation.disable().save(args.trace)
+    print(summary)
+    return 1 if summary.failed else 0
+
+
+def _atlas(args) -> int:
+    rsis = {os.path.basename(os.path.normpath(x)): RSI(x) for x in args.rsi}
+    atlas = pack_rsis(rsis, max_size=args.max_size, padding=args.padding)
+    save_atlas(atlas, args.output, name=args.name)
+    print(f"Packed {len(rsis)} .rsi files into {len(atlas.sheets)} sheets")
+    return 0
+
+
+def _generate_corpus(args) -> int:
+    paths = generate_corpus(
+        args.output,
+        files=args.files,
+        states=tuple(args.states),
+        directions=tuple(args.directions),
+        frames=tuple(args.frames),
+        size=(args.size, args.size),
+        seed=args.seed,
+    )
+    print(f"Generated {len(paths)} .dmi files")
+    return 0
+
+
+def _prototypes(args) -> int:
+    written = generate_prototypes(args.source, args.output, inspect_meta=args.meta, index_directory=args.index_dir)
+    for category, prototypes in written.items():
+        print(f"{category}: {len(prototypes)} prototypes")
+    return 0
+
+
+def build_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog="python -m src", description="Converts byond .dmi files to .rsi")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    convert_tree_parser = subparsers.add_parser("convert-tree", help="Convert every .dmi under a directory")
+    convert_tree_parser.add_argument("source", help="Directory of .dmi files")
+    convert_tree_parser.add_argument("output", help="Directory to write .rsi files to")
+    convert_tree_parser.add_argument("-j", "--workers", type=int, default=None,
+                                     help="Process count (defaults to the cpu count)")
+    convert_tree_parser.add_argument("--many", action="append", metavar="GLOB=MODE",
+                                     help="Split .dmi files matching GLOB into many .rsi files with MODE "
+                                          "(use 'default' for no mode). Can be repeated.")
+    convert_tree_parser.add_argument("--cache", metavar="DIR", help="Reuse output of unchanged .dmi files")
+    convert_tree_parser.add_argument("--cache-size", type=int, default=None, metavar="BYTES",
+                                     help="Evict least recently used cache entries past this size")
+    convert_tree_parser.add_argument("--cache-link", action="store_true",
+                                     help="Hardlink cached files into the output instead of copying them")
+    convert_tree_parser.add_argument("--profile", choices=PNG_PROFILES, default="default",
+                                     help="png output profile; small trades encode time for size")
+    convert_tree_parser.add_argument("--trace", metavar="PATH",
+                                     help="Record timings to PATH as a chrome trace (or JSON lines if it ends in "
+                                          ".jsonl). Only this process is traced so use -j 1 to see everything.")
+    convert_tree_parser.set_defaults(func=_convert_tree)
+
+    atlas_parser = subparsers.add_parser("atlas", help="Pack .rsi files into power of two atlas sheets")
+    atlas_parser.add_argument("output", help="Directory to write the sheets and index to")
+    atlas_parser.add_argument("rsi", nargs="+", help=".rsi directories / zips")
+    atlas_parser.add_argument("--name", default="atlas", help="Sheets are <name>-<n>.png and the index <name>.json")
+    atlas_parser.add_argument("--max-size", type=int, default=2048, help="Largest sheet width / height")
+    atlas_parser.add_argument("--padding", type=int, default=0, help="Transparent pixels between frames")
+    atlas_parser.set_defaults(func=_atlas)
+
+    corpus_parser = subparsers.add_parser("generate-corpus", help="Write seeded random .dmi files for stress testing")
+    corpus_parser.add_argument("output", help="Directory to write to")
+    corpus_parser.add_argument("--files", type=int, default=10)
+    corpus_parser.add_argument("--states", type=int, nargs=2, default=[10, 100], metavar=("MIN", "MAX"),
+                               help="States per file")
+    corpus_parser.add_argument("--directions", type=int, nargs="+", default=[1, 4],
+                               help="Direction counts to pick from")
+    corpus_parser.add_argument("--frames", type=int, nargs="+", default=[1], help="Frame counts to pick from")
+    corpus_parser.add_argument("--size", type=int, default=32, help="Icon width / height")
+    corpus_parser.add_argument("--seed", type=int, default=0)
+    corpus_parser.set_defaults(func=_generate_corpus)
+
+    prototypes_parser = subparsers.add_parser("prototypes", help="Generate entity prototypes for an .rsi tree")
+    prototypes_parser.add_argument("source", help="Directory of .rsi files, e.g. Resources/Textures")
+    prototypes_parser.add_argument("output", help="Directory to append <category>.yml files in")
+    prototypes_parser.add_argument("--meta", action="store_true",
+                                   help="Read each meta.json to pick the sprite state")
+    prototypes_parser.add_argument("--index-dir", metavar="DIR",
+                                   help="Keep the prototype ID indexes here rather than next to the YAML files")
+    prototypes_parser.set_defaults(func=_prototypes)
+    return parser
+
+
+def main(argv=None) -> int:
+    basicConfig(level=INFO, format="%(message)s")
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
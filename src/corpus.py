@@ -0,0 +1,105 @@
+import os
+import random
+from logging import Logger, getLogger
+from math import ceil, sqrt
+from typing import List, Sequence, Union
+
+from PIL import Image, ImageDraw
+
+from src.dmi import DMIState, write_dmi
+
+logger: Logger = getLogger(__name__)
+
+# Suffixes byond sheets tend to use, so the many-rsi modes get something to group
+NAME_SUFFIXES = ["", "-open", "-closed", "0", "1", "2", "-on", "-off", "-empty", "-20", "-30"]
+
+
+def _pick(rng: random.Random, value: Union[int, Sequence[int]]) -> int:
+    return value if isinstance(value, int) else rng.choice(list(value))
+
+
+def generate_state_image(rng: random.Random, count: int, size: tuple = (32, 32)) -> Image.Image:
+    """
+    A few random rectangles per frame so the output compresses about like real sprites rather than flat colour
+    :param count: frames (dirs * frames)
+    :return: image laid out like dmi_state_images
+    """
+    columns = ceil(sqrt(count))
+    image = Image.new("RGBA", (columns * size[0], ceil(count / columns) * size[1]))
+    draw = ImageDraw.Draw(image)
+    for i in range(count):
+        left, top = (i % columns) * size[0], (i // columns) * size[1]
+        for _ in range(rng.randint(1, 4)):
+            x0, x1 = sorted(rng.randrange(size[0]) for _ in range(2))
+            y0, y1 = sorted(rng.randrange(size[1]) for _ in range(2))
+            colour = (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.choice([128, 255]))
+            draw.rectangle((left + x0, top + y0, left + x1, top + y1), fill=colour)
+    return image
+
+
+def generate_states(count: int,
+                    directions: Union[int, Sequence[int]] = (1, 4),
+                    frames: Union[int, Sequence[int]] = 1,
+                    size: tuple = (32, 32),
+                    seed: int = 0,
+                    ) -> List[DMIState]:
+    """
+    Seeded random states; the same arguments always give the same states
+    :param count: state count
+    :param directions: direction count or choices for it, e.g. (1, 4, 8)
+    :param frames: frames per direction or choices for it
+    :param size: icon (width, height)
+    """
+    rng = random.Random(seed)
+    states = []
+    for i in range(count):
+        state_directions = _pick(rng, directions)
+        state_frames = _pick(rng, frames)
+        # Roughly 4 states per base name, like an object and its variants
+        name = f"object{i // 4}{rng.choice(NAME_SUFFIXES)}"
+        delay = [rng.choice([0.1, 0.2, 0.5, 1.0]) for _ in range(state_frames)] if state_frames > 1 else None
+        states.append(DMIState(
+            metadata={"name": name, "dirs": state_directions, "frames": state_frames, "delay": delay},
+            image=generate_state_image(rng, state_directions * state_frames, size),
+        ))
+    return states
+
+
+def generate_dmi(count: int,
+                 directions: Union[int, Sequence[int]] = (1, 4),
+                 frames: Union[int, Sequence[int]] = 1,
+                 size: tuple = (32, 32),
+                 seed: int = 0,
+                 ) -> bytes:
+    """
+    See generate_states
+    :return: .dmi bytes
+    """
+    return write_dmi(generate_states(count, directions, frames, size, seed), size)
+
+
+def generate_corpus(directory: str,
+                    files: int = 10,
+                    states: Union[int, Sequence[int]] = (10, 100),
+                    directions: Union[int, Sequence[int]] = (1, 4),
+                    frames: Union[int, Sequence[int]] = 1,
+                    size: tuple = (32, 32),
+                    seed: int = 0,
+                    ) -> List[str]:
+    """
+    Writes a tree of generated .dmi files for stress testing, e.g. with convert_tree
+    :param files: .dmi count; they're spread over a couple of sub directories
+    :param states: state count per file or (min, max) for it
+    :return: paths written
+    """
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        state_count = states if isinstance(states, int) else rng.randint(states[0], states[1])
+        path = os.path.join(directory, f"set{i % 3}", f"icons{i}.dmi")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(generate_dmi(state_count, directions, frames, size, seed=rng.randrange(2 ** 32)))
+        paths.append(path)
+    logger.info(f"Generated {len(paths)} .dmi files in {directory}")
+    return paths
@@ -0,0 +1,67 @@
+import json
+from collections import defaultdict
+from logging import Logger, getLogger
+from threading import Lock
+from typing import Dict, List, NamedTuple
+
+logger: Logger = getLogger(__name__)
+
+
+def dedupe_states(states: list) -> list:
+    """
+    Drops states that are exact repeats of an earlier one: same name, same pixels and same meta
+    :param states: RSIStates
+    :return: the first of each, in their original order
+    """
+    seen = set()
+    result = []
+    for state in states:
+        key = (state.name, state.content_hash, json.dumps(state.meta(), sort_keys=True))
+        if key in seen:
+            logger.debug(f"Dropping duplicate state {state.name}")
+            continue
+        seen.add(key)
+        result.append(state)
+    return result
+
+
+class DuplicateState(NamedTuple):
+    rsi: str
+    state: str
+
+
+class DuplicateReport:
+    def __init__(self):
+        """
+        Collects the states of every .rsi written during a conversion so identical pixels across them can be found
+        """
+        self._states: Dict[str, List[DuplicateState]] = defaultdict(list)
+        self._sizes: Dict[str, tuple] = {}
+        self._lock = Lock()
+
+    def add(self, rsi: str, states: list) -> None:
+        """
+        :param rsi: name of the .rsi they end up in
+        :param states: RSIStates / DMIStates
+        """
+        hashes = [(state.content_hash, state.name, state.image.size) for state in states if state.name]
+        with self._lock:
+            for content_hash, name, size in hashes:
+                self._states[content_hash].append(DuplicateState(rsi=rsi, state=name))
+                self._sizes[content_hash] = size
+
+    def duplicates(self) -> Dict[str, List[DuplicateState]]:
+        """
+        :return: content_hash -> every state with those pixels, only where there's more than one
+        """
+        with self._lock:
+            return {content_hash: list(states) for content_hash, states in self._states.items() if len(states) > 1}
+
+    def __str__(self) -> str:
+        duplicates = self.duplicates()
+        lines = [f"{sum(len(x) - 1 for x in duplicates.values())} duplicate states"]
+        for content_hash, states in sorted(duplicates.items(), key=lambda x: -len(x[1])):
+            width, height = self._sizes[content_hash]
+            names = ", ".join(f"{x.rsi}/{x.state}" for x in states)
+            lines.append(f"{content_hash[:12]} ({width}x{height}): {names}")
+        return "\n".join(lines)
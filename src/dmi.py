@@ -1,7 +1,18 @@
 from logging import Logger, getLogger
-from PIL import Image
-from src.internal_utils import handle_data_to_pil_image
+from PIL import Image, PngImagePlugin
+from io import BytesIO
+from src.instrumentation import count, span
+from src.internal_utils import handle_data_to_pil_image, pixel_hash
+from src.png import PNG_SIGNATURE, InvalidPNGException, read_ihdr, read_png_text
 from math import sqrt, ceil
+from functools import partial
+from bisect import bisect_left
+from typing import List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 logger: Logger = getLogger(__name__)
 
@@ -10,41 +21,96 @@ class InvalidMetadataException(Exception):
     pass
 
 
+SLICING_BACKENDS = ["pillow", "numpy"]
+
+
 # TODO: Add tests for all of the below and in the other files
 
 
 def is_png(png_bytes: bytes) -> bool:
-    if png_bytes[1:4] == b'PNG':
+    if png_bytes[0:8] == PNG_SIGNATURE:
         return True
     else:
         return False
 
 
-def validate_dmi(png_bytes: bytes) -> None:
-    if not is_png(png_bytes):
-        raise AttributeError
+def validate_dmi(png_bytes) -> None:
+    """
+    Checks the png signature and IHDR chunk (including its CRC). Only reads the header so it's cheap on big sheets.
+    :param png_bytes: path / bytes / BytesIO / mmap of .dmi
+    """
+    try:
+        read_ihdr(png_bytes)
+    except InvalidPNGException as e:
+        raise AttributeError(f"Invalid .dmi: {e}")
     return
 
 
 class DMI:
     def __init__(self,
                  data,
+                 lazy: bool = False,
+                 cache_states: bool = True,
+                 backend: str = "pillow",
                  ):
         """
         Class of a byond .dmi file
         :param data: path / BytesIO of .dmi. Thankfully we can extract all the data from its metadata
-        :param index: Specifies one item to pull out as a state
+        :param lazy: If True each state's image is only sliced out of the sheet the first time it's accessed
+        :param cache_states: If False lazy state images get re-sliced on every access rather than kept around
+        :param backend: one of SLICING_BACKENDS, see dmi_state_images
         """
-        self.image = handle_data_to_pil_image(data)
+        if backend not in SLICING_BACKENDS:
+            raise AttributeError(f"Unknown slicing backend {backend}")
+        with span("dmi.open"):
+            self.image = handle_data_to_pil_image(data)
         # Once we get self.image we're golden
         self.states = None
-        self.metadata = self._parse_metadata()
+        self.lazy = lazy
+        self.backend = backend
+        self._sheet = None
+        self._decoded = False
+        with span("dmi.parse_metadata"):
+            self.metadata = self._parse_metadata()
         self.states = []
-        index = 0
         for state in self.metadata.get("states"):
-            dmi_image = dmi_state_images(self.image, index, frames=state.get("frames"), directions=state.get("dirs"))
-            index += state.get("frames", 0) * state.get("dirs", 1)
-            self.states.append(DMIState(metadata=state, image=dmi_image))
+            loader = partial(self._state_image, state["offset"], frames=state["frames"], directions=state["dirs"])
+            if lazy:
+                self.states.append(DMIState(metadata=state, loader=loader, cache_image=cache_states))
+            else:
+                self.states.append(DMIState(metadata=state, image=loader()))
+        count("dmi.states", len(self.states))
+        count("dmi.frames", self.metadata["frames"])
+        self.reindex()
+
+    def reindex(self) -> None:
+        """
+        Rebuilds the name lookups; only needed if self.states gets changed after loading
+        """
+        # First one wins for duplicate names, same as list.index did
+        self._states_by_name = {}
+        for state in self.states:
+            self._states_by_name.setdefault(state.name, state)
+        self._sorted_names = sorted((state.name or "", position) for position, state in enumerate(self.states))
+
+    def get_state(self, name: str) -> Optional["DMIState"]:
+        """
+        :return: the first state called name or None
+        """
+        return self._states_by_name.get(name)
+
+    def states_with_prefix(self, prefix: str) -> List["DMIState"]:
+        """
+        :return: every state whose name starts with prefix, in sheet order
+        """
+        positions = []
+        # Names sharing a prefix are next to each other once sorted
+        for name, position in self._sorted_names[bisect_left(self._sorted_names, (prefix, -1)):]:
+            if not name.startswith(prefix):
+                break
+            positions.append(position)
+        positions.sort()
+        return [self.states[x] for x in positions]
 
     @property
     def width(self) -> int:
@@ -54,52 +120,180 @@ class DMI:
     def height(self) -> int:
         return self.metadata.get("height")
 
+    @property
+    def sheet(self):
+        """
+        Sheet as a (rows, columns, height, width, 4) array; only built for the numpy backend
+        """
+        if self._sheet is None:
+            self._sheet = sheet_array(self.image, (self.width, self.height))
+        return self._sheet
+
+    def _state_image(self, index: int, frames: int, directions: int = 1) -> Image.Image:
+        if not self._decoded:
+            # Pillow only decodes on first use so it'd otherwise get counted against the first slice
+            with span("png.decode", width=self.image.width, height=self.image.height):
+                self.image.load()
+            self._decoded = True
+        with span("dmi.slice", frames=frames * directions):
+            if self.backend == "numpy":
+                return dmi_state_images(self.image, index, frames=frames, directions=directions,
+                                        size=(self.width, self.height), backend="numpy", sheet=self.sheet)
+            return dmi_state_images(self.image, index, frames=frames, directions=directions,
+                                    size=(self.width, self.height))
+
     def _process_file(self):
         pass
 
     def _parse_metadata(self):
-        # PyYaml was giving me the shits so custom parse - famous last words
-        base_metadata: str = self.image.info.get("Description")
-        split_metadata = base_metadata.splitlines()
-        # Start row is # BEGIN DMI and end row is # END DMI
-        # Parse version etc first
-        output = {
-            "version": split_metadata[1].split(" = ")[1],
-            "width": int(split_metadata[2].split(" = ")[1]),
-            "height": int(split_metadata[2].split(" = ")[1]),
-            "states": []
-        }
-        for line in base_metadata.splitlines()[4:-1]:
-            # Should only be raised if coding is bad, which it is
-            if len(line.split(" = ")) > 2:
-                logger.critical("Unable to parse metadata for .dmi")
-                raise InvalidMetadataException("Unable to parse metadata for .dmi")
-            # version and state
-            elif line[0] != "\t":
-                description = line.split(" = ")[-1].replace('"', "")
-                output["states"].append({"name": description})
+        return parse_dmi_metadata(self.image.info.get("Description"))
+
+
+# Keys byond writes, anything else is kept as-is
+HEADER_KEYS = {"version": str, "width": int, "height": int}
+STATE_INT_KEYS = {"dirs", "frames", "loop", "rewind", "movement"}
+STATE_LIST_KEYS = {"delay", "hotspot"}
+
+
+def _metadata_value(value: str):
+    """
+    Best guess for keys we don't know: ints, then comma separated numbers, otherwise the raw string (quotes and all so
+    it gets written back the same)
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        numbers = [float(x) for x in value.split(",")]
+    except ValueError:
+        return value
+    if "," not in value:
+        return numbers[0]
+    return numbers
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+    if "\\" in value:
+        value = value.replace('\\"', '"').replace("\\\\", "\\")
+    return value
+
+
+def parse_dmi_metadata(base_metadata: str) -> dict:
+    """
+    Single pass over the Description byond writes into a .dmi
+    :param base_metadata: Description text
+    :return: {"version", "width", "height", "frames", "states"}. Each state is a dict of its keys (delay in seconds
+    rather than ticks) plus "offset", the sheet index of its first frame. frames is the total across every state.
+    """
+    if not base_metadata:
+        logger.critical("No Description metadata found for .dmi")
+        raise InvalidMetadataException("No Description metadata found for .dmi")
+    # byond leaves width / height out when they're the default
+    output = {"version": None, "width": 32, "height": 32, "frames": 0, "states": []}
+    states = output["states"]
+    state = None
+    offset = 0
+    for line in base_metadata.splitlines():
+        # Covers # BEGIN DMI / # END DMI too
+        if not line or line[0] == "#" or line.isspace():
+            continue
+        # Only the first = counts so state names can have them
+        key, separator, value = line.partition("=")
+        if not separator:
+            logger.critical(f"Unable to parse .dmi metadata line {line}")
+            raise InvalidMetadataException(f"Unable to parse .dmi metadata line {line}")
+        key = key.strip()
+        value = value.strip()
+        try:
+            if key == "state":
+                if state is not None:
+                    offset += state["frames"] * state["dirs"]
+                state = {"name": _unquote(value), "dirs": 1, "frames": 1, "offset": offset}
+                states.append(state)
+            elif state is None:
+                output[key] = HEADER_KEYS[key](value) if key in HEADER_KEYS else _metadata_value(value)
+            elif key in STATE_INT_KEYS:
+                state[key] = int(value)
+            elif key == "delay":
+                # ticks -> seconds
+                state[key] = [float(x) / 10 for x in value.split(",")]
+            elif key in STATE_LIST_KEYS:
+                state[key] = [int(x) for x in value.split(",")]
             else:
-                description = line.split(" = ")[0][1:]
-                value = line.split(" = ")[1]
-                # width / height / dirs / frames
-                if len(value) == len([c for c in value if c.isdigit()]):
-                    value = int(value)
-                elif "," in value:
-                    value = [float(d) for d in value.split(",")]
-                else:
-                    logger.critical(f"Unable to find value format for {value}")
-                    raise InvalidMetadataException(f"Unable to find value format for {value}")
+                state[key] = _metadata_value(value)
+        except ValueError:
+            logger.critical(f"Unable to find value format for {key} = {value}")
+            raise InvalidMetadataException(f"Unable to find value format for {key} = {value}")
+    if state is not None:
+        offset += state["frames"] * state["dirs"]
+    output["frames"] = offset
+    return output
 
-                if description == "delay":
-                    value = [x / 10 for x in value]
 
-                output["states"][-1].update({description: value})
+def read_dmi_metadata(data) -> dict:
+    """
+    Reads the metadata of a .dmi without decoding any of its pixel data
+    :param data: path / bytes / BytesIO / mmap of .dmi
+    :return: same dict as DMI.metadata
+    """
+    description = read_png_text(data, "Description")
+    if description is None:
+        logger.critical("No Description metadata found for .dmi")
+        raise InvalidMetadataException("No Description metadata found for .dmi")
+    return parse_dmi_metadata(description)
 
-        return output
 
+def sheet_array(image: Image.Image, size: tuple = (32, 32)):
+    """
+    Views a .dmi sheet as a grid of frames; any partial row / column at the edges is dropped
+    :param image: whole .dmi image
+    :param size: frame (width, height)
+    :return: uint8 array of shape (rows, columns, height, width, 4). This is a strided view over the decoded sheet
+    so building it costs a single conversion of the image and no per-frame copies.
+    """
+    if numpy is None:
+        raise ImportError("numpy is required for the numpy slicing backend")
+    columns = image.width // size[0]
+    rows = image.height // size[1]
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    pixels = numpy.asarray(image)[:rows * size[1], :columns * size[0]]
+    return pixels.reshape(rows, size[1], columns, size[0], 4).swapaxes(1, 2)
 
-def dmi_state_images(image: Image.Image, index: int, frames: int, directions: int = 1, size: tuple = (32, 32)) \
-        -> Image.Image:
+
+def _numpy_state_images(sheet, index: int, image_count: int) -> Image.Image:
+    rows, columns, height, width = sheet.shape[0:4]
+    column_count = ceil(sqrt(image_count))
+    row_count = ceil(image_count / column_count)
+    # Anything past the end of the sheet or filling out the last row is left transparent like Image.crop does
+    frames = numpy.zeros((row_count * column_count, height, width, 4), dtype=numpy.uint8)
+    frame_indices = numpy.arange(index, min(index + image_count, rows * columns))
+    # Single gather of every frame in the state
+    frames[0:len(frame_indices)] = sheet[frame_indices // columns, frame_indices % columns]
+    atlas = frames.reshape(row_count, column_count, height, width, 4).swapaxes(1, 2)
+    return Image.fromarray(atlas.reshape(row_count * height, column_count * width, 4))
+
+
+def dmi_state_images(image: Image.Image, index: int, frames: int, directions: int = 1, size: tuple = (32, 32),
+                     backend: str = "pillow", sheet=None) -> Image.Image:
+    """
+    Slices a state's frames out of the sheet and lays them out as an RSI state image
+    :param image: whole .dmi image
+    :param index: index of the state's first frame on the sheet
+    :param frames: frames per direction
+    :param directions: direction count
+    :param size: frame (width, height)
+    :param backend: "pillow" crops and pastes frame by frame; "numpy" gathers every frame in one go
+    :param sheet: pre-built sheet_array to avoid converting the sheet on every call with the numpy backend
+    :return: RGBA image
+    """
+    if backend == "numpy":
+        if sheet is None:
+            sheet = sheet_array(image, size)
+        return _numpy_state_images(sheet, index, frames * directions)
     image_columns = int(image.width / size[0])
     image_count = frames * directions
     # TODO: Verify image size
@@ -120,20 +314,8 @@ def dmi_state_images(image: Image.Image, index: int, frames: int, directions: in
     target_image_size = (column_count * size[0], ceil(image_count / column_count) * size[1])
     target_image = Image.new("RGBA", size=target_image_size)
     for idx, frame in enumerate(individual_frames):
-        box = (
-            (idx * size[0]) % target_image_size[0],
-            int(idx / target_image_size[0] * size[1]) * size[1],
-            (idx * size[0]) % target_image_size[0] + size[0],
-            int(idx / target_image_size[0] * size[1]) * size[1] + size[1],
-        )
-        # This here mainly if I'm being dumb
-        if box[1] > target_image_size[0]:
-            logger.critical(f"Target X {box[1]} outside bounds of image {target_image_size[0]}")
-            raise ValueError(f"Target X {box[1]} outside bounds of image {target_image_size[0]}")
-        if box[3] > target_image_size[1]:
-            logger.critical(f"Target Y {box[3]} outside bounds of image {target_image_size[1]}")
-            raise ValueError(f"Target Y {box[3]} outside bounds of image {target_image_size[1]}")
-        target_image.paste(frame, box)
+        x, y = (idx % column_count) * size[0], (idx // column_count) * size[1]
+        target_image.paste(frame, (x, y, x + size[0], y + size[1]))
 
     return target_image
 
@@ -142,13 +324,125 @@ class DMIState:
     def __init__(self,
                  metadata: dict = None,
                  image: Image.Image = None,
+                 loader=None,
+                 cache_image: bool = True,
                  ):
+        """
+        Single state of a .dmi
+        :param metadata: state dict as parsed from the .dmi description
+        :param image: already sliced image for the state
+        :param loader: callable returning the image, used if image isn't supplied so slicing only happens on access
+        :param cache_image: whether to hold onto the image returned by loader
+        """
         if metadata:
             self.name = metadata.get("name")
             self.dirs = metadata.get("dirs")
             self.frames = metadata.get("frames")
             self.delay = metadata.get("delay")
-            self.image = image
+            # Everything else byond had for it (loop, rewind, hotspot...) so write_dmi can put it back
+            self.metadata = metadata
+            self._loader = loader
+            self.cache_image = cache_image
+            self._image = image
+            self._content_hash = None
         else:
             logger.critical(f"No metadata provided for DMIState")
             raise AttributeError
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None and self._loader is not None:
+            image = self._loader()
+            if not self.cache_image:
+                return image
+            self._image = image
+        return self._image
+
+    @image.setter
+    def image(self, value: Image.Image) -> None:
+        self._image = value
+        self._content_hash = None
+
+    @property
+    def content_hash(self) -> str:
+        """
+        pixel_hash of the state's image; kept after release as re-slicing gives the same pixels
+        """
+        if self._content_hash is None:
+            self._content_hash = pixel_hash(self.image)
+        return self._content_hash
+
+    @property
+    def loaded(self) -> bool:
+        return self._image is not None
+
+    def release(self) -> None:
+        """
+        Drops the cached image so it can be garbage collected; it'll get re-sliced next time it's accessed.
+        Does nothing for states that were given an image directly as there's nothing to rebuild it from.
+        """
+        if self._loader is not None:
+            self._image = None
+
+
+# Written separately by dmi_description or not at all
+_DESCRIPTION_SKIP = {"name", "dirs", "frames", "delay", "offset"}
+
+
+def dmi_description(states: List[dict], size: tuple = (32, 32), version: str = "4.0") -> str:
+    """
+    Builds the Description text byond keeps in a .dmi
+    :param states: state dicts like DMI.metadata["states"]; delay is in seconds like the parser gives back
+    :param size: icon (width, height)
+    """
+    lines = ["# BEGIN DMI", f"version = {version}", f"\twidth = {size[0]}", f"\theight = {size[1]}"]
+    for state in states:
+        name = (state.get("name") or "").replace("\\", "\\\\").replace('"', '\\"')
+        lines.append(f'state = "{name}"')
+        lines.append(f"\tdirs = {state.get('dirs') or 1}")
+        lines.append(f"\tframes = {state.get('frames') or 1}")
+        # byond only writes delays for animated states
+        if (state.get("frames") or 1) > 1 and state.get("delay"):
+            lines.append(f"\tdelay = {','.join(f'{x * 10:g}' for x in state['delay'])}")
+        for key, value in state.items():
+            if key in _DESCRIPTION_SKIP or value is None:
+                continue
+            if isinstance(value, list):
+                value = ",".join(f"{x:g}" for x in value)
+            elif isinstance(value, float):
+                value = f"{value:g}"
+            lines.append(f"\t{key} = {value}")
+    lines.append("# END DMI")
+    return "\n".join(lines) + "\n"
+
+
+def write_dmi(states: List["DMIState"], size: tuple = (32, 32)) -> bytes:
+    """
+    Builds a .dmi; the inverse of DMI so DMI(write_dmi(dmi.states, size)) gives back the same states
+    :param states: DMIStates, their images laid out the same way dmi_state_images does
+    :param size: icon (width, height)
+    :return: png bytes
+    """
+    counts = [(state.frames or 1) * (state.dirs or 1) for state in states]
+    total = max(sum(counts), 1)
+    columns = ceil(sqrt(total))
+    rows = ceil(total / columns)
+    sheet = Image.new("RGBA", (columns * size[0], rows * size[1]))
+    index = 0
+    for state, frame_count in zip(states, counts):
+        image = state.image
+        state_columns = max(image.width // size[0], 1)
+        for i in range(frame_count):
+            x, y = (i % state_columns) * size[0], (i // state_columns) * size[1]
+            frame = image.crop((x, y, x + size[0], y + size[1]))
+            sheet.paste(frame, ((index % columns) * size[0], (index // columns) * size[1]))
+            index += 1
+    description = dmi_description(
+        [{**x.metadata, "name": x.name, "dirs": x.dirs, "frames": x.frames, "delay": x.delay} for x in states], size
+    )
+    info = PngImagePlugin.PngInfo()
+    # byond compresses it too
+    info.add_text("Description", description, zip=True)
+    buffer = BytesIO()
+    sheet.save(buffer, format="PNG", pnginfo=info)
+    return buffer.getvalue()
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger, getLogger
+from threading import Lock
+from typing import Dict, List, Optional
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from src.instrumentation import count, span
+
+logger: Logger = getLogger(__name__)
+
+
+class Fetcher:
+    def __init__(self,
+                 cache_dir: str = None,
+                 pool_size: int = 10,
+                 timeout: float = 30,
+                 session: Session = None,
+                 ):
+        """
+        Shared HTTP client so batch imports reuse connections and don't re-download unchanged files
+        :param cache_dir: keep responses here and revalidate them with ETag / If-Modified-Since; None disables caching
+        :param pool_size: connections kept open per host
+        :param timeout: seconds per request
+        :param session: use this session instead of making one
+        """
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        if session is None:
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.pool_size = pool_size
+        # fetched / not_modified (served from the cache) so callers can see what actually went over the wire
+        self.stats = Counter()
+        self._stats_lock = Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _cache_paths(self, url: str) -> tuple:
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.body"), os.path.join(self.cache_dir, f"{name}.json")
+
+    def _read_cache(self, url: str) -> Optional[tuple]:
+        if not self.cache_dir:
+            return None
+        body_path, meta_path = self._cache_paths(url)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fetch-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _write_cache(self, url: str, body: bytes, headers) -> None:
+        if not self.cache_dir:
+            return
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        if not meta["etag"] and not meta["last_modified"]:
+            # Nothing to revalidate against
+            return
+        body_path, meta_path = self._cache_paths(url)
+        # Body first so the metadata never points at a missing / old body
+        self._write_atomic(body_path, body)
+        self._write_atomic(meta_path, json.dumps(meta).encode())
+
+    def get(self, url: str) -> bytes:
+        """
+        Downloads url, using the cached copy if the server says it's not modified
+        :param url: url
+        :return: response body
+        """
+        headers = {}
+        cached = self._read_cache(url)
+        if cached:
+            _, meta = cached
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        with span("fetch", url=url) as fetch_span:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            fetch_span.set("status", response.status_code)
+            if response.status_code == 304 and cached:
+                logger.debug(f"{url} not modified")
+                self._count("not_modified")
+                return cached[0]
+            response.raise_for_status()
+            body = response.content
+        self._count("fetched")
+        count("fetch.bytes", len(body))
+        self._write_cache(url, body, response.headers)
+        return body
+
+    def get_many(self, urls: List[str], workers: int = None) -> Dict[str, bytes]:
+        """
+        Downloads several urls at once
+        :param urls: duplicate urls only get fetched once
+        :param workers: concurrent downloads, defaults to pool_size
+        :return: url -> body; the first failure gets raised
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=workers or self.pool_size) as executor:
+            bodies = executor.map(self.get, unique_urls)
+            return dict(zip(unique_urls, bodies))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_default_fetcher: Optional[Fetcher] = None
+_default_fetcher_lock = Lock()
+
+
+def get_default_fetcher() -> Fetcher:
+    """
+    Fetcher shared by the url conversion functions. Caches to DMI_TO_RSI_CACHE if it's set.
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher(cache_dir=os.environ.get("DMI_TO_RSI_CACHE"))
+        return _default_fetcher
+
+
+def set_default_fetcher(fetcher: Optional[Fetcher]) -> None:
+    global _default_fetcher
+    with _default_fetcher_lock:
+        _default_fetcher = fetcher
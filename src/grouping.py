@@ -0,0 +1,199 @@
+from logging import Logger, getLogger
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+logger: Logger = getLogger(__name__)
+
+
+class GroupingRule(NamedTuple):
+    """
+    How convert_dmi_to_many_rsi splits a .dmi's states into separate .rsi files for a mode
+    """
+    # state name -> the groups it suggests. If no state suggests anything every name becomes its own group.
+    group_keys: Callable[[str], Iterable[str]]
+    # state name -> the group it belongs to. None means it belongs to every group its name starts with.
+    member_key: Optional[Callable[[str], str]] = None
+    # state name -> name inside the .rsi
+    rename: Optional[Callable[[str], str]] = None
+    # Orders a group's states (anything with .name) before they get numbered as steps
+    order: Optional[Callable[[list], list]] = None
+    # Everything goes into one group named by the caller
+    single: bool = False
+
+
+def strip_numbers(name: str) -> str:
+    return "".join([c for c in name if not c.isdigit() and c not in ["-"]])
+
+
+def _no_keys(name: str) -> List[str]:
+    return []
+
+
+def _default_keys(name: str) -> List[str]:
+    return [strip_numbers(name)] if name and strip_numbers(name) else []
+
+
+def _gun_keys(name: str) -> List[str]:
+    if not name:
+        return []
+    split = name.split("-")
+    return ["-".join(split[0:-1]) if len(split) > 1 else name]
+
+
+def _mag_keys(name: str) -> List[str]:
+    keys = []
+    if name and name[-1].isdigit():
+        keys.append("-".join(name.split("-")[0:-1]))
+    if len([c for c in name if not c.isdigit()]) == len(name):
+        keys.append(name)
+    return keys
+
+
+def _mag_member(name: str) -> str:
+    return "".join(name.split("-")[0:-1])
+
+
+def _ammo_box_keys(name: str) -> List[str]:
+    if not name:
+        return []
+    if name.count("-") >= 2:
+        return ["-".join(name.split("-")[0:-1])]
+    if name.count("-") <= 1 and name.split("-")[-1].isdigit():
+        return [name.split("-")[0]]
+    return []
+
+
+def _ammo_box_member(name: str) -> str:
+    # If 2 dashes it's probs box38-rubber-30
+    # If not it's probs box38-30
+    if name.count("-") == 2:
+        return "-".join(name.split("-")[0:-1])
+    elif name.count("-") == 1 and name.split("-")[-1].isdigit():
+        return name.split("-")[0]
+    return name
+
+
+def _exact_keys(name: str) -> List[str]:
+    return [name]
+
+
+def _exact_member(name: str) -> str:
+    return name
+
+
+DOOR_NAMES = {
+    "door_closed": "closed",
+    "door_closing": "closing_unlit",
+    "door_closing_stat": "closing",
+    "door_deny": "deny",
+    "door_locked": "locked",
+    "door_open": "open",
+    "door_opening": "opening_unlit",
+    "door_opening_stat": "opening",
+    "door_spark": "spark",
+    "o_door_closing": "panel_closing",
+    "o_door_opening": "panel_opening",
+}
+
+
+def _door_name(name: str) -> str:
+    return DOOR_NAMES.get(name, name)
+
+
+def _suit_name(name: str) -> str:
+    return "equipped-OUTERCLOTHING"
+
+
+def order_by_name(states: list) -> list:
+    return sorted(states, key=lambda x: x.name)
+
+
+def order_gun_states(states: list) -> list:
+    """
+    Try sorting by: Ammo account, full / empty, slide, loaded, etc.
+    """
+    sorted_states = order_by_name(states)
+    # AK, AK-20, AK-30 or saber, saber-full
+    if len([x for x in sorted_states if "-" in x.name]) == len(sorted_states) - 1:
+        new_states = []
+        # First
+        new_states.append([x for x in sorted_states if "-" not in x.name][0])
+        # Rest
+        new_states.extend(sorted([x for x in sorted_states if "-" in x.name],
+                                 key=lambda x:
+                                 int(x.name.split("-")[-1]) if x.name.split("-")[-1].isdigit() else
+                                 x.name.split("-")[-1]))
+        sorted_states = new_states
+    # taser, taser0, taser25
+    if len([x for x in sorted_states if "-" not in x.name and x.name[-1].isdigit()]) == \
+            len(sorted_states) - 1:
+        new_states = []
+        # First
+        new_states.extend([x for x in sorted_states if not [c for c in x.name if c.isdigit()]][0:1])
+        # Rest
+        new_states.extend(sorted([x for x in sorted_states if [c for c in x.name if c.isdigit()]],
+                                 key=lambda x: "".join([c for c in x.name if c.isdigit()])))
+        sorted_states = new_states
+    return sorted_states
+
+
+def order_ammo_box_states(states: list) -> list:
+    # Sort by ammo acount at the box
+    return sorted(order_by_name(states),
+                  key=lambda x: int(x.name.split("-")[-1]) if x.name.split("-")[-1].isdigit() else -1)
+
+
+# Anything not in here gets DEFAULT_RULE
+GROUPING_RULES: Dict[Optional[str], GroupingRule] = {
+    None: GroupingRule(group_keys=_default_keys),
+    "wall": GroupingRule(group_keys=_default_keys),
+    "door": GroupingRule(group_keys=_no_keys, rename=_door_name, single=True),
+    "guns": GroupingRule(group_keys=_gun_keys, order=order_gun_states),
+    "mags": GroupingRule(group_keys=_mag_keys, member_key=_mag_member, order=order_by_name),
+    "ammo_boxes": GroupingRule(group_keys=_ammo_box_keys, member_key=_ammo_box_member, order=order_ammo_box_states),
+    "food": GroupingRule(group_keys=_exact_keys, member_key=_exact_member),
+    "suits": GroupingRule(group_keys=_exact_keys, member_key=_exact_member, rename=_suit_name),
+}
+
+# Every state name is a group and gets everything starting with it
+DEFAULT_RULE = GroupingRule(group_keys=_no_keys)
+
+
+def register_grouping_rule(mode: str, rule: GroupingRule) -> None:
+    GROUPING_RULES[mode] = rule
+
+
+def get_grouping_rule(mode: Optional[str]) -> GroupingRule:
+    return GROUPING_RULES.get(mode, DEFAULT_RULE)
+
+
+def group_states(states: list, rule: GroupingRule, single_group: str = None) -> Dict[str, list]:
+    """
+    Splits states into groups in a single pass over them
+    :param states: anything with .name, e.g. DMIState
+    :param rule: GroupingRule
+    :param single_group: group name for rules with single set
+    :return: group -> its states in their original order. Groups nobody matched are still in there (empty).
+    """
+    if rule.single:
+        return {single_group: list(states)}
+    keys = []
+    for state in states:
+        keys.extend(rule.group_keys(state.name))
+    if not keys:
+        keys = [x.name for x in states]
+    groups = {x: [] for x in keys if x}
+    if rule.member_key is not None:
+        for state in states:
+            members = groups.get(rule.member_key(state.name))
+            if members is not None:
+                members.append(state)
+    else:
+        for state in states:
+            name = state.name or ""
+            # A state belongs to every group that's a prefix of its name
+            for end in range(1, len(name) + 1):
+                members = groups.get(name[:end])
+                if members is not None:
+                    members.append(state)
+    logger.debug(f"Grouped {len(states)} states into {len(groups)} groups")
+    return groups
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+from functools import wraps
+from logging import Logger, getLogger
+from time import perf_counter_ns
+from typing import Dict, List, NamedTuple, Optional
+
+logger: Logger = getLogger(__name__)
+
+
+class SpanRecord(NamedTuple):
+    name: str
+    # ns since the recorder started
+    start: int
+    duration: int
+    pid: int
+    tid: int
+    args: dict
+
+
+class _Span:
+    __slots__ = ("_recorder", "name", "args", "_start")
+
+    def __init__(self, recorder: "Recorder", name: str, args: dict):
+        self._recorder = recorder
+        self.name = name
+        self.args = args
+        self._start = 0
+
+    def set(self, key: str, value) -> None:
+        """
+        Attaches something only known part way through, e.g. bytes written
+        """
+        self.args[key] = value
+
+    def __enter__(self) -> "_Span":
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self._recorder.record(SpanRecord(
+            name=self.name,
+            start=self._start - self._recorder.origin,
+            duration=end - self._start,
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+            args=self.args,
+        ))
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Recorder:
+    def __init__(self):
+        """
+        Collects spans and counters while enabled; safe to use from several threads
+        """
+        self.origin = perf_counter_ns()
+        self.spans: List[SpanRecord] = []
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, span: SpanRecord) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        :return: span name -> {"count", "total_ms", "max_ms"}, slowest total first
+        """
+        totals = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = totals[span.name]
+            total["count"] += 1
+            total["total_ms"] += span.duration / 1e6
+            total["max_ms"] = max(total["max_ms"], span.duration / 1e6)
+        return dict(sorted(totals.items(), key=lambda x: -x[1]["total_ms"]))
+
+    def to_json_lines(self, path: str) -> None:
+        """
+        A line per span then a line per counter
+        """
+        with self._lock:
+            spans, counters = list(self.spans), dict(self.counters)
+        with open(path, "w") as f:
+            for span in spans:
+                f.write(json.dumps({"type": "span", **span._asdict()}, default=str) + "\n")
+            for name, value in counters.items():
+                f.write(json.dumps({"type": "counter", "name": name, "value": value}) + "\n")
+
+    def to_chrome_trace(self, path: str) -> None:
+        """
+        Trace Event Format, opens in chrome://tracing or https://ui.perfetto.dev
+        """
+        with self._lock:
+            spans, counters = list(self.spans), dict(self.counters)
+        events = [{
+            "name": span.name,
+            "cat": span.name.split(".")[0],
+            "ph": "X",
+            "ts": span.start / 1000,
+            "dur": span.duration / 1000,
+            "pid": span.pid,
+            "tid": span.tid,
+            "args": span.args,
+        } for span in spans]
+        if counters:
+            end = max((x.start + x.duration for x in spans), default=0)
+            events.append({"name": "counters", "ph": "C", "ts": end / 1000, "pid": os.getpid(), "args": counters})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def save(self, path: str) -> None:
+        """
+        .jsonl gets JSON lines, anything else a chrome trace
+        """
+        if path.endswith(".jsonl"):
+            self.to_json_lines(path)
+        else:
+            self.to_chrome_trace(path)
+
+
+# Spans and counters are no-ops until enable() is called; a disabled span() is a global lookup and handing back the
+# shared NULL_SPAN so leaving them in hot paths is fine
+_recorder: Optional[Recorder] = None
+
+
+def enable(recorder: Recorder = None) -> Recorder:
+    """
+    Starts recording for the whole process
+    :param recorder: carry on with an existing one
+    """
+    global _recorder
+    _recorder = recorder or Recorder()
+    return _recorder
+
+
+def disable() -> Optional[Recorder]:
+    """
+    :return: whatever was being recorded into
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def get_recorder() -> Optional[Recorder]:
+    return _recorder
+
+
+def span(name: str, **args):
+    """
+    with span("png.encode", state=name) as s: ...; s.set("bytes", len(data))
+    """
+    recorder = _recorder
+    if recorder is None:
+        return NULL_SPAN
+    return _Span(recorder, name, args)
+
+
+def count(name: str, value: int = 1) -> None:
+    recorder = _recorder
+    if recorder is not None:
+        recorder.add(name, value)
+
+
+def instrumented(name: str):
+    """
+    Decorator wrapping every call of a function in a span
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
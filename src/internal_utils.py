@@ -1,8 +1,13 @@
+import hashlib
 import os
+from collections import OrderedDict
 from io import BytesIO, StringIO
+from threading import Lock
 
 from PIL import Image
 
+from src.png import InvalidPNGException, read_ihdr
+
 from logging import Logger, getLogger
 
 logger: Logger = getLogger(__name__)
@@ -11,27 +16,14 @@ logger: Logger = getLogger(__name__)
 def png_dimensions(png_bytes) -> tuple:
     """
     Reads png bytes and gets (width, height)
-    :param png_bytes: png bytes
+    :param png_bytes: png bytes / BytesIO / path
     :return:
     """
-    width = None
-    height = None
-    last_four_bytes = [0, 0, 0, 0]
-    if isinstance(png_bytes, BytesIO):
-        png_bytes.seek(0)
-        png_bytes = png_bytes.read()
-    for idx, b in enumerate(png_bytes):
-        last_four_bytes.pop(0)
-        last_four_bytes.append(b)
-        if ["I", "H", "D", "R"] == [str(chr(x)) for x in last_four_bytes]:
-            width = png_bytes[idx + 1: idx + 5]
-            width = int.from_bytes(width, byteorder="big")
-            height = png_bytes[idx + 5: idx + 9]
-            height = int.from_bytes(height, byteorder="big")
-    dimensions = (width, height)
-    if width is None or height is None:
-        raise Exception("Unable to get dimensions from png")
-    return dimensions
+    try:
+        ihdr = read_ihdr(png_bytes)
+    except InvalidPNGException as e:
+        raise Exception(f"Unable to get dimensions from png: {e}")
+    return ihdr.width, ihdr.height
 
 
 def handle_data_to_pil_image(data) -> Image.Image:
@@ -40,16 +32,85 @@ def handle_data_to_pil_image(data) -> Image.Image:
     elif isinstance(data, BytesIO):
         data.seek(0)
         return Image.open(data)
-    elif isinstance(data, bytes):
-        # TODO: Need to test this
-        size = png_dimensions(data)
-        return Image.frombytes(mode="RGBA", size=size, data=data)
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        # These are encoded png bytes, not raw pixels, so check the header then let Pillow decode it
+        read_ihdr(data)
+        return Image.open(BytesIO(data))
     elif os.path.exists(data):
         return Image.open(data)
     else:
         raise AttributeError("Unable to load data attribute")
 
 
+def pixel_hash(image: Image.Image) -> str:
+    """
+    Hash of what an image looks like rather than how it's encoded, so the same pixels as P or RGBA match
+    :param image: any PIL image
+    :return: hex digest
+    """
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    digest = hashlib.sha1(f"{image.size[0]}x{image.size[1]}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ImagePool:
+    def __init__(self, maxsize: int = 256):
+        """
+        Bounded LRU of decoded images so lazily loaded states don't hold onto every file / image at once
+        :param maxsize: max images kept decoded
+        """
+        self.maxsize = maxsize
+        self._images = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def get(self, key, loader, copy: bool = True) -> Image.Image:
+        """
+        :param key: anything hashable identifying the image, e.g. its path
+        :param loader: called to decode the image on a miss
+        :param copy: hand back a copy so editing it in place can't change what everyone else sharing the key gets.
+        Only turn off for read-only use.
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+        if image is None:
+            image = loader()
+            with self._lock:
+                self._images[key] = image
+                self._images.move_to_end(key)
+                while len(self._images) > self.maxsize:
+                    self._images.popitem(last=False)
+        return image.copy() if copy else image
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._images.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+
+
+# Shared by every lazily loaded RSI unless one gets passed in
+IMAGE_POOL = ImagePool()
+
+
+def load_png_file(path: str) -> Image.Image:
+    """
+    Opens and fully decodes an image so its file handle gets closed straight away rather than whenever Pillow
+    gets around to it
+    """
+    image = Image.open(path)
+    image.load()
+    return image
+
+
 def handle_new_pil_image(data) -> Image.Image:
     """
     Used for .rsi: Will create a new image if requiredwhereas _handle_pil_image will die (mainly used for .dmi files)
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from logging import Logger, getLogger
+from typing import List, NamedTuple, Optional
+
+from src.fetch import Fetcher, get_default_fetcher
+from src.utils import convert_dmi_to_many_rsi, convert_dmi_to_rsi
+
+logger: Logger = getLogger(__name__)
+
+
+class UrlJob(NamedTuple):
+    url: str
+    output: str
+    # None means a single .rsi, otherwise it's the convert_dmi_to_many_rsi mode ("default" being mode=None)
+    mode: Optional[str] = None
+
+
+class UrlJobResult(NamedTuple):
+    job: UrlJob
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def convert_url_job_bytes(job: UrlJob, body: bytes, **kwargs) -> None:
+    """
+    The CPU-heavy half of a job: decode the downloaded .dmi, encode and write the output. Runs in the executor.
+    """
+    parent = os.path.dirname(job.output)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    if job.mode is None:
+        convert_dmi_to_rsi(BytesIO(body), job.output, rsi_copyright=job.url, **kwargs)
+    else:
+        mode = None if job.mode == "default" else job.mode
+        convert_dmi_to_many_rsi(BytesIO(body), job.output, mode=mode, rsi_copyright=job.url, **kwargs)
+
+
+async def convert_urls(jobs: List[UrlJob],
+                       fetcher: Fetcher = None,
+                       fetch_concurrency: int = 8,
+                       executor: Executor = None,
+                       workers: int = None,
+                       max_pending: int = None,
+                       **kwargs) -> List[UrlJobResult]:
+    """
+    Downloads and converts a batch of .dmi urls with downloads overlapping conversion
+    :param jobs: UrlJob or (url, output, mode) tuples
+    :param fetcher: Fetcher for downloads; defaults to the shared one
+    :param fetch_concurrency: max downloads at once, each download task only starts its next one once the converters
+    have taken its last body
+    :param executor: where conversions run; defaults to a process pool of workers
+    :param workers: conversions at once, defaults to the cpu count
+    :param max_pending: max downloaded bodies waiting on a conversion. Downloads pause once it's hit which keeps
+    memory bounded when the network is faster than the CPU. Defaults to workers.
+    :param kwargs: passed onto the convert functions (cache, profile, etc.)
+    :return: results in the same order as jobs; failures don't stop the rest of the batch
+    """
+    jobs = [UrlJob(*x) for x in jobs]
+    fetcher = fetcher or get_default_fetcher()
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers
+    loop = asyncio.get_running_loop()
+    results = {}
+    queue = asyncio.Queue(maxsize=max_pending)
+    # Shared between the fetch tasks; each takes the next job once it's handed its last body to the queue
+    pending = iter(enumerate(jobs))
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    fetch_executor = ThreadPoolExecutor(max_workers=fetch_concurrency)
+
+    async def _fetch():
+        for index, job in pending:
+            try:
+                body = await loop.run_in_executor(fetch_executor, fetcher.get, job.url)
+            except Exception:
+                results[index] = UrlJobResult(job=job, error=traceback.format_exc())
+                logger.error(f"Unable to fetch {job.url}")
+                continue
+            # Blocks while the converters are behind, so at most fetch_concurrency bodies wait outside the queue
+            await queue.put((index, job, body))
+
+    async def _convert():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, job, body = item
+            try:
+                await loop.run_in_executor(executor, _run_job, job, body, kwargs)
+                results[index] = UrlJobResult(job=job)
+                logger.info(f"[{len(results)}/{len(jobs)}] {job.url} ok")
+            except Exception:
+                results[index] = UrlJobResult(job=job, error=traceback.format_exc())
+                logger.error(f"[{len(results)}/{len(jobs)}] {job.url} failed")
+
+    try:
+        converters = [asyncio.ensure_future(_convert()) for _ in range(workers)]
+        await asyncio.gather(*[_fetch() for _ in range(max(min(fetch_concurrency, len(jobs)), 1))])
+        for _ in converters:
+            await queue.put(None)
+        await asyncio.gather(*converters)
+    finally:
+        fetch_executor.shutdown(wait=True)
+        if owns_executor:
+            executor.shutdown(wait=True)
+    return [results[index] for index in range(len(jobs))]
+
+
+def _run_job(job: UrlJob, body: bytes, kwargs: dict) -> None:
+    # run_in_executor doesn't take kwargs and this has to be picklable for process pools
+    convert_url_job_bytes(job, body, **kwargs)
+
+
+def run_url_batch(jobs: List[UrlJob], **kwargs) -> List[UrlJobResult]:
+    """
+    Blocking wrapper around convert_urls
+    """
+    return asyncio.run(convert_urls(jobs, **kwargs))
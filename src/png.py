@@ -0,0 +1,280 @@
+import os
+import zlib
+from io import BytesIO
+from logging import Logger, getLogger
+from mmap import mmap
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger: Logger = getLogger(__name__)
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Chunks we never want the contents of when only looking at metadata
+PIXEL_CHUNKS = (b"IDAT", )
+PNG_PROFILES = ["fast", "default", "small"]
+# zlib strategies: default, filtered, huffman only, RLE, fixed. Pillow doesn't let you pick the png filter itself
+# so the small profile tries each of these instead.
+ZLIB_STRATEGIES = [0, 1, 2, 3, 4]
+# Signature + length + type + 13 bytes of IHDR data + CRC; IHDR always has to be the first chunk
+IHDR_END = len(PNG_SIGNATURE) + 8 + 13 + 4
+
+
+class InvalidPNGException(Exception):
+    pass
+
+
+class IHDR(NamedTuple):
+    width: int
+    height: int
+    bit_depth: int
+    colour_type: int
+    compression: int
+    filter_method: int
+    interlace: int
+
+
+class _BufferReader:
+    """
+    Reads chunks straight out of something that supports the buffer protocol (bytes, mmap, etc.)
+    without copying the whole thing
+    """
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.position = 0
+
+    def read(self, size: int) -> bytes:
+        result = self.view[self.position:self.position + size].tobytes()
+        self.position += len(result)
+        return result
+
+    def skip(self, size: int) -> None:
+        self.position += size
+
+    def close(self) -> None:
+        self.view.release()
+
+
+class _StreamReader:
+    def __init__(self, stream, close: bool = False):
+        self.stream = stream
+        self._close = close
+
+    def read(self, size: int) -> bytes:
+        return self.stream.read(size)
+
+    def skip(self, size: int) -> None:
+        self.stream.seek(size, os.SEEK_CUR)
+
+    def close(self) -> None:
+        if self._close:
+            self.stream.close()
+
+
+def _get_reader(data):
+    if isinstance(data, (bytes, bytearray, memoryview, mmap)):
+        return _BufferReader(data)
+    elif isinstance(data, BytesIO) or hasattr(data, "read"):
+        data.seek(0)
+        return _StreamReader(data)
+    elif isinstance(data, (str, os.PathLike)) and os.path.exists(data):
+        return _StreamReader(open(data, "rb"), close=True)
+    else:
+        raise AttributeError(f"Unable to read png data from {type(data)}")
+
+
+def _check_crc(chunk_type: bytes, chunk_data: bytes, crc: bytes) -> None:
+    if zlib.crc32(chunk_data, zlib.crc32(chunk_type)) != int.from_bytes(crc, byteorder="big"):
+        raise InvalidPNGException(f"CRC mismatch for {chunk_type} chunk")
+
+
+def read_ihdr(data) -> IHDR:
+    """
+    Reads the IHDR chunk, which sits at a fixed offset, so only the first few dozen bytes get touched
+    :param data: path / bytes / BytesIO / mmap of a png
+    :return: IHDR
+    """
+    reader = _get_reader(data)
+    try:
+        header = reader.read(IHDR_END)
+    finally:
+        reader.close()
+    if len(header) < IHDR_END:
+        raise InvalidPNGException("Png is too short to have an IHDR chunk")
+    if header[0:8] != PNG_SIGNATURE:
+        raise InvalidPNGException("Missing png signature")
+    if header[8:16] != b"\x00\x00\x00\x0dIHDR":
+        raise InvalidPNGException("First chunk isn't IHDR")
+    _check_crc(b"IHDR", header[16:29], header[29:33])
+    width = int.from_bytes(header[16:20], byteorder="big")
+    height = int.from_bytes(header[20:24], byteorder="big")
+    return IHDR(width, height, *header[24:29])
+
+
+def iter_chunks(data, skip: tuple = PIXEL_CHUNKS, check_crc: bool = True) \
+        -> Iterator[Tuple[bytes, Optional[bytes]]]:
+    """
+    Walks the chunks of a png in file order, stopping after IEND. Stop iterating whenever to avoid reading the rest.
+    :param data: path / bytes / BytesIO / mmap of a png
+    :param skip: chunk types whose data gets seeked over rather than read; these are yielded with None as data
+    and can't have their CRC checked
+    :param check_crc: raise InvalidPNGException if a chunk that was read has a bad CRC
+    :return: (chunk type, chunk data)
+    """
+    reader = _get_reader(data)
+    try:
+        if reader.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            raise InvalidPNGException("Missing png signature")
+        while True:
+            header = reader.read(8)
+            if len(header) < 8:
+                raise InvalidPNGException("Png ended before IEND")
+            length = int.from_bytes(header[0:4], byteorder="big")
+            chunk_type = header[4:8]
+            if chunk_type in skip:
+                # Data + CRC
+                reader.skip(length + 4)
+                yield chunk_type, None
+            else:
+                chunk_data = reader.read(length)
+                crc = reader.read(4)
+                if len(chunk_data) < length or len(crc) < 4:
+                    raise InvalidPNGException(f"Truncated {chunk_type} chunk")
+                if check_crc:
+                    _check_crc(chunk_type, chunk_data, crc)
+                yield chunk_type, chunk_data
+            if chunk_type == b"IEND":
+                return
+    finally:
+        reader.close()
+
+
+def decode_text_chunk(chunk_type: bytes, chunk_data: bytes) -> Tuple[str, str]:
+    """
+    Decodes a tEXt / zTXt / iTXt chunk
+    :return: (keyword, text)
+    """
+    keyword, _, rest = chunk_data.partition(b"\x00")
+    keyword = keyword.decode("latin-1")
+    if chunk_type == b"tEXt":
+        return keyword, rest.decode("latin-1")
+    elif chunk_type == b"zTXt":
+        # First byte is the compression method which is only ever 0 (deflate)
+        return keyword, zlib.decompress(rest[1:]).decode("latin-1")
+    elif chunk_type == b"iTXt":
+        compressed, rest = rest[0], rest[2:]
+        _language, _, rest = rest.partition(b"\x00")
+        _translated, _, text = rest.partition(b"\x00")
+        if compressed:
+            text = zlib.decompress(text)
+        return keyword, text.decode("utf-8")
+    else:
+        raise AttributeError(f"{chunk_type} is not a text chunk")
+
+
+def read_png_text(data, keyword: str) -> Optional[str]:
+    """
+    Finds a single text entry in a png without decoding any pixel data
+    :param data: path / bytes / BytesIO / mmap of a png
+    :param keyword: text keyword e.g. Description
+    :return: the text or None if it's not there
+    """
+    chunks = iter_chunks(data)
+    try:
+        for chunk_type, chunk_data in chunks:
+            if chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+                # Check the keyword before inflating anything
+                if chunk_data.partition(b"\x00")[0].decode("latin-1") != keyword:
+                    continue
+                return decode_text_chunk(chunk_type, chunk_data)[1]
+    finally:
+        # Make sure any file / buffer view is let go of straight away (mmaps can't close while viewed)
+        chunks.close()
+    return None
+
+
+class EncodedPNG(NamedTuple):
+    data: bytes
+    # Size Pillow's default settings would have produced, if it was worked out
+    default_size: Optional[int] = None
+
+
+def palette_image(image: Image.Image) -> Optional[Image.Image]:
+    """
+    Losslessly converts an image to a palette image with a tRNS chunk for alpha
+    :param image: any PIL image
+    :return: None if there's more than 256 colours
+    """
+    rgba = image if image.mode == "RGBA" else image.convert("RGBA")
+    colours = rgba.getcolors(256)
+    if colours is None:
+        return None
+    # Translucent colours go first so tRNS can stop at the last one of them
+    colours.sort(key=lambda x: (x[1][3] == 255, -x[0]))
+    result = Image.frombytes("P", rgba.size, _palette_indices(rgba, [colour for _, colour in colours]))
+    result.putpalette(b"".join(bytes(colour[0:3]) for _, colour in colours))
+    alphas = bytes(colour[3] for _, colour in colours if colour[3] != 255)
+    if alphas:
+        result.info["transparency"] = alphas
+    return result
+
+
+def _palette_indices(rgba: Image.Image, colours: List[tuple]) -> bytes:
+    """
+    :param colours: every colour in rgba; a pixel's index is its colour's position in here
+    :return: a byte per pixel
+    """
+    pixels = rgba.tobytes()
+    if numpy is None:
+        lookup = {bytes(colour): idx for idx, colour in enumerate(colours)}
+        return bytes(lookup[pixels[i:i + 4]] for i in range(0, len(pixels), 4))
+    # Each RGBA pixel as one uint32 so the whole lookup is a single searchsorted
+    keys = numpy.frombuffer(b"".join(bytes(x) for x in colours), dtype=numpy.uint32)
+    order = numpy.argsort(keys)
+    positions = numpy.searchsorted(keys[order], numpy.frombuffer(pixels, dtype=numpy.uint32))
+    return order[positions].astype(numpy.uint8).tobytes()
+
+
+def _encode(image: Image.Image, **kwargs) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", **kwargs)
+    return buffer.getvalue()
+
+
+def encode_png(image: Image.Image, profile: str = "default", measure: bool = False) -> EncodedPNG:
+    """
+    Encodes an image as png
+    :param image: any PIL image
+    :param profile: "fast" (zlib level 1), "default" (Pillow's defaults) or "small" (lossless palette conversion where
+    possible, no ancillary chunks and whichever zlib strategy comes out smallest)
+    :param measure: also work out the default profile's size for fast. The other two get it for free.
+    :return: EncodedPNG
+    """
+    if profile == "default":
+        data = _encode(image)
+        return EncodedPNG(data=data, default_size=len(data))
+    elif profile == "fast":
+        data = _encode(image, compress_level=1)
+        return EncodedPNG(data=data, default_size=len(_encode(image)) if measure else None)
+    elif profile == "small":
+        default = _encode(image)
+        candidates = [image]
+        palette = palette_image(image)
+        if palette is not None:
+            candidates.append(palette)
+        best = default
+        for candidate in candidates:
+            for strategy in ZLIB_STRATEGIES:
+                # icc_profile=None stops Pillow copying it over from the source image's info
+                data = _encode(candidate, compress_level=9, compress_type=strategy, icc_profile=None)
+                if len(data) < len(best):
+                    best = data
+        return EncodedPNG(data=best, default_size=len(default))
+    else:
+        raise AttributeError(f"Unknown png profile {profile}")
@@ -1,11 +1,21 @@
+import hashlib
 import yaml
-from typing import List
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import json
 import os
+from fnmatch import fnmatch
 from logging import Logger, getLogger
 from collections import OrderedDict
 
 logger: Logger = getLogger(__name__)
 
+# LibYAML's C loader is a lot faster on the big shared files, if pyyaml was built with it. Dumping stays on the pure
+# Python SafeDumper as the C one wraps long strings differently; it only ever sees the new prototypes anyway.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = yaml.SafeDumper
+
+PROTOTYPE_INDEX_VERSION = 1
+
 
 class PrototypeComponent:
     def __init__(self,
@@ -81,287 +91,362 @@ class Prototype:
         return result
 
 
-def create_glove_prototype(path: str) -> Prototype:
-    name = os.path.split(path)[-1].replace(".rsi", "")
-    components = [
-        PrototypeComponent(
-            ptype="Sprite",
-            sprite=f"Clothing/Gloves/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Icon",
-            sprite=f"Clothing/Gloves/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Clothing",
-            sprite=f"Clothing/Gloves/{name}.rsi",
-        ),
-    ]
-    prototype_name = " ".join([x.capitalize() for x in name.split("_")]) + " gloves"
-    pascal_name = "".join([x.capitalize() for x in name.split("_")])
-    prototype = Prototype(
-        ptype="entity",
-        parent="GlovesBase",
-        id=f"Gloves{pascal_name}",
-        name=prototype_name,
-        description="",
-        components=components,
-    )
-    return prototype
+def _sprite_components(sprite: str, state: str = None) -> List[PrototypeComponent]:
+    kwargs = {"sprite": sprite}
+    if state is not None:
+        kwargs["state"] = state
+    return [PrototypeComponent(ptype="Sprite", **kwargs), PrototypeComponent(ptype="Icon", **kwargs)]
 
 
-def create_hat_prototype(path: str) -> Prototype:
-    name = os.path.split(path)[-1].replace(".rsi", "")
-    components = [
-        PrototypeComponent(
-            ptype="Sprite",
-            sprite=f"Clothing/Head/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Icon",
-            sprite=f"Clothing/Head/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Clothing",
-            sprite=f"Clothing/Head/{name}.rsi",
-        ),
-    ]
-    prototype_name = " ".join([x.capitalize() for x in name.split("_")])
-    pascal_name = "".join([x.capitalize() for x in name.split("_")])
-    prototype = Prototype(
-        ptype="entity",
-        parent="HatBase",
-        id=f"Hat{pascal_name}",
-        name=prototype_name,
-        description="",
-        components=components,
-    )
-    return prototype
+def _clothing_components(sprite: str, state: str = None) -> List[PrototypeComponent]:
+    return _sprite_components(sprite, state) + [PrototypeComponent(ptype="Clothing", sprite=sprite)]
 
 
-def create_shoes_prototype(path: str) -> Prototype:
-    name = os.path.split(path)[-1].replace(".rsi", "")
-    components = [
-        PrototypeComponent(
-            ptype="Sprite",
-            sprite=f"Clothing/Shoes/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Icon",
-            sprite=f"Clothing/Shoes/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Clothing",
-            sprite=f"Clothing/Shoes/{name}.rsi",
-        ),
-    ]
-    prototype_name = " ".join([x.capitalize() for x in name.split("_")]) + " shoes"
-    pascal_name = "".join([x.capitalize() for x in name.split("_")])
-    prototype = Prototype(
-        ptype="entity",
-        parent="ShoesBase",
-        id=f"Shoes{pascal_name}",
-        name=prototype_name,
-        description="",
-        components=components,
-    )
-    return prototype
+def _food_components(sprite: str, state: str = None) -> List[PrototypeComponent]:
+    return [PrototypeComponent(ptype="Food", uses=1, nutriment_amount=1)] + _sprite_components(sprite, state)
 
 
-def create_suit_prototype(path: str) -> Prototype:
-    name = os.path.split(path)[-1].replace(".rsi", "")
-    components = [
-        PrototypeComponent(
-            ptype="Sprite",
-            sprite=f"Clothing/OuterClothing/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Icon",
-            sprite=f"Clothing/OuterClothing/{name}.rsi",
-        ),
-        PrototypeComponent(
-            ptype="Clothing",
-            sprite=f"Clothing/OuterClothing/{name}.rsi",
-        ),
-    ]
-    prototype_name = " ".join([x.capitalize() for x in name.split("_")])
-    prototype_name = " ".join([x.capitalize() for x in prototype_name.split("-")])
-    pascal_name = "".join([x.capitalize() for x in name.split("_")])
-    pascal_name = "".join([x.capitalize() for x in pascal_name.split("-")])
-    prototype = Prototype(
-        ptype="entity",
-        parent="OuterclothingBase",
-        id=f"Outerclothing{pascal_name}",
-        name=prototype_name,
-        description="",
-        components=components,
-    )
-    return prototype
+def _drink_components(sprite: str, state: str = None) -> List[PrototypeComponent]:
+    return [PrototypeComponent(ptype="Drink", uses=1, nutriment_amount=30)] + _sprite_components(sprite, state)
 
 
-def create_food_prototype(path: str) -> Prototype:
-    name = os.path.split(path)[-1].replace(".rsi", "")
-    rsi_sprite = f"Objects/Food/{name}.rsi"
-    components = [
-        PrototypeComponent(
-            ptype="Food",
-            uses=1,
-            nutriment_amount=1,
-        ),
-        PrototypeComponent(
-            ptype="Sprite",
-            sprite=rsi_sprite,
-        ),
-        PrototypeComponent(
-            ptype="Icon",
-            sprite=rsi_sprite,
-        ),
-    ]
-    prototype_name = " ".join([x.capitalize() for x in name.split("_")])
-    pascal_name = "".join([x.capitalize() for x in name.split("_")])
-    prototype = Prototype(
-        ptype="entity",
-        parent="FoodBase",
-        id=f"Food{pascal_name}",
-        name=prototype_name,
-        description="",
-        components=components,
-    )
-    return prototype
+class PrototypeRule(NamedTuple):
+    parent: str
+    id_prefix: str
+    # Where the .rsi files live under Resources/Textures, used when only given a name
+    sprite_directory: str
+    # (sprite path, sprite state or None) -> components
+    components: Callable[..., List[PrototypeComponent]]
+    name_suffix: str = ""
+    # Also treat - as a word separator for names / IDs
+    split_dashes: bool = False
 
 
-def create_drink_prototype(path: str) -> Prototype:
+PROTOTYPE_RULES: Dict[str, PrototypeRule] = {
+    "gloves": PrototypeRule("GlovesBase", "Gloves", "Clothing/Gloves", _clothing_components, name_suffix=" gloves"),
+    "hats": PrototypeRule("HatBase", "Hat", "Clothing/Head", _clothing_components),
+    "shoes": PrototypeRule("ShoesBase", "Shoes", "Clothing/Shoes", _clothing_components, name_suffix=" shoes"),
+    "suits": PrototypeRule("OuterclothingBase", "Outerclothing", "Clothing/OuterClothing", _clothing_components,
+                           split_dashes=True),
+    "food": PrototypeRule("FoodBase", "Food", "Objects/Food", _food_components),
+    "drinks": PrototypeRule("DrinkBase", "Drink", "Objects/Food", _drink_components),
+}
+
+# (glob of the directory an .rsi is in relative to the scanned tree, category); first match wins and anything nested
+# further down matches too
+PROTOTYPE_ROUTES = [
+    ("Clothing/Gloves", "gloves"),
+    ("Clothing/Head", "hats"),
+    ("Clothing/Shoes", "shoes"),
+    ("Clothing/OuterClothing", "suits"),
+    ("Objects/Food", "food"),
+    ("Objects/Drinks", "drinks"),
+    ("Objects/Consumable/Drinks", "drinks"),
+    ("Objects/Consumable/Food", "food"),
+]
+
+
+def _words(name: str, split_dashes: bool) -> List[str]:
+    words = [x.capitalize() for x in name.split("_")]
+    if split_dashes:
+        words = [x.capitalize() for x in " ".join(words).split("-")]
+    return words
+
+
+def create_prototype(path: str, rule: PrototypeRule, sprite: str = None, state: str = None) -> Prototype:
+    """
+    :param path: .rsi path or name
+    :param sprite: sprite path for the components, defaults to <rule.sprite_directory>/<name>.rsi
+    :param state: sprite state for the Sprite / Icon components
+    """
     name = os.path.split(path)[-1].replace(".rsi", "")
-    rsi_sprite = f"Objects/Food/{name}.rsi"
-    components = [
-        PrototypeComponent(
-            ptype="Drink",
-            uses=1,
-            nutriment_amount=30,
-        ),
-        PrototypeComponent(
-            ptype="Sprite",
-            sprite=rsi_sprite,
-        ),
-        PrototypeComponent(
-            ptype="Icon",
-            sprite=rsi_sprite,
-        ),
-    ]
-    prototype_name = " ".join([x.capitalize() for x in name.split("_")])
-    pascal_name = "".join([x.capitalize() for x in name.split("_")])
-    prototype = Prototype(
+    sprite = sprite or f"{rule.sprite_directory}/{name}.rsi"
+    if rule.split_dashes:
+        prototype_name = " ".join(_words(name, True))
+        pascal_name = "".join(x.capitalize() for x in "".join(_words(name, False)).split("-"))
+    else:
+        prototype_name = " ".join(_words(name, False))
+        pascal_name = "".join(_words(name, False))
+    return Prototype(
         ptype="entity",
-        parent="DrinkBase",
-        id=f"Drink{pascal_name}",
-        name=prototype_name,
+        parent=rule.parent,
+        id=f"{rule.id_prefix}{pascal_name}",
+        name=prototype_name + rule.name_suffix,
         description="",
-        components=components,
+        components=rule.components(sprite, state),
     )
-    return prototype
-
-
-def directory_to_gloves(directory: str, output: str) -> None:
-    if not os.path.isdir(directory):
-        raise NotADirectoryError(f"{directory}")
-    if not os.path.isfile(output):
-        raise FileNotFoundError(f"{output}")
 
-    prototypes: List[Prototype] = []
-    for rsi in os.listdir(directory):
-        prototypes.append(create_glove_prototype(rsi))
 
-    append_to_file(prototypes, output)
-    return
+def create_glove_prototype(path: str) -> Prototype:
+    return create_prototype(path, PROTOTYPE_RULES["gloves"])
 
 
-def directory_to_hats(directory: str, output: str) -> None:
-    if not os.path.isdir(directory):
-        raise NotADirectoryError(f"{directory}")
-    if not os.path.isfile(output):
-        raise FileNotFoundError(f"{output}")
+def create_hat_prototype(path: str) -> Prototype:
+    return create_prototype(path, PROTOTYPE_RULES["hats"])
 
-    prototypes: List[Prototype] = []
-    for rsi in os.listdir(directory):
-        prototypes.append(create_hat_prototype(rsi))
 
-    append_to_file(prototypes, output)
-    return
+def create_shoes_prototype(path: str) -> Prototype:
+    return create_prototype(path, PROTOTYPE_RULES["shoes"])
 
 
-def directory_to_shoes(directory: str, output: str) -> None:
-    if not os.path.isdir(directory):
-        raise NotADirectoryError(f"{directory}")
-    if not os.path.isfile(output):
-        raise FileNotFoundError(f"{output}")
+def create_suit_prototype(path: str) -> Prototype:
+    return create_prototype(path, PROTOTYPE_RULES["suits"])
 
-    prototypes: List[Prototype] = []
-    for rsi in os.listdir(directory):
-        prototypes.append(create_shoes_prototype(rsi))
 
-    append_to_file(prototypes, output)
-    return
+def create_food_prototype(path: str) -> Prototype:
+    return create_prototype(path, PROTOTYPE_RULES["food"])
 
 
-def directory_to_suits(directory: str, output: str) -> None:
+def create_drink_prototype(path: str) -> Prototype:
+    return create_prototype(path, PROTOTYPE_RULES["drinks"])
+
+
+def scan_rsis(directory: str, relative: str = "") -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    Every .rsi directory under directory; .rsi directories aren't descended into. A directory's own .rsi files come
+    before anything in its sub directories so the shallowest one wins when names collide.
+    :return: (posix path of the directory it's in relative to directory, entry) pairs
+    """
+    with os.scandir(directory) as entries:
+        # Sorted so the output's the same on every filesystem
+        # Not following symlinks so a link back up the tree can't recurse forever
+        directories = sorted((x for x in entries if x.is_dir(follow_symlinks=False)), key=lambda x: x.name)
+    sub_directories = []
+    for entry in directories:
+        if entry.name.endswith(".rsi"):
+            yield relative, entry
+        else:
+            sub_directories.append(entry)
+    for entry in sub_directories:
+        yield from scan_rsis(entry.path, f"{relative}/{entry.name}" if relative else entry.name)
+
+
+def route_rsi(relative: str, routes: List[Tuple[str, str]] = None) -> Optional[str]:
+    """
+    :param relative: directory the .rsi is in relative to the scanned tree
+    :return: category from routes (default PROTOTYPE_ROUTES) or None
+    """
+    for pattern, category in PROTOTYPE_ROUTES if routes is None else routes:
+        if fnmatch(relative, pattern) or fnmatch(relative, f"{pattern}/*"):
+            return category
+    return None
+
+
+def _meta_state(path: str) -> Optional[str]:
+    """
+    State to show from an .rsi's meta.json: "icon" if it has one, otherwise the first
+    """
+    try:
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            states = [x.get("name") for x in json.load(f).get("states", [])]
+    except (OSError, ValueError, AttributeError):
+        logger.warning(f"Unable to read meta.json of {path}")
+        return None
+    if "icon" in states:
+        return "icon"
+    return states[0] if states else None
+
+
+def generate_prototypes(directory: str,
+                        output: str,
+                        routes: List[Tuple[str, str]] = None,
+                        rules: Dict[str, PrototypeRule] = None,
+                        inspect_meta: bool = False,
+                        index_directory: str = None,
+                        ) -> Dict[str, List[Prototype]]:
+    """
+    Scans an .rsi tree (e.g. Resources/Textures) once and appends a prototype for every .rsi to
+    <output>/<category>.yml. Prototypes whose IDs are already in those files are skipped.
+    :param routes: see PROTOTYPE_ROUTES; .rsi files no route matches are ignored
+    :param rules: category -> PrototypeRule, defaults to PROTOTYPE_RULES
+    :param inspect_meta: read each meta.json to pick the sprite state
+    :param index_directory: see PrototypeIndex
+    :return: category -> prototypes that got written
+    """
+    if not os.path.isdir(directory):
+        raise NotADirectoryError(f"{directory}")
+    rules = PROTOTYPE_RULES if rules is None else rules
+    # category -> (prototype, sprite path) pairs
+    prototypes: Dict[str, List[Tuple[Prototype, str]]] = {}
+    for relative, entry in scan_rsis(directory):
+        category = route_rsi(relative, routes)
+        if category is None:
+            continue
+        if category not in rules:
+            raise AttributeError(f"No prototype rule for {category}")
+        state = _meta_state(entry.path) if inspect_meta else None
+        sprite = f"{relative}/{entry.name}" if relative else entry.name
+        prototype = create_prototype(entry.name, rules[category], sprite, state)
+        prototypes.setdefault(category, []).append((prototype, sprite))
+
+    os.makedirs(output, exist_ok=True)
+    written = {}
+    for category, category_prototypes in sorted(prototypes.items()):
+        path = os.path.join(output, f"{category}.yml")
+        if not os.path.isfile(path):
+            open(path, "w").close()
+        # Same name in two directories, only the first gets written
+        unique = []
+        seen = {}
+        for prototype, sprite in category_prototypes:
+            if prototype.id in seen:
+                logger.warning(f"Skipping {prototype.id} from {sprite}, it was already generated from "
+                               f"{seen[prototype.id]}")
+                continue
+            seen[prototype.id] = sprite
+            unique.append(prototype)
+        skipped = set(append_to_file(unique, path, index_directory=index_directory))
+        written[category] = [x for x in unique if x.id not in skipped]
+    logger.info(f"Generated {sum(len(x) for x in written.values())} prototypes in {output}")
+    return written
+
+
+def _directory_to(directory: str, output: str, rule: PrototypeRule) -> None:
     if not os.path.isdir(directory):
         raise NotADirectoryError(f"{directory}")
     if not os.path.isfile(output):
         raise FileNotFoundError(f"{output}")
 
-    prototypes: List[Prototype] = []
-    for rsi in os.listdir(directory):
-        prototypes.append(create_suit_prototype(rsi))
-
+    with os.scandir(directory) as entries:
+        prototypes = [create_prototype(x.name, rule) for x in entries if x.name.endswith(".rsi")]
     append_to_file(prototypes, output)
     return
 
 
-def directory_to_food(directory: str, output: str) -> None:
-    if not os.path.isdir(directory):
-        raise NotADirectoryError(f"{directory}")
-    if not os.path.isfile(output):
-        raise FileNotFoundError(f"{output}")
+def directory_to_gloves(directory: str, output: str) -> None:
+    _directory_to(directory, output, PROTOTYPE_RULES["gloves"])
 
-    prototypes: List[Prototype] = []
-    for rsi in os.listdir(directory):
-        prototypes.append(create_food_prototype(rsi))
 
-    append_to_file(prototypes, output)
-    return
+def directory_to_hats(directory: str, output: str) -> None:
+    _directory_to(directory, output, PROTOTYPE_RULES["hats"])
 
 
-def directory_to_drinks(directory: str, output: str) -> None:
-    if not os.path.isdir(directory):
-        raise NotADirectoryError(f"{directory}")
-    if not os.path.isfile(output):
-        raise FileNotFoundError(f"{output}")
+def directory_to_shoes(directory: str, output: str) -> None:
+    _directory_to(directory, output, PROTOTYPE_RULES["shoes"])
 
-    prototypes: List[Prototype] = []
-    for rsi in os.listdir(directory):
-        prototypes.append(create_drink_prototype(rsi))
 
-    append_to_file(prototypes, output)
-    return
+def directory_to_suits(directory: str, output: str) -> None:
+    _directory_to(directory, output, PROTOTYPE_RULES["suits"])
+
+
+def directory_to_food(directory: str, output: str) -> None:
+    _directory_to(directory, output, PROTOTYPE_RULES["food"])
 
 
-def append_to_file(prototypes: List[Prototype], output) -> None:
+def directory_to_drinks(directory: str, output: str) -> None:
+    _directory_to(directory, output, PROTOTYPE_RULES["drinks"])
+
+
+class PrototypeIndex:
+    def __init__(self, path: str, index_path: str = None, index_directory: str = None):
+        """
+        IDs of every prototype in a YAML file. They're kept in a sidecar file along with the YAML file's size and mtime
+        so the YAML only gets re-read when something else has changed it.
+        NOTE: By default the sidecar sits next to the YAML, so inside a content repo either pass index_directory or add
+        *.ids.json to its .gitignore.
+        :param path: prototype YAML file
+        :param index_path: where to keep the sidecar, defaults to <path>.ids.json
+        :param index_directory: keep the sidecar in here instead (named after the hash of path's absolute path)
+        """
+        self.path = path
+        if index_path is None and index_directory is not None:
+            os.makedirs(index_directory, exist_ok=True)
+            name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+            index_path = os.path.join(index_directory, f"{name}.ids.json")
+        self.index_path = index_path or f"{path}.ids.json"
+        self.ids = set()
+        self._load()
+
+    def __contains__(self, prototype_id) -> bool:
+        return prototype_id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, prototype_id) -> None:
+        self.ids.add(prototype_id)
+
+    def _stat(self) -> list:
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if index and index.get("version") == PROTOTYPE_INDEX_VERSION and index.get("stat") == self._stat():
+            self.ids = set(index["ids"])
+            return
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """
+        Re-reads every ID from the YAML file
+        """
+        with open(self.path, "rb") as f:
+            existing = yaml.load(stream=f, Loader=YAML_LOADER)
+        self.ids = {x.get("id") for x in existing or [] if isinstance(x, dict) and x.get("id") is not None}
+        logger.debug(f"Rebuilt prototype index for {self.path} with {len(self.ids)} IDs")
+        self.save()
+
+    def save(self) -> None:
+        """
+        Writes the sidecar; call after changing the YAML file
+        """
+        with open(self.index_path, "w") as f:
+            json.dump({"version": PROTOTYPE_INDEX_VERSION, "stat": self._stat(), "ids": sorted(self.ids, key=str)}, f)
+
+
+def dump_prototypes(prototypes: List[Prototype]) -> str:
+    """
+    :return: YAML for the prototypes as a list, with a blank line before each like the files in the game repo
+    """
+    text = yaml.dump(data=[x.to_dict() for x in prototypes], Dumper=YAML_DUMPER, default_flow_style=False,
+                     sort_keys=False)
+    # Format it because idek how to do it with yaml
+    return "".join(f"\n{x}" if x[0:7] == "- type:" else x for x in text.splitlines(keepends=True))
+
+
+def append_to_file(prototypes: List[Prototype], output, index: PrototypeIndex = None,
+                   index_directory: str = None) -> List[str]:
+    """
+    Appends prototypes to the end of a YAML file in a single write; nothing already in the file gets re-read or
+    re-written so it's O(new prototypes) once the index exists.
+    :param output: existing prototype YAML file
+    :param index: index of output, pass one in when appending to the same file repeatedly
+    :param index_directory: see PrototypeIndex, used if index isn't passed
+    :return: IDs that were skipped because they're already in the file (or earlier in prototypes)
+    """
     if not os.path.isfile(output):
         raise FileNotFoundError(f"{output}")
-    # Load existing
-    with open(output, "rb") as f:
-        existing = yaml.load(stream=f, Loader=yaml.SafeLoader)
-    if not existing:
-        existing = []
+    if index is None:
+        index = PrototypeIndex(output, index_directory=index_directory)
+    new = []
+    skipped = []
     for prototype in prototypes:
-        existing.append(prototype.to_dict())
-
-    # Re-add
-    with open(output, "w") as f:
-        yaml.dump(data=existing, stream=f, Dumper=yaml.SafeDumper, default_flow_style=False, sort_keys=False)
-    # Format it because idek how to do it with yaml
-    with open(output, "r") as f:
-        lines = f.readlines()
-    with open(output, "w") as f:
-        f.writelines([f"\n{x}" if x[0:7] == "- type:" else x for x in lines])
-    return
+        if prototype.id is not None and prototype.id in index:
+            logger.debug(f"Skipping duplicate prototype {prototype.id} for {output}")
+            skipped.append(prototype.id)
+            continue
+        if prototype.id is not None:
+            index.add(prototype.id)
+        new.append(prototype)
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} prototypes already in {output}")
+    if not new:
+        return skipped
+
+    text = dump_prototypes(new)
+    with open(output, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            # Don't glue the first one onto the end of the last line
+            if f.read(1) != b"\n":
+                text = f"\n{text}"
+    with open(output, "a") as f:
+        f.write(text)
+    index.save()
+    return skipped
@@ -1,10 +1,16 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from logging import getLogger, Logger
-from typing import List
+from typing import List, NamedTuple, Optional
 import os
+import shutil
 from PIL import Image
 from io import BytesIO
-from src.internal_utils import handle_data_to_pil_image
+from src.instrumentation import count, span
+from src.internal_utils import IMAGE_POOL, ImagePool, handle_data_to_pil_image, load_png_file, pixel_hash
+from src.png import EncodedPNG, encode_png, read_ihdr
+from src.storage import DirectoryStorage, RSIStorage, get_storage
 
 logger: Logger = getLogger(__name__)
 
@@ -13,6 +19,28 @@ class InvalidRSIStateException(Exception):
     pass
 
 
+class SaveReport(NamedTuple):
+    states_written: int = 0
+    bytes_written: int = 0
+    # Compared to Pillow's default png settings; None if that wasn't measured (fast profile)
+    bytes_saved: Optional[int] = 0
+
+    def add(self, encoded: EncodedPNG) -> "SaveReport":
+        if encoded.default_size is None or self.bytes_saved is None:
+            bytes_saved = None
+        else:
+            bytes_saved = self.bytes_saved + encoded.default_size - len(encoded.data)
+        return SaveReport(
+            states_written=self.states_written + 1,
+            bytes_written=self.bytes_written + len(encoded.data),
+            bytes_saved=bytes_saved,
+        )
+
+    def __str__(self) -> str:
+        saved = "unknown" if self.bytes_saved is None else self.bytes_saved
+        return f"Wrote {self.states_written} states, {self.bytes_written} bytes ({saved} bytes saved)"
+
+
 class RSIState:
     # Directions might be able to be more?
     def __init__(self,
@@ -22,9 +50,26 @@ class RSIState:
                  delays: list = None,
                  select: list = None,
                  flags: dict = None,
+                 lazy: bool = False,
+                 pool: ImagePool = None,
                  **kwargs,
                  ):
-        self.image = handle_data_to_pil_image(data)  # RSIState should only ever get the completed image I think?
+        """
+        :param data: path / BytesIO / png bytes / PIL image of the state. png bytes get written back out as-is when
+        saving with the default profile unless the image gets replaced.
+        :param lazy: If data is a path don't open it until the image is needed, and then only keep it in pool
+        :param pool: ImagePool for lazy states; defaults to the shared IMAGE_POOL
+        """
+        self._path = None
+        self._pool = None
+        self._encoded = bytes(data) if isinstance(data, (bytes, bytearray)) else None
+        self._content_hash = None
+        if lazy and isinstance(data, str):
+            self._path = data
+            self._pool = pool if pool is not None else IMAGE_POOL
+            self._image = None
+        else:
+            self._image = handle_data_to_pil_image(data)  # RSIState should only ever get the completed image I think?
         self.name = name
         self.directions = directions  # TODO: Look at https://github.com/space-wizards/RSI
         # Don't use mutable in __init__ or Guido gets you
@@ -34,10 +79,91 @@ class RSIState:
         self.select = select
         self.flags = flags
 
-    def image_buffer(self) -> BytesIO:
-        buffer = BytesIO()
-        self.image.save(buffer, format="PNG")
-        return buffer
+    @property
+    def image(self) -> Image.Image:
+        """
+        Lazy states hand back a fresh copy from the pool each time, so editing it in place doesn't stick (or affect
+        anything else loaded from the same file); assign state.image instead.
+        """
+        if self._image is None and self._path is not None:
+            return self._pool.get(self._pool_key(), partial(load_png_file, self._path))
+        return self._image
+
+    def _read_image(self) -> Image.Image:
+        # Same as image without the copy, only for things that don't modify it
+        if self._image is None and self._path is not None:
+            return self._pool.get(self._pool_key(), partial(load_png_file, self._path), copy=False)
+        return self._image
+
+    def _pool_key(self) -> tuple:
+        # Includes the inode / mtime so a .rsi rewritten in place doesn't get served stale images
+        stat = os.stat(self._path)
+        return self._path, stat.st_ino, stat.st_mtime_ns
+
+    @image.setter
+    def image(self, value: Image.Image) -> None:
+        # Once it's been set it's no longer backed by the file / original bytes
+        if self._path is not None:
+            if os.path.exists(self._path):
+                self._pool.discard(self._pool_key())
+            self._path = None
+        self._encoded = None
+        self._content_hash = None
+        self._image = value
+
+    @property
+    def content_hash(self) -> str:
+        """
+        pixel_hash of the image, so states that look the same match however they were encoded
+        """
+        if self._path is not None:
+            # The file could get rewritten underneath us so don't hold onto it
+            return pixel_hash(self._read_image())
+        if self._content_hash is None:
+            self._content_hash = pixel_hash(self.image)
+        return self._content_hash
+
+    def passthrough(self, profile: str = "default") -> bool:
+        """
+        Whether encode would just hand back the png this state was loaded from
+        """
+        return profile == "default" and (self._encoded is not None or self._path is not None)
+
+    @property
+    def size(self) -> tuple:
+        """
+        (width, height) of the image; lazy states read it from the png header rather than decoding it
+        """
+        if self._image is None and self._path is not None:
+            ihdr = read_ihdr(self._path)
+            return ihdr.width, ihdr.height
+        return self.image.size
+
+    def encode(self, profile: str = "default") -> EncodedPNG:
+        """
+        Gets the state as png. With the default profile a state that came from a png and hasn't had its image replaced
+        is passed through without decoding / encoding it again.
+        NOTE: Editing the image in place (e.g. paste) isn't picked up, assign state.image instead.
+        :param profile: one of PNG_PROFILES, see encode_png
+        """
+        if self.passthrough(profile):
+            count("png.passthrough")
+            if self._encoded is not None:
+                return EncodedPNG(data=self._encoded, default_size=len(self._encoded))
+            with open(self._path, "rb") as f:
+                data = f.read()
+            return EncodedPNG(data=data, default_size=len(data))
+        with span("png.encode", state=self.name, profile=profile) as encode_span:
+            encoded = encode_png(self._read_image(), profile)
+            encode_span.set("bytes", len(encoded.data))
+        count("png.bytes_out", len(encoded.data))
+        return encoded
+
+    def image_buffer(self, profile: str = "default") -> BytesIO:
+        """
+        :param profile: one of PNG_PROFILES, see encode_png
+        """
+        return BytesIO(self.encode(profile).data)
 
     def meta(self) -> dict:
         meta_json = {
@@ -51,7 +177,12 @@ class RSIState:
         return meta_json
 
 
-def meta_json_to_states(rsi_path: str) -> List[RSIState]:
+def meta_json_to_states(rsi_path: str, lazy: bool = False, pool: ImagePool = None) -> List[RSIState]:
+    """
+    :param rsi_path: .rsi directory
+    :param lazy: only read the pngs when each state's image is used, see RSIState
+    :param pool: ImagePool for lazy states
+    """
     meta_json_path = os.path.join(rsi_path, "meta.json")
     with open(meta_json_path, "rb") as f:
         meta_json = json.load(f)
@@ -60,7 +191,27 @@ def meta_json_to_states(rsi_path: str) -> List[RSIState]:
         state_path = os.path.join(rsi_path, f"{state.get('name', '<blank>')}.png")
         rsi_state = RSIState(
             name=state.get("name", "<blank>"),
-            data=Image.open(state_path),
+            data=state_path if lazy else load_png_file(state_path),
+            directions=state.get("directions"),
+            delays=state.get("delays"),
+            lazy=lazy,
+            pool=pool,
+        )
+        rsi_states.append(rsi_state)
+
+    return rsi_states
+
+
+def storage_to_states(storage: RSIStorage) -> List[RSIState]:
+    """
+    Same as meta_json_to_states for any RSIStorage; the png bytes are kept so they can be passed straight through
+    """
+    meta_json = json.loads(storage.read("meta.json"))
+    rsi_states = []
+    for state in meta_json.get("states", []):
+        rsi_state = RSIState(
+            name=state.get("name", "<blank>"),
+            data=storage.read(f"{state.get('name', '<blank>')}.png"),
             directions=state.get("directions"),
             delays=state.get("delays"),
         )
@@ -78,7 +229,15 @@ class RSI:
                  rsi_license: str = "CC-BY-SA-3.0",
                  rsi_copyright: str = None,
                  states: List[RSIState] = None,
+                 lazy: bool = False,
+                 pool: ImagePool = None,
                  ):
+        """
+        :param data: None for a new .rsi or an existing one as a directory path, zip path, BytesIO of a zip or any
+        RSIStorage
+        :param lazy: when loading from a directory only read meta.json up front, see RSIState
+        :param pool: ImagePool for lazy states
+        """
 
         if data is None:
             # Using mutable as arg is bad
@@ -93,24 +252,26 @@ class RSI:
                 self.states = states
             else:
                 self.states = []
-        elif os.path.exists(data):
-            meta_json_path = os.path.join(data, "meta.json")
-            with open(meta_json_path, "rb") as f:
-                meta_json = json.load(f)
+        elif isinstance(data, (BytesIO, RSIStorage)) or os.path.exists(data):
+            storage = get_storage(data)
+            meta_json = json.loads(storage.read("meta.json"))
             self.version = meta_json.get("version")
             self.size = meta_json.get("size")
             self.license = meta_json.get("license")
             self.copyright = meta_json.get("copyright")
-            self.states = meta_json_to_states(data)
-        elif isinstance(data, BytesIO):
-            # TODO: Use temporary directory to store .rsi instead
-            pass
+            if isinstance(storage, DirectoryStorage):
+                self.states = meta_json_to_states(storage.path, lazy=lazy, pool=pool)
+            else:
+                self.states = storage_to_states(storage)
+            # Only close what we opened
+            if storage is not data:
+                storage.close()
         else:
             raise AttributeError
 
     def validate_states(self):
         for state in self.states:
-            if state.image.size[0] % self.size.get('x') != 0 or state.image.size[1] % self.size.get('y') != 0:
+            if state.size[0] % self.size.get('x') != 0 or state.size[1] % self.size.get('y') != 0:
                 raise InvalidRSIStateException("Dimensions for RSIState don't look valid")
 
         return
@@ -125,31 +286,243 @@ class RSI:
         }
         return meta_json
 
-    def save_to(self, path: str) -> None:
+    def save_to(self, path, incremental: bool = False, fsync: bool = True, workers: int = None,
+                profile: str = "default", memo: dict = None) -> SaveReport:
+        """
+        Writes the .rsi to disk. Everything gets written to a sibling staging directory first which is then swapped in
+        so anything loading the .rsi sees either the old or the new version, never a half-written one.
+        :param path: .rsi directory or any RSIStorage. Other storages just get the files written to them and ignore
+        incremental / fsync.
+        :param incremental: If the .rsi already exists only write the states whose pixels changed, remove states that
+        are gone and leave everything else (including meta.json if it's the same) untouched
+        :param fsync: fsync every file before the swap so a crash can't leave the new version partially on disk
+        :param workers: encode states on a thread pool of this size (Pillow lets go of the GIL while compressing).
+        Files are still written one at a time in state order so the output is the same either way.
+        :param profile: png profile for the states, see encode_png. Unchanged states in incremental mode keep whatever
+        encoding they already had.
+        :param memo: dict of already encoded pngs by (content_hash, profile). States with the same pixels as one in
+        there reuse its png instead of being encoded again; pass the same dict to several saves to share it.
+        :return: SaveReport of the states that got encoded
+        """
+        if isinstance(path, DirectoryStorage):
+            path = path.path
+        elif isinstance(path, RSIStorage):
+            return self._save_to_storage(path, workers, profile, memo)
         if not path.endswith(".rsi"):
             raise AttributeError(f"path should end with .rsi")
-        if os.path.exists(path):
+        path = os.path.abspath(path)
+        staging, old = _staging_paths(path)
+        _recover_staging(path)
+        existing = path if incremental and os.path.isdir(path) else None
+        # Not mkdtemp as that'd be 0700 once it's swapped in; this gets the usual umask permissions
+        os.mkdir(staging)
+        try:
+            with span("rsi.save", path=path, states=len(self.states)):
+                report = self._write_files(staging, existing, fsync, workers, profile, memo)
+                if fsync:
+                    _fsync_directory(staging)
+                _swap_directory(staging, path, old)
+                if fsync:
+                    # Makes the renames themselves durable
+                    _fsync_directory(os.path.dirname(path))
+            return report
+        except Exception as e:
+            logger.error(e)
+            shutil.rmtree(staging, ignore_errors=True)
+            raise e
+
+    def _save_to_storage(self, storage: RSIStorage, workers: int = None, profile: str = "default",
+                         memo: dict = None) -> SaveReport:
+        with span("rsi.save", path=repr(storage), states=len(self.states)):
+            storage.write("meta.json", json.dumps(self.meta()).encode())
+            named_states = self._named_states()
+            report = SaveReport()
+            for state, encoded in zip(named_states, self._encode_states(named_states, profile, workers, memo=memo)):
+                with span("rsi.write", state=state.name, bytes=len(encoded.data)):
+                    storage.write(f"{state.name}.png", encoded.data)
+                count("rsi.bytes_written", len(encoded.data))
+                report = report.add(encoded)
+        return report
+
+    def _named_states(self) -> List[RSIState]:
+        named_states = []
+        for state in self.states:
+            if state.name:
+                named_states.append(state)
+            else:
+                logger.warning("No name found for state")
+        return named_states
+
+    @staticmethod
+    def _encode_states(states: List[RSIState], profile: str, workers: int = None, existing: str = None,
+                       memo: dict = None):
+        """
+        Yields each state's EncodedPNG in order, or None where it's unchanged from the existing version
+        """
+        def _encode(state: RSIState):
+            if existing and _png_matches(os.path.join(existing, f"{state.name}.png"), state):
+                return None
             try:
-                os.remove(path)
-            except Exception as e:
-                logger.error(e)
+                if memo is None or state.passthrough(profile):
+                    return state.encode(profile)
+                key = (state.content_hash, profile)
+                if key in memo:
+                    logger.debug(f"Reusing encoded png for {state.name}")
+                    return memo[key]
+                # Threads racing on the same key just both encode it, no harm done
+                return memo.setdefault(key, state.encode(profile))
+            except ValueError as e:
+                logger.critical(f"Unable to save: state name is {state.name}")
                 raise e
+
+        if workers and workers > 1 and len(states) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                yield from executor.map(_encode, states)
+        else:
+            yield from map(_encode, states)
+
+    def _write_files(self, path: str, existing: str = None, fsync: bool = True, workers: int = None,
+                     profile: str = "default", memo: dict = None) -> SaveReport:
+        """
+        Writes meta.json and the states into path
+        :param existing: previous version of the .rsi; anything unchanged from it gets linked across as-is
+        :param workers: thread count for encoding states
+        :param profile: png profile
+        :param memo: see save_to
+        """
+        meta_json = json.dumps(self.meta())
+        if existing and _file_matches(os.path.join(existing, "meta.json"), meta_json.encode()):
+            _link_or_copy(os.path.join(existing, "meta.json"), os.path.join(path, "meta.json"))
         else:
-            os.mkdir(path)
-            meta_path = os.path.join(path, "meta.json")
-            with open(meta_path, "w") as f:
-                json.dump(self.meta(), f)
+            with open(os.path.join(path, "meta.json"), "w") as f:
+                f.write(meta_json)
+                _sync_file(f, fsync)
             logger.info("Created meta.json")
-            for state in self.states:
-                if state.name:
-                    state_path = os.path.join(path, f"{state.name}.png")
-                    try:
-                        state.image.save(state_path)
-                    except ValueError as e:
-                        logger.critical(f"Unable to save: state name is {state.name} and attempted file path is {state_path}")
-                        raise e
-                else:
-                    logger.warning("No name found for state")
+
+        named_states = self._named_states()
+        encoded_states = self._encode_states(named_states, profile, workers, existing, memo)
+        report = self._write_states(path, existing, fsync, named_states, encoded_states)
+
+        if existing:
+            state_files = set(f"{x.name}.png" for x in named_states)
+            for file in os.listdir(existing):
+                if file.endswith(".png") and file not in state_files:
+                    logger.info(f"Removing old state {file}")
+                elif file != "meta.json" and file not in state_files:
+                    # Not ours so carry it across
+                    _link_or_copy(os.path.join(existing, file), os.path.join(path, file))
+        return report
+
+    @staticmethod
+    def _write_states(path: str, existing: str, fsync: bool, states: List[RSIState], encoded_states) -> SaveReport:
+        report = SaveReport()
+        encoded: EncodedPNG
+        for state, encoded in zip(states, encoded_states):
+            state_path = os.path.join(path, f"{state.name}.png")
+            if encoded is None:
+                logger.debug(f"Skipping unchanged state {state.name}")
+                _link_or_copy(os.path.join(existing, f"{state.name}.png"), state_path)
+                continue
+            with span("rsi.write", state=state.name, bytes=len(encoded.data)):
+                with open(state_path, "wb") as f:
+                    f.write(encoded.data)
+                    _sync_file(f, fsync)
+            count("rsi.bytes_written", len(encoded.data))
+            report = report.add(encoded)
+        return report
+
+
+def _sync_file(f, fsync: bool) -> None:
+    if fsync:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_directory(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Windows can't open directories
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _link_or_copy(source: str, target: str) -> None:
+    """
+    Hardlinking keeps the file byte-identical with the same mtime; copy2 does the same where links aren't possible
+    """
+    if os.path.isdir(source):
+        shutil.copytree(source, target)
+        return
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _staging_paths(path: str) -> tuple:
+    """
+    :return: (staging, old) siblings of path used while saving. They're fixed so a crashed save can be found again,
+    which does mean two saves to the same .rsi at once aren't supported.
+    """
+    parent, name = os.path.split(path)
+    return os.path.join(parent, f".{name}.tmp"), os.path.join(parent, f".{name}.old")
+
+
+def _recover_staging(path: str) -> None:
+    """
+    Cleans up after a save that crashed part way. If it died between the two renames of _swap_directory path is gone
+    and the previous version is only in the .old directory, so that gets moved back.
+    """
+    staging, old = _staging_paths(path)
+    if os.path.exists(old):
+        if os.path.exists(path):
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            logger.warning(f"Restoring {path} from an interrupted save")
+            os.rename(old, path)
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+
+
+def _swap_directory(staging: str, path: str, old: str) -> None:
+    """
+    Moves staging to path. If path exists it's moved aside to old first and only deleted once the new version is in
+    place, or moved back if that fails.
+    """
+    if not os.path.exists(path):
+        os.rename(staging, path)
+        return
+    os.rename(path, old)
+    try:
+        os.rename(staging, path)
+    except Exception:
+        os.rename(old, path)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _file_matches(path: str, data: bytes) -> bool:
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read() == data
+
+
+def _png_matches(path: str, state: RSIState) -> bool:
+    """
+    Whether the png at path already has the same pixels as the state. Decoding it is a lot cheaper than encoding again.
+    """
+    if not os.path.isfile(path):
+        return False
+    try:
+        with Image.open(path) as existing:
+            return existing.size == state.size and pixel_hash(existing) == state.content_hash
+    except (OSError, ValueError):
+        return False
 
 
 def _get_rsi(data):
@@ -0,0 +1,115 @@
+from logging import Logger, getLogger
+from typing import Dict, Tuple
+
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger: Logger = getLogger(__name__)
+
+
+QUADRANTS = ("nw", "ne", "se", "sw")
+
+# Output state -> which source state each quadrant (in QUADRANTS order) comes from. The quadrant itself never moves,
+# e.g. state1's north-west corner is the north-west corner of state14.
+# These should be different technically but eh (0/2, 1/3, 4/6 and 5/7 come out the same)
+WALL_JUNCTIONS: Dict[int, Tuple[int, int, int, int]] = {
+    0: (0, 0, 0, 0),
+    1: (14, 11, 13, 7),
+    2: (0, 0, 0, 0),
+    3: (14, 11, 13, 7),
+    4: (7, 14, 11, 13),
+    5: (15, 15, 15, 15),
+    6: (7, 14, 11, 13),
+    7: (15, 15, 15, 15),
+}
+
+# Every source state the junctions need
+WALL_SOURCES = sorted({x for sources in WALL_JUNCTIONS.values() for x in sources})
+
+
+def _quadrant_boxes(size: int) -> Dict[str, tuple]:
+    half = size // 2
+    return {
+        "nw": (0, 0, half, half),
+        "ne": (half, 0, size, half),
+        "se": (half, half, size, size),
+        "sw": (0, half, half, size),
+    }
+
+
+def _corner_offsets(size: int) -> Dict[str, tuple]:
+    # Where each quadrant of a tile ends up on the (size * 2) square corner sheet
+    half = size // 2
+    return {
+        "se": (half, half),
+        "nw": (size, 0),
+        "ne": (half, size),
+        "sw": (size, size + half),
+    }
+
+
+def split_quadrants(image: Image.Image, size: int = 32) -> dict:
+    """
+    Splits the first tile of an image into its 4 corners
+    :return: quadrant name -> (size / 2) square; numpy arrays if numpy is around otherwise images
+    """
+    if image.size != (size, size):
+        # Crop pads with transparency if the image is too small
+        image = image.crop((0, 0, size, size))
+    if numpy is None:
+        return {quadrant: image.crop(box) for quadrant, box in _quadrant_boxes(size).items()}
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    tile = numpy.asarray(image)
+    return {quadrant: tile[top:bottom, left:right] for quadrant, (left, top, right, bottom)
+            in _quadrant_boxes(size).items()}
+
+
+def corner_image(quadrants: dict, size: int = 32) -> Image.Image:
+    """
+    Lays out a tile's quadrants as the 4 direction corner sheet the smoothing system uses
+    :param quadrants: quadrant name -> corner, see split_quadrants
+    """
+    offsets = _corner_offsets(size)
+    if numpy is None:
+        result = Image.new(mode="RGBA", size=(size * 2, size * 2))
+        for quadrant, (x, y) in offsets.items():
+            result.paste(quadrants[quadrant], box=(x, y))
+        return result
+    half = size // 2
+    result = numpy.zeros((size * 2, size * 2, 4), dtype=numpy.uint8)
+    for quadrant, (x, y) in offsets.items():
+        result[y:y + half, x:x + half] = quadrants[quadrant]
+    return Image.fromarray(result)
+
+
+def cornerise_image(original: Image.Image, size: int = 32) -> Image.Image:
+    return corner_image(split_quadrants(original, size), size)
+
+
+def wall_junction_images(sources: Dict[int, Image.Image], size: int = 32) -> Dict[int, Image.Image]:
+    """
+    Builds every wall junction state from the byond smoothing states
+    :param sources: state number -> image for each of WALL_SOURCES
+    :param size: tile size
+    :return: junction number -> corner sheet. Junctions made from the same corners share the same image.
+    """
+    missing = [x for x in WALL_SOURCES if x not in sources]
+    if missing:
+        raise AttributeError(f"Missing wall states {missing}")
+    # Every source only gets split the once
+    quadrants = {state: split_quadrants(sources[state], size) for state in WALL_SOURCES}
+    built = {}
+    result = {}
+    for junction, junction_sources in WALL_JUNCTIONS.items():
+        if junction_sources not in built:
+            built[junction_sources] = corner_image(
+                {quadrant: quadrants[state][quadrant] for quadrant, state in zip(QUADRANTS, junction_sources)},
+                size,
+            )
+        result[junction] = built[junction_sources]
+    return result
@@ -0,0 +1,156 @@
+import os
+import zipfile
+from io import BytesIO
+from logging import Logger, getLogger
+from typing import Dict, List
+
+logger: Logger = getLogger(__name__)
+
+
+class RSIStorage:
+    """
+    Somewhere the files of an .rsi (meta.json and the state pngs) can be read from / written to.
+    Names are relative to the .rsi e.g. "meta.json" or "icon.png".
+    """
+    def read(self, name: str) -> bytes:
+        raise NotImplementedError
+
+    def write(self, name: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def names(self) -> List[str]:
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        return name in self.names()
+
+    def sub(self, name: str) -> "RSIStorage":
+        """
+        Storage for a nested directory, e.g. one .rsi of many when converting a whole .dmi
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DirectoryStorage(RSIStorage):
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self, name: str) -> bytes:
+        with open(os.path.join(self.path, name), "rb") as f:
+            return f.read()
+
+    def write(self, name: str, data: bytes) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(data)
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return [x for x in os.listdir(self.path) if os.path.isfile(os.path.join(self.path, x))]
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def sub(self, name: str) -> "DirectoryStorage":
+        return DirectoryStorage(os.path.join(self.path, name))
+
+    def __repr__(self) -> str:
+        return f"DirectoryStorage({self.path})"
+
+
+class MemoryStorage(RSIStorage):
+    def __init__(self, mapping: Dict[str, bytes] = None, prefix: str = ""):
+        """
+        :param mapping: name -> bytes; nested storages share it with their names prefixed
+        :param prefix: e.g. "lamp.rsi/"
+        """
+        self.mapping = mapping if mapping is not None else {}
+        self.prefix = prefix
+
+    def read(self, name: str) -> bytes:
+        try:
+            return self.mapping[self.prefix + name]
+        except KeyError:
+            raise FileNotFoundError(f"{self.prefix}{name}")
+
+    def write(self, name: str, data: bytes) -> None:
+        self.mapping[self.prefix + name] = bytes(data)
+
+    def names(self) -> List[str]:
+        return [x[len(self.prefix):] for x in self.mapping
+                if x.startswith(self.prefix) and "/" not in x[len(self.prefix):]]
+
+    def exists(self, name: str) -> bool:
+        return self.prefix + name in self.mapping
+
+    def sub(self, name: str) -> "MemoryStorage":
+        return MemoryStorage(self.mapping, f"{self.prefix}{name}/")
+
+    def __repr__(self) -> str:
+        return f"MemoryStorage({self.prefix})"
+
+
+class ZipStorage(RSIStorage):
+    def __init__(self, file, mode: str = "r", prefix: str = "", archive: zipfile.ZipFile = None):
+        """
+        :param file: path / BytesIO of the archive
+        :param mode: zipfile mode; writes are append-only so each name should only get written once
+        :param prefix: e.g. "lamp.rsi/" if the archive holds more than the one .rsi
+        :param archive: already open ZipFile, used by sub
+        """
+        self._owner = archive is None
+        self.archive = archive if archive is not None else zipfile.ZipFile(file, mode)
+        self.prefix = prefix
+
+    def read(self, name: str) -> bytes:
+        try:
+            return self.archive.read(self.prefix + name)
+        except KeyError:
+            raise FileNotFoundError(f"{self.prefix}{name}")
+
+    def write(self, name: str, data: bytes) -> None:
+        # pngs are already deflated so compressing them again just burns time
+        compression = zipfile.ZIP_STORED if name.endswith(".png") else zipfile.ZIP_DEFLATED
+        self.archive.writestr(self.prefix + name, data, compress_type=compression)
+
+    def names(self) -> List[str]:
+        return [x[len(self.prefix):] for x in self.archive.namelist()
+                if x.startswith(self.prefix) and "/" not in x[len(self.prefix):]]
+
+    def sub(self, name: str) -> "ZipStorage":
+        return ZipStorage(None, prefix=f"{self.prefix}{name}/", archive=self.archive)
+
+    def close(self) -> None:
+        if self._owner:
+            self.archive.close()
+
+    def __repr__(self) -> str:
+        return f"ZipStorage({self.archive.filename or '<memory>'}:{self.prefix})"
+
+
+def get_storage(data) -> RSIStorage:
+    """
+    Works out storage for an existing .rsi
+    :param data: RSIStorage / .rsi directory / zip path / BytesIO of a zip
+    """
+    if isinstance(data, RSIStorage):
+        return data
+    elif isinstance(data, BytesIO):
+        data.seek(0)
+        return ZipStorage(data)
+    elif os.path.isdir(data):
+        return DirectoryStorage(data)
+    elif os.path.isfile(data) and zipfile.is_zipfile(data):
+        return ZipStorage(data)
+    else:
+        raise AttributeError(f"Unable to get storage for {type(data)}")
@@ -1,10 +1,17 @@
-from src.dmi import DMI, DMIState
+from src.dmi import DMI, DMIState, write_dmi
 from src.rsi import RSI, RSIState
-from typing import List
-from requests import Session
+from src.cache import data_bytes, get_cache
+from src.storage import DirectoryStorage, RSIStorage
+from src.fetch import Fetcher, get_default_fetcher
+from src.instrumentation import count, instrumented, span
+from src.grouping import get_grouping_rule, group_states
+from src.dedupe import DuplicateReport, dedupe_states
+from src.smoothing import WALL_SOURCES, wall_junction_images
+from typing import List, Optional
 from io import BytesIO
 from logging import Logger, getLogger
 from PIL import Image, ImageChops
+import hashlib
 import os
 from time import sleep
 
@@ -14,17 +21,50 @@ logger: Logger = getLogger(__name__)
 
 # Ghetto: used for guns
 REPO_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+GUN_INHANDS = [os.path.join(REPO_DIRECTORY, "textures", f"inhand-{x}.png") for x in ["left", "right"]]
+
+
+def _file_hash(path: str) -> Optional[str]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _single_group_name(rsi_path, mode: str) -> str:
+    if not isinstance(rsi_path, RSIStorage):
+        return f"{rsi_path}"
+    # The repr would end up in the .rsi name otherwise
+    location = getattr(rsi_path, "path", None) or getattr(rsi_path, "prefix", "")
+    return os.path.basename(location.rstrip("/\\")) or f"{mode}"
 
 
 # TODO: That DRY violation
-def convert_dmi_to_rsi(dmi_data, rsi_path: str, **kwargs) -> None:
+@instrumented("convert_dmi_to_rsi")
+def convert_dmi_to_rsi(dmi_data, rsi_path: str, cache=None, workers: int = None, profile: str = "default",
+                       **kwargs) -> None:
     """
     Converts source dmi file to target rsi file
     :param dmi_data: path / BytesIO of .dmi file
-    :param rsi_path: path to new rsi file
+    :param rsi_path: path to new rsi file or an RSIStorage
+    :param cache: ConversionCache / cache directory; if the same input was converted before its output gets restored.
+    Only works with a path for rsi_path.
+    :param workers: thread count for encoding the states, see RSI.save_to
+    :param profile: png profile for the states, see encode_png
     :param index: If specified will only convert that state
     :return: None
     """
+    cache = get_cache(cache)
+    cache_key = None
+    if cache and isinstance(rsi_path, RSIStorage):
+        raise AttributeError("cache can only be used when writing to a directory")
+    if cache:
+        dmi_data = data_bytes(dmi_data)
+        cache_key = cache.key(dmi_data, function="convert_dmi_to_rsi", profile=profile,
+                              rsi_copyright=kwargs.get("rsi_copyright"))
+        if cache.restore(cache_key, rsi_path, clear=True):
+            return
+        dmi_data = BytesIO(dmi_data)
     dmi = DMI(dmi_data)
     rsi_states = []
     for state in dmi.states:
@@ -38,284 +78,142 @@ def convert_dmi_to_rsi(dmi_data, rsi_path: str, **kwargs) -> None:
     rsi = RSI(
         size={"x": dmi.width, "y": dmi.height},
         rsi_copyright=kwargs.get("rsi_copyright"),
-        states=rsi_states,
+        states=dedupe_states(rsi_states),
     )
-    rsi.save_to(rsi_path)
+    # Identical states only get encoded once
+    report = rsi.save_to(rsi_path, workers=workers, profile=profile, memo={})
+    logger.info(f"{rsi_path}: {report}")
+    if cache:
+        cache.store(cache_key, rsi_path)
     return
 
 
-def _strip_numbers(string: str) -> str:
-    return "".join([c for c in string if not c.isdigit() and c not in ["-"]])
-
-
-def cornerise_image(original: Image.Image) -> Image.Image:
-    whole_image = Image.new(mode="RGBA", size=(64, 64))
-    # Each state will get split into 4 corners
-    se_corner = original.copy().crop((16, 16, 32, 32))
-    whole_image.paste(se_corner, box=(16, 16, 32, 32))
-
-    nw_corner = original.copy().crop((0, 0, 16, 16))
-    whole_image.paste(nw_corner, box=(32, 0, 48, 16))
-
-    ne_corner = original.copy().crop((16, 0, 32, 16))
-    whole_image.paste(ne_corner, box=(16, 32, 32, 48))
-
-    sw_corner = original.copy().crop((0, 16, 16, 32))
-    whole_image.paste(sw_corner, box=(32, 48, 48, 64))
-    return whole_image
-
-
-def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, **kwargs) -> None:
+def convert_rsi_to_dmi(rsi_data, dmi_path: str = None) -> bytes:
+    """
+    Converts an .rsi back into a .dmi, the inverse of convert_dmi_to_rsi. Handy for checking round trips.
+    :param rsi_data: RSI or anything RSI can load
+    :param dmi_path: If specified the .dmi also gets written there
+    :return: .dmi bytes
+    """
+    rsi = rsi_data if isinstance(rsi_data, RSI) else RSI(rsi_data)
+    dmi_states = []
+    for state in rsi.states:
+        if not state.name:
+            continue
+        delays = state.delays or []
+        # Loaded from meta.json it's a list per direction
+        if delays and isinstance(delays[0], list):
+            delays = delays[0]
+        dmi_states.append(DMIState(
+            metadata={
+                "name": state.name,
+                "dirs": state.directions,
+                "frames": max(len(delays), 1),
+                "delay": delays or None,
+            },
+            image=state.image,
+        ))
+    data = write_dmi(dmi_states, size=(rsi.size.get("x"), rsi.size.get("y")))
+    if dmi_path:
+        with open(dmi_path, "wb") as f:
+            f.write(data)
+    return data
+
+
+@instrumented("convert_dmi_to_many_rsi")
+def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, cache=None, workers: int = None,
+                            profile: str = "default", duplicates: DuplicateReport = None, group_name: str = None,
+                            **kwargs) -> None:
     """
     Converts source dmi file to many target rsi file
     WARNING: This will be far from perfect
     :param dmi_data: path / BytesIO of .dmi file
-    :param rsi_path: path to new rsi file
+    :param rsi_path: directory to put the new rsi files in or an RSIStorage
+    :param cache: ConversionCache / cache directory; if the same input was converted before its output gets restored.
+    Only works with a path for rsi_path.
+    :param workers: thread count for encoding the states of each rsi, see RSI.save_to
+    :param profile: png profile for the states, see encode_png
+    :param duplicates: DuplicateReport to record every written state in, for finding identical states across the
+    .rsi files. Nothing gets recorded if the output came from the cache.
+    :param group_name: name of the one .rsi for modes that don't split the sheet (door). Defaults to rsi_path for a
+    path or the last part of a storage's path / prefix.
     :param index: If specified will only convert that state
     :return: None
     """
-    if not os.path.isdir(rsi_path):
+    cache = get_cache(cache)
+    cache_key = None
+    if cache and isinstance(rsi_path, RSIStorage):
+        raise AttributeError("cache can only be used when writing to a directory")
+    if cache:
+        dmi_data = data_bytes(dmi_data)
+        icons_hash = None
+        if kwargs.get("icons"):
+            icons_bytes = data_bytes(kwargs["icons"])
+            icons_hash = cache.key(icons_bytes)
+            kwargs["icons"] = BytesIO(icons_bytes)
+        # guns also pulls in the inhands from textures/ so they're an input too
+        inhands_hash = [_file_hash(x) for x in GUN_INHANDS] if mode == "guns" else None
+        cache_key = cache.key(dmi_data, function="convert_dmi_to_many_rsi", mode=mode, profile=profile,
+                              icons=icons_hash, inhands=inhands_hash, rsi_copyright=kwargs.get("rsi_copyright"))
+        if cache.restore(cache_key, rsi_path):
+            return
+        dmi_data = BytesIO(dmi_data)
+    if not isinstance(rsi_path, RSIStorage) and not os.path.isdir(rsi_path):
         os.mkdir(rsi_path)
         logger.info(f"Created directory {rsi_path}")
-    dmi = DMI(dmi_data)
+    elif isinstance(rsi_path, DirectoryStorage):
+        # Each .rsi gets staged next to where it ends up so that has to exist
+        os.makedirs(rsi_path.path, exist_ok=True)
+    # Only what this call wrote gets cached in case rsi_path already has other stuff in it
+    written = []
+    # Most modes only touch a handful of states per group so only slice them as needed
+    dmi = DMI(dmi_data, lazy=True)
+    # Shared by every .rsi so a state that turns up in several of them only gets encoded once
+    memo = {}
     # Find probable groupings, iterate over similar states, then output.
-    # Doesn't even matter if dupe because this is hacky
     # This will ignore blank stuff which means it will likely miss things with bad names
-    dmi_groups = []
-    if mode in ["guns", ]:
-        dmi_groups += ["-".join(x.name.split("-")[0:-1]) if len(x.name.split("-")) > 1 else x.name
-                        for x in dmi.states if x.name]
-    if mode in ["mags", ]:
-        dmi_groups += ["-".join(x.name.split("-")[0:-1]) for x in dmi.states if x.name and x.name[-1].isdigit()]
-        dmi_groups += [x.name for x in dmi.states if len([c for c in x.name if not c.isdigit()]) == len(x.name)]
-    if mode in ["ammo_boxes", ]:
-        dmi_groups += ["-".join(x.name.split("-")[0:-1]) for x in dmi.states if x.name and x.name.count("-") >= 2]
-        dmi_groups += [x.name.split("-")[0] for x in dmi.states
-                       if x.name and x.name.count("-") <= 1 and x.name.split("-")[-1].isdigit()]
-    if mode in [None, "wall"]:
-        dmi_groups += [_strip_numbers(x.name) for x in dmi.states if _strip_numbers(x.name)]
-    if mode == "door":
-        dmi_groups = [f"{rsi_path}"]
-    if not dmi_groups:
-        dmi_groups += [x.name for x in dmi.states]
-
-    dmi_groups = set([x for x in dmi_groups if x != ""])
+    rule = get_grouping_rule(mode)
+    # Each state gets put into its group(s) in one pass rather than rescanning every state per group
+    with span("grouping", mode=mode, states=len(dmi.states)) as grouping_span:
+        dmi_groups = group_states(dmi.states, rule, single_group=group_name or _single_group_name(rsi_path, mode))
+        grouping_span.set("groups", len(dmi_groups))
+    count("groups", len(dmi_groups))
     icon_dmi = None
     if kwargs.get("icons"):
         # Try and match icons as they use lower res images and are a bit more polished (rather than just resizing)
-        icon_dmi = DMI(kwargs['icons'])
-    for group in dmi_groups:
+        icon_dmi = DMI(kwargs['icons'], lazy=True)
+    for group, members in dmi_groups.items():
         logger.debug(f"Group is {group}")
         rsi_states = []
-        if mode == "door":
-            for state in dmi.states:
-                name = {
-                    "door_closed": "closed",
-                    "door_closing": "closing_unlit",
-                    "door_closing_stat": "closing",
-                    "door_deny": "deny",
-                    "door_locked": "locked",
-                    "door_open": "open",
-                    "door_opening": "opening_unlit",
-                    "door_opening_stat": "opening",
-                    "door_spark": "spark",
-                    "o_door_closing": "panel_closing",
-                    "o_door_opening": "panel_opening",
-                }.get(state.name, state.name)
-
-                rsi_state = RSIState(
-                    data=state.image,
-                    name=name,
-                    directions=state.dirs,
-                    delays=state.delay,
-                )
-                rsi_states.append(rsi_state)
-        if mode == "wall" and f"{group}0" in [x.name for x in dmi.states]:
-
+        if mode == "wall" and dmi.get_state(f"{group}0") is not None:
+            sources = {x: dmi.get_state(f"{group}{x}") for x in WALL_SOURCES}
+            sources = {x: state.image for x, state in sources.items() if state is not None}
             # If it's wall mode then you also need a "full" derived from <statename>0
             rsi_states.append(
                 RSIState(
-                    data=dmi.states[[x.name for x in dmi.states].index(f"{group}0")].image,
+                    data=sources[0],
                     name="full",
                     directions=1,
                     delays=None,
             ))
-            # state0
-            rsi_states.append(
-                RSIState(
-                    data=cornerise_image(dmi.states[[x.name for x in dmi.states].index(f"{group}0")].image),
-                    name=f"{group}0",
-                    directions=4,
-                    delays=None,
-            ))
-            # state2
-            rsi_states.append(
-                RSIState(
-                    data=cornerise_image(dmi.states[[x.name for x in dmi.states].index(f"{group}0")].image),
-                    name=f"{group}2",
+            for junction, image in wall_junction_images(sources).items():
+                rsi_states.append(RSIState(
+                    data=image,
+                    name=f"{group}{junction}",
                     directions=4,
                     delays=None,
                 ))
-            # state1
-            whole_image = Image.new(mode="RGBA", size=(64, 64), color=255)
-            # top, bottom, right, left
-            # - top
-            nw_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}14")].image
-            nw_corner = nw_corner.crop(box=(0, 0, 16, 16))
-            whole_image.paste(nw_corner, box=(0, 0, 16, 16))
-
-            # - bottom
-            se_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}13")].image
-            se_corner = se_corner.crop(box=(16, 16, 32, 32))
-            whole_image.paste(se_corner, box=(16, 16, 32, 32))
-
-            # - right
-            ne_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}11")].image
-            ne_corner = ne_corner.crop(box=(16, 0, 32, 16))
-            whole_image.paste(ne_corner, box=(16, 0, 32, 16))
-
-            # - left
-            sw_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}7")].image
-            sw_corner = sw_corner.crop(box=(0, 16, 16, 32))
-            whole_image.paste(sw_corner, box=(0, 16, 16, 32))
-
-            rsi_states.append(RSIState(
-                data=cornerise_image(whole_image),
-                name=f"{group}1",
-                directions=4,
-                delays=None,
-            ))
-            rsi_states.append(RSIState(
-                data=cornerise_image(whole_image),
-                name=f"{group}3",
-                directions=4,
-                delays=None,
-            ))
-
-            # state4
-            whole_image = Image.new(mode="RGBA", size=(64, 64), color=255)
-            # top, bottom, right, left
-            # - left
-            nw_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}7")].image
-            nw_corner = nw_corner.crop(box=(0, 0, 16, 16))
-            whole_image.paste(nw_corner, box=(0, 0, 16, 16))
-
-            # - right
-            se_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}11")].image
-            se_corner = se_corner.crop(box=(16, 16, 32, 32))
-            whole_image.paste(se_corner, box=(16, 16, 32, 32))
-
-            # - top
-            ne_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}14")].image
-            ne_corner = ne_corner.crop(box=(16, 0, 32, 16))
-            whole_image.paste(ne_corner, box=(16, 0, 32, 16))
-
-            # - bottom
-            sw_corner: Image.Image = dmi.states[[x.name for x in dmi.states].index(f"{group}13")].image
-            sw_corner = sw_corner.crop(box=(0, 16, 16, 32))
-            whole_image.paste(sw_corner, box=(0, 16, 16, 32))
-
-            rsi_states.append(RSIState(
-                data=cornerise_image(whole_image),
-                name=f"{group}4",
-                directions=4,
-                delays=None,
-            ))
-            rsi_states.append(RSIState(
-                data=cornerise_image(whole_image),
-                name=f"{group}6",
-                directions=4,
-                delays=None,
-            ))
-
-            # These should be different technically but eh
-            # state5
-            rsi_states.append(RSIState(
-                data=cornerise_image(dmi.states[[x.name for x in dmi.states].index(f"{group}15")].image),
-                name=f"{group}5",
-                directions=4,
-                delays=None,
-            ))
-
-            # state7
-            rsi_states.append(RSIState(
-                data=cornerise_image(dmi.states[[x.name for x in dmi.states].index(f"{group}15")].image),
-                name=f"{group}7",
-                directions=4,
-                delays=None,
-            ))
             rsi_states.sort(key=lambda x: x.name)
 
-        elif mode == "guns":
-            for state in dmi.states:
-                if state.name.startswith(group):
-                    rsi_state = RSIState(
-                        data=state.image,
-                        name=state.name,
-                        directions=state.dirs,
-                        delays=state.delay,
-                    )
-                    rsi_states.append(rsi_state)
-        # For this we'll be a little more strict
-        elif mode == "ammo_boxes":
-            for state in dmi.states:
-                # If 2 dashes it's probs box38-rubber-30
-                # If not it's probs box38-30
-                if state.name.count("-") == 2:
-                    state_name = "-".join(state.name.split("-")[0:-1])
-                elif state.name.count("-") == 1 and state.name.split("-")[-1].isdigit():
-                    state_name = state.name.split("-")[0]
-                else:
-                    state_name = state.name
-                if state_name == group:
-                    rsi_state = RSIState(
-                        data=state.image,
-                        name=state.name,
-                        directions=state.dirs,
-                        delays=state.delay,
-                    )
-                else:
-                    continue
-                rsi_states.append(rsi_state)
-        elif mode == "mags":
-            for state in dmi.states:
-                if "".join(state.name.split("-")[0:-1]) == group:
-                    rsi_state = RSIState(
-                        data=state.image,
-                        name=state.name,
-                        directions=state.dirs,
-                        delays=state.delay,
-                    )
-                    rsi_states.append(rsi_state)
-        elif mode in ["food"]:
-            for state in dmi.states:
-                if state.name == group:
-                    rsi_state = RSIState(
-                        data=state.image,
-                        name=state.name,
-                        directions=state.dirs,
-                        delays=state.delay,
-                    )
-                    rsi_states.append(rsi_state)
-        elif mode in ["suits"]:
-            for state in dmi.states:
-                if state.name == group:
-                    rsi_states.append(RSIState(
-                        data=state.image,
-                        name="equipped-OUTERCLOTHING",
-                        directions=state.dirs,
-                        delays=state.delay
-                    ))
         else:
-            for state in dmi.states:
-                if state.name.startswith(group):
-                    rsi_state = RSIState(
-                        data=state.image,
-                        name=state.name,
-                        directions=state.dirs,
-                        delays=state.delay,
-                    )
-                    rsi_states.append(rsi_state)
+            for state in members:
+                rsi_state = RSIState(
+                    data=state.image,
+                    name=rule.rename(state.name) if rule.rename else state.name,
+                    directions=state.dirs,
+                    delays=state.delay,
+                )
+                rsi_states.append(rsi_state)
         if mode == "helmets":
             if len(rsi_states) == 1:
                 rsi_states[0].name = "equipped-HELMET"
@@ -325,38 +223,10 @@ def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, **kwargs) -> Non
         # TODO: Just break these out at this point
         # Get unique
         if mode == "ammo_boxes":
-            rsi_states = list(set(rsi_states))
-        if mode in ["ammo_boxes", "guns", "mags"] and rsi_states:
+            rsi_states = dedupe_states(rsi_states)
+        if rule.order is not None and rsi_states:
             logger.info("Correcting steps")
-            sorted_states = sorted(rsi_states, key=lambda x: x.name)
-            # If guns: Try sorting by: Ammo account, full / empty, slide, loaded, etc.
-            if mode == "guns":
-                # AK, AK-20, AK-30 or saber, saber-full
-                if len([x for x in sorted_states if "-" in x.name]) == len(sorted_states) - 1:
-                    new_states = []
-                    # First
-                    new_states.append([x for x in sorted_states if "-" not in x.name][0])
-                    # Rest
-                    new_states.extend(sorted([x for x in sorted_states if "-" in x.name],
-                                             key=lambda x:
-                                             int(x.name.split("-")[-1]) if x.name.split("-")[-1].isdigit() else
-                                             x.name.split("-")[-1]))
-                    sorted_states = new_states
-                # taser, taser0, taser25
-                if len([x for x in sorted_states if "-" not in x.name and x.name[-1].isdigit()]) == \
-                        len(sorted_states) - 1:
-                    new_states = []
-                    # First
-                    new_states.extend([x for x in sorted_states if not [c for c in x.name if c.isdigit()]][0:1])
-                    # Rest
-                    new_states.extend(sorted([x for x in sorted_states if [c for c in x.name if c.isdigit()]],
-                                             key=lambda x: "".join([c for c in x.name if c.isdigit()])))
-                    sorted_states = new_states
-            elif mode == "ammo_boxes":
-                # Sort by ammo acount at the box
-                sorted_states = sorted(sorted_states, key=lambda x: int(x.name.split("-")[-1]) if x.name.split("-")[-1].isdigit() else -1)
-            else:
-                pass
+            sorted_states = rule.order(rsi_states)
 
             if mode == "mags":
                 for idx, state in enumerate(sorted_states):
@@ -365,8 +235,6 @@ def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, **kwargs) -> Non
                 for idx, state in enumerate(sorted_states[1:]):
                     state.name = f"{group.lower()}-{idx}"
                 sorted_states[0].name = group.lower()
-            else:
-                raise Exception
             # Also add a base state for the icon
             if mode in ["mags"]:
                 last_state = sorted_states[-1]
@@ -380,13 +248,13 @@ def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, **kwargs) -> Non
                 # Also need to add the old inhands
                 sorted_states.extend([
                     RSIState(
-                        data=os.path.join(REPO_DIRECTORY, "textures", "inhand-left.png"),
+                        data=GUN_INHANDS[0],
                         name="inhand-left",
                         directions=4,
                         delays=[1.0,],
                     ),
                     RSIState(
-                        data=os.path.join(REPO_DIRECTORY, "textures", "inhand-right.png"),
+                        data=GUN_INHANDS[1],
                         name="inhand-right",
                         directions=4,
                         delays=[1.0,],
@@ -423,10 +291,9 @@ def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, **kwargs) -> Non
                     left_image = base_image.copy().crop(box=(42, 32, 58, 48))
 
                 # Try and match an icon, otherwise just resize one
-                matched_icons = [x for x in icon_dmi.states if x.name == group] if icon_dmi else None
+                icon_state: DMIState = icon_dmi.get_state(group) if icon_dmi else None
 
-                if matched_icons:
-                    icon_state: DMIState = matched_icons[0]
+                if icon_state:
                     rsi_states.append(RSIState(
                         data=icon_state.image,
                         name="icon",
@@ -519,38 +386,48 @@ def convert_dmi_to_many_rsi(dmi_data, rsi_path: str, mode=None, **kwargs) -> Non
             rsi = RSI(
                 size={"x": dmi.width, "y": dmi.height},
                 rsi_copyright=kwargs.get("rsi_copyright"),
-                states=rsi_states,
+                states=dedupe_states(rsi_states),
             )
-            target = os.path.join(rsi_path, f"{group.lower().replace('-', '_')}.rsi")
+            target_name = f"{group.lower().replace('-', '_')}.rsi"
+            if isinstance(rsi_path, RSIStorage):
+                target = rsi_path.sub(target_name)
+            else:
+                target = os.path.join(rsi_path, target_name)
             logger.info(f"Saved rsi to {target}")
-            rsi.save_to(target)
+            report = rsi.save_to(target, workers=workers, profile=profile, memo=memo)
+            logger.info(f"{target}: {report}")
+            written.append(target_name)
+            if duplicates is not None:
+                duplicates.add(target_name, rsi.states)
+    if cache:
+        cache.store(cache_key, rsi_path, names=written)
     return
 
 
-# TODO: Add some sort of buffer loader via BytesIO to avoid doing this shit. Will require editing the normal classes
-def convert_dmi_url_to_rsi(dmi_url: str, rsi_path: str) -> None:
-    session = Session()
-    response = session.get(dmi_url)
-    response.raise_for_status()
-    buffer = BytesIO()  # Temporary measure as response.content doesn't seem to work
-    buffer.write(response.content)
-    convert_dmi_to_rsi(buffer, rsi_path, rsi_copyright=dmi_url)
+def convert_dmi_url_to_rsi(dmi_url: str, rsi_path: str, fetcher: Fetcher = None, **kwargs) -> None:
+    """
+    :param fetcher: Fetcher to download with; defaults to the shared one so connections / cached responses get reused
+    :param kwargs: passed onto convert_dmi_to_rsi
+    """
+    fetcher = fetcher or get_default_fetcher()
+    buffer = BytesIO(fetcher.get(dmi_url))
+    convert_dmi_to_rsi(buffer, rsi_path, rsi_copyright=dmi_url, **kwargs)
     return
 
 
-def convert_dmi_url_to_many_rsi(dmi_url: str, rsi_path: str, mode=None, **kwargs) -> None:
+def convert_dmi_url_to_many_rsi(dmi_url: str, rsi_path: str, mode=None, fetcher: Fetcher = None, **kwargs) -> None:
+    """
+    :param fetcher: Fetcher to download with; defaults to the shared one so connections / cached responses get reused
+    :param kwargs: icons is a url for the icons .dmi, the rest get passed onto convert_dmi_to_many_rsi
+    """
+    fetcher = fetcher or get_default_fetcher()
+    icons_url = kwargs.pop("icons", None)
     icons_buffer = None
-    session = Session()
-    response = session.get(dmi_url)
-    response.raise_for_status()
-    buffer = BytesIO()  # Temporary measure as response.content doesn't seem to work
-    buffer.write(response.content)
-    if kwargs.get("icons"):
-        icons_buffer = BytesIO()
-        icon_response = session.get(kwargs['icons'])
-        icon_response.raise_for_status()
-        icons_buffer.write(icon_response.content)
-    convert_dmi_to_many_rsi(buffer, rsi_path, rsi_copyright=dmi_url, mode=mode, icons=icons_buffer)
+    bodies = fetcher.get_many([x for x in [dmi_url, icons_url] if x])
+    buffer = BytesIO(bodies[dmi_url])
+    if icons_url:
+        icons_buffer = BytesIO(bodies[icons_url])
+    convert_dmi_to_many_rsi(buffer, rsi_path, rsi_copyright=dmi_url, mode=mode, icons=icons_buffer, **kwargs)
     return
 
 
@@ -0,0 +1,88 @@
+from PIL import Image
+import os
+import random
+import pytest
+from tempfile import TemporaryDirectory
+from src.cli import main
+from src.atlas import MaxRectsPacker, load_atlas, pack_rsis, save_atlas, unpack_atlas
+from src.rsi import RSI, RSIState
+from tests.test_fixtures import temporary_directory
+
+
+def _noise(seed: int, size: tuple) -> Image.Image:
+    rng = random.Random(seed)
+    return Image.frombytes("RGBA", size, bytes(rng.randrange(256) for _ in range(size[0] * size[1] * 4)))
+
+
+def _rsis() -> dict:
+    return {
+        "lamp.rsi": RSI(rsi_copyright="lamp", states=[
+            RSIState(name="off", data=_noise(1, (32, 32))),
+            RSIState(name="on", data=_noise(2, (64, 64)), directions=4, delays=[0.1]),
+            # Same pixels as off
+            RSIState(name="broken", data=_noise(1, (32, 32))),
+        ]),
+        "big.rsi": RSI(size={"x": 48, "y": 24}, states=[
+            RSIState(name="icon", data=_noise(3, (96, 48)), select=["hide"]),
+        ]),
+    }
+
+
+def test_packer_no_overlaps():
+    rng = random.Random(0)
+    packer = MaxRectsPacker(256, 256)
+    placed = []
+    for _ in range(200):
+        rect = packer.insert(rng.randrange(1, 40), rng.randrange(1, 40))
+        if rect is None:
+            continue
+        assert rect.right <= 256 and rect.bottom <= 256
+        assert not any(rect.intersects(x) for x in placed)
+        placed.append(rect)
+    # Should fill a good chunk of the sheet
+    assert sum(x.width * x.height for x in placed) > 256 * 256 * 0.7
+
+
+def test_pack_round_trip():
+    rsis = _rsis()
+    atlas = pack_rsis(rsis)
+    assert len(atlas.sheets) == 1
+    width, height = atlas.sheets[0].size
+    assert width & (width - 1) == 0 and height & (height - 1) == 0
+    # off / broken share their frame
+    off, broken = atlas.index["rsis"]["lamp.rsi"]["states"][0], atlas.index["rsis"]["lamp.rsi"]["states"][2]
+    assert off["frames"] == broken["frames"]
+
+    unpacked = unpack_atlas(atlas)
+    assert list(unpacked) == list(rsis)
+    for name, rsi in rsis.items():
+        assert unpacked[name].meta() == rsi.meta()
+        for original, state in zip(rsi.states, unpacked[name].states):
+            assert state.image.tobytes() == original.image.tobytes()
+
+
+def test_pack_many_sheets(temporary_directory: TemporaryDirectory):
+    rsis = {"a.rsi": RSI(states=[RSIState(name=str(i), data=_noise(i, (32, 32))) for i in range(10)])}
+    atlas = pack_rsis(rsis, max_size=64, padding=1)
+    # 33x33 with padding so only one fits per 64 sheet row / column
+    assert len(atlas.sheets) == 10
+    save_atlas(atlas, temporary_directory.name)
+    unpacked = unpack_atlas(load_atlas(temporary_directory.name))
+    for original, state in zip(rsis["a.rsi"].states, unpacked["a.rsi"].states):
+        assert state.image.tobytes() == original.image.tobytes()
+
+
+def test_pack_too_big():
+    with pytest.raises(AttributeError):
+        pack_rsis({"a.rsi": RSI(states=[RSIState(name="a", data=_noise(0, (32, 32)))])}, max_size=16)
+
+
+def test_cli_atlas(temporary_directory: TemporaryDirectory):
+    paths = []
+    for name, rsi in _rsis().items():
+        path = os.path.join(temporary_directory.name, name)
+        rsi.save_to(path)
+        paths.append(path)
+    output = os.path.join(temporary_directory.name, "out")
+    assert main(["atlas", output, *paths]) == 0
+    assert sorted(unpack_atlas(load_atlas(output))) == ["big.rsi", "lamp.rsi"]
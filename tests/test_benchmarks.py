@@ -0,0 +1,47 @@
+import os
+from tempfile import TemporaryDirectory
+from benchmarks.suite import QUICK_CASES, build_dmi, compare, load_baseline, main, measure_rss
+from tests.test_fixtures import temporary_directory
+
+
+def test_compare_flags_regressions():
+    baseline = {
+        "a/parse": {"seconds": 1.0, "peak_bytes": 100},
+        "a/save": {"seconds": 1.0, "peak_bytes": 100},
+    }
+    results = {
+        "a/parse": {"seconds": 1.2, "peak_bytes": 200},
+        "a/save": {"seconds": 2.0, "peak_bytes": 100},
+        "b/parse": {"seconds": 9.0, "peak_bytes": 900},
+    }
+    regressions = compare(results, baseline, time_threshold=0.25, memory_threshold=0.5)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("a/parse peak_bytes")
+    assert regressions[1].startswith("a/save seconds")
+
+
+def test_benchmark_baseline_round_trip(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "baseline.json")
+    assert main(["--quick", "--repeat", "1", "--stage", "parse", "--save", path]) == 0
+    assert list(load_baseline(path)) == ["4x4x2@32/parse"]
+    # Nothing can be 1000x slower on the same machine
+    assert main(["--quick", "--repeat", "1", "--stage", "parse", "--baseline", path, "--time-threshold", "1000",
+                 "--memory-threshold", "1000"]) == 0
+
+
+def test_compare_rss():
+    baseline = {
+        "a/parse": {"seconds": 1.0, "peak_bytes": 100},
+        "a/save": {"seconds": 1.0, "peak_bytes": 100, "peak_rss_bytes": 1000},
+    }
+    results = {
+        "a/parse": {"seconds": 1.0, "peak_bytes": 100, "peak_rss_bytes": 5000},
+        "a/save": {"seconds": 1.0, "peak_bytes": 100, "peak_rss_bytes": 2000},
+    }
+    # Older baselines without RSS just don't get it compared
+    assert compare(results, baseline) == ["a/save peak_rss_bytes: 1000 -> 2000 (+100%)"]
+
+
+def test_measure_rss():
+    rss = measure_rss(build_dmi(QUICK_CASES[0]), "convert")
+    assert rss is None or rss >= 0
@@ -0,0 +1,56 @@
+from src.bulk import (
+    convert_tree,
+    find_tree_jobs,
+    parse_many_modes,
+)
+from src.cli import main
+from tempfile import TemporaryDirectory
+import os
+from tests.test_fixtures import (
+    synthetic_dmi_buffer,
+    temporary_directory,
+)
+
+
+def _write_tree(root: str) -> None:
+    os.makedirs(os.path.join(root, "objects"))
+    os.makedirs(os.path.join(root, "guns"))
+    for path in ["objects/lamp.dmi", "objects/table.dmi", "guns/pistol.dmi"]:
+        with open(os.path.join(root, path), "wb") as f:
+            f.write(synthetic_dmi_buffer().getvalue())
+    with open(os.path.join(root, "objects", "broken.dmi"), "wb") as f:
+        f.write(b"not a png")
+    with open(os.path.join(root, "objects", "notes.txt"), "w") as f:
+        f.write("ignored")
+
+
+def test_find_tree_jobs(temporary_directory: TemporaryDirectory):
+    source = os.path.join(temporary_directory.name, "icons")
+    _write_tree(source)
+    jobs = find_tree_jobs(source, "out", parse_many_modes(["guns/*.dmi=default"]))
+    assert [x.target for x in jobs] == [
+        os.path.join("out", "guns", "pistol"),
+        os.path.join("out", "objects", "broken.rsi"),
+        os.path.join("out", "objects", "lamp.rsi"),
+        os.path.join("out", "objects", "table.rsi"),
+    ]
+    assert jobs[0].many_mode == "default"
+
+
+def test_convert_tree_isolates_errors(temporary_directory: TemporaryDirectory):
+    source = os.path.join(temporary_directory.name, "icons")
+    output = os.path.join(temporary_directory.name, "rsi")
+    _write_tree(source)
+    summary = convert_tree(source, output, many_modes=[("guns/*.dmi", "default")], workers=2)
+    assert len(summary.results) == 4
+    assert [x.job.source for x in summary.failed] == [os.path.join(source, "objects", "broken.dmi")]
+    assert os.path.isfile(os.path.join(output, "objects", "lamp.rsi", "meta.json"))
+    assert os.path.isdir(os.path.join(output, "guns", "pistol"))
+
+
+def test_cli_convert_tree(temporary_directory: TemporaryDirectory):
+    source = os.path.join(temporary_directory.name, "icons")
+    output = os.path.join(temporary_directory.name, "rsi")
+    _write_tree(source)
+    assert main(["convert-tree", source, output, "-j", "1"]) == 1
+    assert os.path.isfile(os.path.join(output, "objects", "table.rsi", "meta.json"))
@@ -0,0 +1,79 @@
+from src.cache import ConversionCache
+from src import utils
+from tempfile import TemporaryDirectory
+import os
+import pytest
+from tests.test_fixtures import (
+    synthetic_dmi,
+    synthetic_dmi_buffer,
+    temporary_directory,
+)
+
+
+def _read_tree(path: str) -> dict:
+    result = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), "rb") as f:
+            result[name] = f.read()
+    return result
+
+
+def test_cache_hit_skips_conversion(synthetic_dmi, temporary_directory: TemporaryDirectory, monkeypatch):
+    cache = ConversionCache(os.path.join(temporary_directory.name, "cache"))
+    first = os.path.join(temporary_directory.name, "first.rsi")
+    second = os.path.join(temporary_directory.name, "second.rsi")
+    utils.convert_dmi_to_rsi(synthetic_dmi, first, cache=cache)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("Should have been a cache hit")
+
+    monkeypatch.setattr(utils, "DMI", _fail)
+    utils.convert_dmi_to_rsi(synthetic_dmi, second, cache=cache)
+    assert _read_tree(first) == _read_tree(second)
+    # Different copyright is a different key
+    with pytest.raises(AssertionError):
+        utils.convert_dmi_to_rsi(synthetic_dmi, second, cache=cache, rsi_copyright="someone")
+
+
+def test_cache_key_changes_with_params():
+    dmi_bytes = synthetic_dmi_buffer().getvalue()
+    assert ConversionCache.key(dmi_bytes, mode="wall") == ConversionCache.key(dmi_bytes, mode="wall")
+    assert ConversionCache.key(dmi_bytes, mode="wall") != ConversionCache.key(dmi_bytes, mode="guns")
+    assert ConversionCache.key(dmi_bytes) != ConversionCache.key(dmi_bytes + b"\x00")
+
+
+def test_cache_evicts_least_recently_used(temporary_directory: TemporaryDirectory):
+    cache = ConversionCache(os.path.join(temporary_directory.name, "cache"), max_bytes=250)
+    for name in ["a", "b", "c"]:
+        source = os.path.join(temporary_directory.name, name)
+        os.mkdir(source)
+        with open(os.path.join(source, "data"), "wb") as f:
+            f.write(b"0" * 100)
+        cache.store(name, source)
+        # Keep mtimes distinct
+        os.utime(os.path.join(cache.entries_directory, name), (0, ord(name)))
+        cache.evict()
+    assert sorted(os.listdir(cache.entries_directory)) == ["b", "c"]
+    assert cache.restore("b", os.path.join(temporary_directory.name, "restored")) is True
+    assert cache.restore("a", os.path.join(temporary_directory.name, "restored")) is False
+
+
+def test_cache_restore_replaces_stale_output(temporary_directory: TemporaryDirectory):
+    cache = ConversionCache(os.path.join(temporary_directory.name, "cache"))
+    source = os.path.join(temporary_directory.name, "source")
+    os.makedirs(os.path.join(source, "a.rsi"))
+    with open(os.path.join(source, "a.rsi", "new.png"), "wb") as f:
+        f.write(b"new")
+    cache.store("key", source)
+
+    target = os.path.join(temporary_directory.name, "target")
+    os.makedirs(os.path.join(target, "a.rsi"))
+    os.makedirs(os.path.join(target, "other.rsi"))
+    with open(os.path.join(target, "a.rsi", "stale.png"), "wb") as f:
+        f.write(b"old")
+    assert cache.restore("key", target) is True
+    # Only what's in the entry gets replaced
+    assert sorted(os.listdir(target)) == ["a.rsi", "other.rsi"]
+    assert os.listdir(os.path.join(target, "a.rsi")) == ["new.png"]
+    assert cache.restore("key", target, clear=True) is True
+    assert os.listdir(target) == ["a.rsi"]
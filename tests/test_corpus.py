@@ -0,0 +1,62 @@
+import os
+import pytest
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from src.corpus import generate_corpus, generate_dmi, generate_states
+from src.dmi import DMI, write_dmi
+from src.cli import main
+from src.utils import convert_dmi_to_rsi, convert_rsi_to_dmi
+from tests.test_fixtures import temporary_directory
+
+
+def _assert_same_states(first: DMI, second: DMI):
+    assert [(x.name, x.dirs, x.frames, x.delay) for x in first.states] == \
+           [(x.name, x.dirs, x.frames, x.delay) for x in second.states]
+    for a, b in zip(first.states, second.states):
+        assert a.content_hash == b.content_hash
+
+
+def test_write_dmi_round_trip():
+    states = generate_states(30, directions=(1, 4, 8), frames=(1, 3), seed=4)
+    dmi = DMI(BytesIO(write_dmi(states)))
+    assert [(x.name, x.dirs, x.frames, x.delay) for x in dmi.states] == \
+           [(x.name, x.dirs, x.frames, x.delay) for x in states]
+    for written, state in zip(states, dmi.states):
+        assert written.content_hash == state.content_hash
+
+
+@pytest.mark.parametrize("size", [(64, 64), (32, 48), (48, 16)])
+def test_write_dmi_round_trip_sizes(size):
+    states = generate_states(12, directions=(1, 4), frames=(1, 3), size=size, seed=2)
+    states[0].metadata.update({"loop": 1, "hotspot": [3, 4, 1]})
+    for backend in ["pillow", "numpy"]:
+        dmi = DMI(BytesIO(write_dmi(states, size)), backend=backend)
+        assert (dmi.width, dmi.height) == size
+        assert dmi.metadata["states"][0]["loop"] == 1
+        assert dmi.metadata["states"][0]["hotspot"] == [3, 4, 1]
+        for written, state in zip(states, dmi.states):
+            assert written.content_hash == state.content_hash
+
+
+def test_generate_dmi_is_seeded():
+    assert generate_dmi(10, seed=1) == generate_dmi(10, seed=1)
+    assert generate_dmi(10, seed=1) != generate_dmi(10, seed=2)
+
+
+def test_rsi_to_dmi_round_trip(temporary_directory: TemporaryDirectory):
+    data = generate_dmi(20, directions=(1, 4), frames=(1, 2), seed=3)
+    rsi_path = os.path.join(temporary_directory.name, "icons.rsi")
+    convert_dmi_to_rsi(BytesIO(data), rsi_path)
+    dmi_path = os.path.join(temporary_directory.name, "icons.dmi")
+    convert_rsi_to_dmi(rsi_path, dmi_path)
+    _assert_same_states(DMI(BytesIO(data)), DMI(dmi_path))
+
+
+def test_generate_corpus(temporary_directory: TemporaryDirectory):
+    paths = generate_corpus(temporary_directory.name, files=4, states=(2, 5), seed=0)
+    assert len(paths) == 4
+    for path in paths:
+        assert 2 <= len(DMI(path).states) <= 5
+    output = os.path.join(temporary_directory.name, "cli")
+    assert main(["generate-corpus", output, "--files", "2", "--states", "1", "3", "--directions", "8"]) == 0
+    assert all(x.dirs == 8 for x in DMI(os.path.join(output, "set0", "icons0.dmi")).states)
@@ -0,0 +1,48 @@
+from PIL import Image
+from src.dedupe import DuplicateReport, dedupe_states
+from src.rsi import RSI, RSIState
+from src.storage import MemoryStorage
+from src.utils import convert_dmi_to_many_rsi
+from tests.test_fixtures import synthetic_dmi_buffer
+
+
+def test_content_hash_ignores_encoding():
+    rgba = RSIState(name="a", data=Image.new("RGBA", (32, 32), "red"))
+    palette = RSIState(name="b", data=Image.new("RGBA", (32, 32), "red").convert("P"))
+    assert rgba.content_hash == palette.content_hash
+    rgba.image = Image.new("RGBA", (32, 32), "blue")
+    assert rgba.content_hash != palette.content_hash
+
+
+def test_dedupe_states():
+    red = Image.new("RGBA", (32, 32), "red")
+    states = [
+        RSIState(name="a", data=red),
+        RSIState(name="a", data=red.copy()),
+        RSIState(name="a", data=red, delays=[1.0]),
+        RSIState(name="b", data=red),
+    ]
+    assert dedupe_states(states) == [states[0], states[2], states[3]]
+
+
+def test_save_memo_reuses_encodes():
+    red = Image.new("RGBA", (32, 32), "red")
+    memo = {}
+    first = RSI(states=[RSIState(name="a", data=red), RSIState(name="b", data=red.copy())])
+    second = RSI(states=[RSIState(name="c", data=red.copy())])
+    first_storage, second_storage = MemoryStorage(), MemoryStorage()
+    first.save_to(first_storage, memo=memo)
+    second.save_to(second_storage, memo=memo)
+    assert len(memo) == 1
+    assert first_storage.read("a.png") == first_storage.read("b.png") == second_storage.read("c.png")
+
+
+def test_many_rsi_duplicate_report():
+    states = [("lamp", 1, 1, None), ("lampshade", 1, 1, None), ("other", 1, 1, None)]
+    buffer = synthetic_dmi_buffer(states=states)
+    report = DuplicateReport()
+    convert_dmi_to_many_rsi(buffer, MemoryStorage(), duplicates=report)
+    # lampshade ends up in both lamp.rsi and lampshade.rsi (prefix grouping)
+    duplicates = list(report.duplicates().values())
+    assert [sorted(x) for x in duplicates] == [[("lamp.rsi", "lampshade"), ("lampshade.rsi", "lampshade")]]
+    assert "duplicate states" in str(report)
@@ -1,11 +1,18 @@
 from src.dmi import (
     DMI,
+    dmi_state_images,
+    parse_dmi_metadata,
+    read_dmi_metadata,
 )
+from src.dmi import InvalidMetadataException
+import pytest
+import mmap
 import os
 from logging import getLogger
 from tempfile import TemporaryDirectory
 from tests.test_fixtures import (
     existing_dmi,
+    synthetic_dmi,
     temporary_directory,
 )
 
@@ -25,3 +32,106 @@ def test_save_dmi_states(existing_dmi: DMI, temporary_directory: TemporaryDirect
     for state in existing_dmi.states:
         state_filepath = os.path.join(temporary_directory.name, f"{state.name}.png")
         state.image.save(state_filepath)
+
+
+def test_lazy_dmi_matches_eager(synthetic_dmi):
+    eager = DMI(synthetic_dmi)
+    lazy = DMI(synthetic_dmi, lazy=True)
+    assert not any(x.loaded for x in lazy.states)
+    for eager_state, lazy_state in zip(eager.states, lazy.states):
+        assert eager_state.image.tobytes() == lazy_state.image.tobytes()
+    assert all(x.loaded for x in lazy.states)
+
+
+def test_lazy_dmi_release(synthetic_dmi):
+    dmi = DMI(synthetic_dmi, lazy=True, cache_states=False)
+    state = dmi.states[1]
+    assert state.image.size == (64, 64)
+    assert not state.loaded
+    dmi = DMI(synthetic_dmi, lazy=True)
+    state = dmi.states[1]
+    image = state.image
+    state.release()
+    assert not state.loaded
+    assert state.image.tobytes() == image.tobytes()
+
+
+def test_read_dmi_metadata_matches_dmi(synthetic_dmi):
+    dmi = DMI(synthetic_dmi)
+    assert read_dmi_metadata(synthetic_dmi) == dmi.metadata
+    assert read_dmi_metadata(synthetic_dmi.getvalue()) == dmi.metadata
+
+
+def test_read_dmi_metadata_mmap(synthetic_dmi, temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.dmi")
+    with open(path, "wb") as f:
+        f.write(synthetic_dmi.getvalue())
+    assert read_dmi_metadata(path)["states"][2]["name"] == "blink"
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            assert len(read_dmi_metadata(mapped)["states"]) == 3
+
+
+def test_numpy_backend_matches_pillow(synthetic_dmi):
+    pillow = DMI(synthetic_dmi)
+    array = DMI(synthetic_dmi, backend="numpy")
+    for pillow_state, array_state in zip(pillow.states, array.states):
+        assert pillow_state.image.size == array_state.image.size
+        assert pillow_state.image.tobytes() == array_state.image.tobytes()
+
+
+def test_numpy_backend_past_end_of_sheet(synthetic_dmi):
+    image = DMI(synthetic_dmi).image
+    # Sheet only has 7 frames so the last 2 should be blank
+    pillow = dmi_state_images(image, 3, frames=6)
+    array = dmi_state_images(image, 3, frames=6, backend="numpy")
+    assert pillow.tobytes() == array.tobytes()
+
+
+def test_dmi_state_lookup(synthetic_dmi):
+    dmi = DMI(synthetic_dmi, lazy=True)
+    assert dmi.get_state("blink") is dmi.states[2]
+    assert dmi.get_state("missing") is None
+    assert [x.name for x in dmi.states_with_prefix("base")] == ["base", "base-open"]
+    assert [x.name for x in dmi.states_with_prefix("base-")] == ["base-open"]
+    assert dmi.states_with_prefix("z") == []
+    # Lookups don't slice anything
+    assert not any(x.loaded for x in dmi.states)
+
+
+def test_parse_dmi_metadata_full_keys():
+    metadata = parse_dmi_metadata("""# BEGIN DMI
+version = 4.0
+\twidth = 32
+\theight = 48
+state = "a = b"
+\tdirs = 4
+\tframes = 2
+\tdelay = 3,1.5
+\tloop = 2
+\trewind = 1
+\tmovement = 1
+\thotspot = 12,4,1
+\tfuture = "something"
+state = "single"
+\tdirs = 1
+\tframes = 1
+\tdelay = 5
+# END DMI
+""")
+    assert (metadata["version"], metadata["width"], metadata["height"]) == ("4.0", 32, 48)
+    assert metadata["frames"] == 9
+    first, second = metadata["states"]
+    assert first == {
+        "name": "a = b", "dirs": 4, "frames": 2, "offset": 0, "delay": [0.3, 0.15], "loop": 2, "rewind": 1,
+        "movement": 1, "hotspot": [12, 4, 1], "future": '"something"',
+    }
+    assert second["delay"] == [0.5]
+    assert second["offset"] == 8
+
+
+def test_parse_dmi_metadata_invalid():
+    with pytest.raises(InvalidMetadataException):
+        parse_dmi_metadata("# BEGIN DMI\nversion = 4.0\nstate = \"a\"\n\tdirs = four\n# END DMI\n")
+    with pytest.raises(InvalidMetadataException):
+        parse_dmi_metadata("# BEGIN DMI\nversion = 4.0\nnonsense\n# END DMI\n")
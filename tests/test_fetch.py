@@ -0,0 +1,44 @@
+from src.fetch import Fetcher
+from src.utils import convert_dmi_url_to_rsi
+from tempfile import TemporaryDirectory
+import os
+import pytest
+from requests import HTTPError
+from tests.test_fixtures import (
+    http_server,
+    synthetic_dmi_buffer,
+    temporary_directory,
+)
+
+
+def test_fetcher_revalidates_with_etag(http_server, temporary_directory: TemporaryDirectory):
+    http_server.files["/a.dmi"] = b"first"
+    fetcher = Fetcher(cache_dir=os.path.join(temporary_directory.name, "cache"))
+    assert fetcher.get(f"{http_server.url}/a.dmi") == b"first"
+    assert fetcher.get(f"{http_server.url}/a.dmi") == b"first"
+    assert fetcher.stats == {"fetched": 1, "not_modified": 1}
+
+    http_server.files["/a.dmi"] = b"second"
+    # A new fetcher shares the same on-disk cache
+    fetcher = Fetcher(cache_dir=os.path.join(temporary_directory.name, "cache"))
+    assert fetcher.get(f"{http_server.url}/a.dmi") == b"second"
+    assert fetcher.stats == {"fetched": 1}
+
+
+def test_fetcher_get_many(http_server):
+    for i in range(5):
+        http_server.files[f"/{i}.dmi"] = bytes([i])
+    fetcher = Fetcher()
+    urls = [f"{http_server.url}/{i}.dmi" for i in range(5)]
+    bodies = fetcher.get_many(urls + urls[0:2], workers=3)
+    assert [bodies[x] for x in urls] == [bytes([i]) for i in range(5)]
+    assert len(http_server.requests) == 5
+    with pytest.raises(HTTPError):
+        fetcher.get(f"{http_server.url}/missing.dmi")
+
+
+def test_convert_dmi_url_to_rsi(http_server, temporary_directory: TemporaryDirectory):
+    http_server.files["/synthetic.dmi"] = synthetic_dmi_buffer().getvalue()
+    target = os.path.join(temporary_directory.name, "synthetic.rsi")
+    convert_dmi_url_to_rsi(f"{http_server.url}/synthetic.dmi", target, fetcher=Fetcher())
+    assert os.path.isfile(os.path.join(target, "blink.png"))
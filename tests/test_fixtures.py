@@ -1,9 +1,15 @@
+import hashlib
 import os
+from math import ceil, sqrt
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
 from tempfile import TemporaryDirectory
+from threading import Thread
 
 import pytest
+from PIL import Image
 
-from src.dmi import DMI
+from src.dmi import DMI, DMIState, write_dmi
 from src.rsi import meta_json_to_states
 
 
@@ -22,6 +28,44 @@ def textures_repository():
     return TEXTURES_REPOSITORY
 
 
+# name, dirs, frames, delay
+SYNTHETIC_STATES = [
+    ("base", 1, 1, None),
+    ("base-open", 4, 1, None),
+    ("blink", 1, 2, [1, 2]),
+]
+
+
+def synthetic_dmi_buffer(states=None, size: tuple = (32, 32)) -> BytesIO:
+    """
+    Builds a small .dmi in memory where every frame is filled with its own flat colour
+    :param states: list of (name, dirs, frames, delay)
+    :param size: icon width / height
+    :return: BytesIO of the .dmi
+    """
+    if states is None:
+        states = SYNTHETIC_STATES
+    dmi_states = []
+    index = 0
+    for name, dirs, frames, delay in states:
+        count = dirs * frames
+        columns = ceil(sqrt(count))
+        image = Image.new("RGBA", (columns * size[0], ceil(count / columns) * size[1]))
+        for i in range(count):
+            frame = Image.new("RGBA", size, ((index * 40) % 256, (index * 90) % 256, 200, 255))
+            image.paste(frame, ((i % columns) * size[0], (i // columns) * size[1]))
+            index += 1
+        # delay is in ticks like byond writes it
+        metadata = {"name": name, "dirs": dirs, "frames": frames, "delay": [x / 10 for x in delay] if delay else None}
+        dmi_states.append(DMIState(metadata=metadata, image=image))
+    return BytesIO(write_dmi(dmi_states, size))
+
+
+@pytest.fixture
+def synthetic_dmi():
+    return synthetic_dmi_buffer()
+
+
 @pytest.fixture
 def existing_dmi():
     dmi_path = os.path.join(TEXTURES_REPOSITORY, "stationobjs.dmi")
@@ -33,4 +77,43 @@ def existing_dmi():
 def rsi_state():
     path = os.path.join(TEXTURES_REPOSITORY, "light_small.rsi")
     states = meta_json_to_states(path)
-    return states[0]
\ No newline at end of file
+    return states[0]
+
+
+class _FileRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """
+    Local stand-in for github raw urls. Put bytes in server.files by path; server.requests records what was asked for.
+    """
+    server = HTTPServer(("127.0.0.1", 0), _FileRequestHandler)
+    server.files = {}
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from src.grouping import (
+    GroupingRule,
+    get_grouping_rule,
+    group_states,
+    order_ammo_box_states,
+    order_gun_states,
+    register_grouping_rule,
+    GROUPING_RULES,
+)
+
+
+def _states(*names):
+    return [SimpleNamespace(name=x) for x in names]
+
+
+def _names(groups: dict) -> dict:
+    return {group: [x.name for x in members] for group, members in groups.items()}
+
+
+def test_group_guns():
+    states = _states("ak", "ak-20", "ak-30", "taser", "taser0", "taser25")
+    groups = group_states(states, get_grouping_rule("guns"))
+    assert _names(groups) == {
+        "ak": ["ak", "ak-20", "ak-30"],
+        "taser": ["taser", "taser0", "taser25"],
+        "taser0": ["taser0"],
+        "taser25": ["taser25"],
+    }
+    assert [x.name for x in order_gun_states(groups["taser"])] == ["taser", "taser0", "taser25"]
+    assert [x.name for x in order_gun_states(_states("ak-30", "ak", "ak-5"))] == ["ak", "ak-5", "ak-30"]
+
+
+def test_group_mags():
+    groups = group_states(_states("m1-2", "m1-1", "plain"), get_grouping_rule("mags"))
+    assert _names(groups) == {"m1": ["m1-2", "m1-1"], "plain": []}
+
+
+def test_group_ammo_boxes():
+    states = _states("box38-30", "box38-rubber-30", "box38-rubber-10", "other")
+    groups = group_states(states, get_grouping_rule("ammo_boxes"))
+    assert _names(groups) == {"box38": ["box38-30"], "box38-rubber": ["box38-rubber-30", "box38-rubber-10"]}
+    assert [x.name for x in order_ammo_box_states(groups["box38-rubber"])] == ["box38-rubber-10", "box38-rubber-30"]
+
+
+def test_group_default_and_fallback():
+    groups = group_states(_states("base", "base-open", "light2"), get_grouping_rule(None))
+    assert _names(groups) == {"base": ["base", "base-open"], "baseopen": [], "light": ["light2"]}
+    # Modes without keys (or names that are all numbers) make every name a group
+    groups = group_states(_states("1", "12"), get_grouping_rule(None))
+    assert _names(groups) == {"1": ["1", "12"], "12": ["12"]}
+
+
+def test_group_door_single():
+    rule = get_grouping_rule("door")
+    groups = group_states(_states("door_open", "door_closed", "weird"), rule, single_group="airlock")
+    assert list(groups) == ["airlock"]
+    assert [rule.rename(x.name) for x in groups["airlock"]] == ["open", "closed", "weird"]
+
+
+def test_register_grouping_rule():
+    rule = GroupingRule(group_keys=lambda name: [name.split("_")[0]], member_key=lambda name: name.split("_")[0])
+    register_grouping_rule("underscores", rule)
+    try:
+        groups = group_states(_states("a_1", "a_2", "b_1"), get_grouping_rule("underscores"))
+        assert _names(groups) == {"a": ["a_1", "a_2"], "b": ["b_1"]}
+    finally:
+        del GROUPING_RULES["underscores"]
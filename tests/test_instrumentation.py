@@ -0,0 +1,57 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from src import instrumentation
+from src.cli import main
+from src.storage import MemoryStorage
+from src.utils import convert_dmi_to_many_rsi
+from tests.test_fixtures import synthetic_dmi, synthetic_dmi_buffer, temporary_directory
+
+
+def test_disabled_is_a_no_op():
+    assert instrumentation.get_recorder() is None
+    with instrumentation.span("nothing", a=1) as span:
+        span.set("b", 2)
+    assert span is instrumentation.NULL_SPAN
+    instrumentation.count("nothing")
+
+
+def test_records_conversion(synthetic_dmi, temporary_directory: TemporaryDirectory):
+    recorder = instrumentation.enable()
+    try:
+        convert_dmi_to_many_rsi(synthetic_dmi, MemoryStorage())
+    finally:
+        assert instrumentation.disable() is recorder
+    summary = recorder.summary()
+    for name in ["convert_dmi_to_many_rsi", "dmi.open", "dmi.parse_metadata", "png.decode", "dmi.slice", "grouping",
+                 "png.encode", "rsi.save", "rsi.write"]:
+        assert name in summary, name
+    assert summary["png.decode"]["count"] == 1
+    assert recorder.counters["dmi.states"] == 3
+    assert recorder.counters["png.bytes_out"] == recorder.counters["rsi.bytes_written"]
+    encodes = [x for x in recorder.spans if x.name == "png.encode"]
+    assert all(x.args["bytes"] > 0 and x.args["state"] for x in encodes)
+
+    trace_path = os.path.join(temporary_directory.name, "trace.json")
+    recorder.save(trace_path)
+    with open(trace_path) as f:
+        events = json.load(f)["traceEvents"]
+    assert len([x for x in events if x["ph"] == "X"]) == len(recorder.spans)
+    lines_path = os.path.join(temporary_directory.name, "trace.jsonl")
+    recorder.save(lines_path)
+    with open(lines_path) as f:
+        lines = [json.loads(x) for x in f]
+    assert len([x for x in lines if x["type"] == "counter"]) == len(recorder.counters)
+
+
+def test_cli_trace(temporary_directory: TemporaryDirectory):
+    source = os.path.join(temporary_directory.name, "source")
+    os.makedirs(source)
+    with open(os.path.join(source, "a.dmi"), "wb") as f:
+        f.write(synthetic_dmi_buffer().getvalue())
+    trace = os.path.join(temporary_directory.name, "trace.jsonl")
+    assert main(["convert-tree", source, os.path.join(temporary_directory.name, "out"), "-j", "1", "--trace",
+                 trace]) == 0
+    assert instrumentation.get_recorder() is None
+    with open(trace) as f:
+        assert any(json.loads(x).get("name") == "convert_dmi_to_rsi" for x in f)
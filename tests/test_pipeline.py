@@ -0,0 +1,63 @@
+from src.fetch import Fetcher
+from src.pipeline import UrlJob, run_url_batch
+from src import pipeline
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from threading import Lock
+import os
+import time
+from tests.test_fixtures import (
+    http_server,
+    synthetic_dmi_buffer,
+    temporary_directory,
+)
+
+
+def test_run_url_batch(http_server, temporary_directory: TemporaryDirectory):
+    for name in ["a", "b", "c"]:
+        http_server.files[f"/{name}.dmi"] = synthetic_dmi_buffer().getvalue()
+    output = temporary_directory.name
+    jobs = [
+        (f"{http_server.url}/a.dmi", os.path.join(output, "a.rsi")),
+        UrlJob(f"{http_server.url}/missing.dmi", os.path.join(output, "missing.rsi")),
+        (f"{http_server.url}/b.dmi", os.path.join(output, "nested", "b.rsi"), None),
+        (f"{http_server.url}/c.dmi", os.path.join(output, "c"), "default"),
+    ]
+    results = run_url_batch(jobs, fetcher=Fetcher(), fetch_concurrency=2, workers=2, max_pending=1)
+    assert [x.ok for x in results] == [True, False, True, True]
+    assert os.path.isfile(os.path.join(output, "a.rsi", "meta.json"))
+    assert os.path.isfile(os.path.join(output, "nested", "b.rsi", "meta.json"))
+    assert os.path.isfile(os.path.join(output, "c", "blink.rsi", "meta.json"))
+
+
+def test_run_url_batch_with_executor(http_server, temporary_directory: TemporaryDirectory):
+    http_server.files["/a.dmi"] = b"not a dmi"
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = run_url_batch([(f"{http_server.url}/a.dmi", os.path.join(temporary_directory.name, "a.rsi"))],
+                                fetcher=Fetcher(), executor=executor, workers=1)
+    assert not results[0].ok
+
+
+def test_run_url_batch_backpressure(monkeypatch):
+    counts = {"fetched": 0, "converted": 0, "most_pending": 0}
+    lock = Lock()
+
+    class _Fetcher:
+        def get(self, url: str) -> bytes:
+            with lock:
+                counts["fetched"] += 1
+                counts["most_pending"] = max(counts["most_pending"], counts["fetched"] - counts["converted"])
+            return b""
+
+    def _slow_job(job, body, kwargs):
+        with lock:
+            counts["converted"] += 1
+        time.sleep(0.01)
+
+    monkeypatch.setattr(pipeline, "_run_job", _slow_job)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = run_url_batch([(f"http://localhost/{x}.dmi", f"{x}.rsi") for x in range(50)], fetcher=_Fetcher(),
+                                fetch_concurrency=2, executor=executor, workers=1, max_pending=1)
+    assert all(x.ok for x in results)
+    # Queue plus one body held by each download task
+    assert counts["most_pending"] <= 1 + 2
@@ -0,0 +1,77 @@
+from src.png import (
+    PNG_PROFILES,
+    InvalidPNGException,
+    encode_png,
+    iter_chunks,
+    palette_image,
+    read_ihdr,
+)
+from src import png
+from src.dmi import validate_dmi
+from src.internal_utils import handle_data_to_pil_image, png_dimensions
+from io import BytesIO
+from PIL import Image
+import pytest
+from tests.test_fixtures import (
+    synthetic_dmi,
+)
+
+
+def test_read_ihdr(synthetic_dmi):
+    ihdr = read_ihdr(synthetic_dmi)
+    assert (ihdr.width, ihdr.height) == (96, 96)
+    assert png_dimensions(synthetic_dmi.getvalue()) == (96, 96)
+
+
+def test_iter_chunks_skips_pixel_data(synthetic_dmi):
+    chunks = list(iter_chunks(synthetic_dmi))
+    assert chunks[0][0] == b"IHDR"
+    assert chunks[-1][0] == b"IEND"
+    assert all(data is None for chunk_type, data in chunks if chunk_type == b"IDAT")
+
+
+def test_iter_chunks_bad_crc(synthetic_dmi):
+    data = bytearray(synthetic_dmi.getvalue())
+    # Flip a byte inside the IHDR data
+    data[20] ^= 0xFF
+    with pytest.raises(InvalidPNGException):
+        list(iter_chunks(bytes(data)))
+    with pytest.raises(AttributeError):
+        validate_dmi(bytes(data))
+
+
+def test_png_bytes_to_pil_image(synthetic_dmi):
+    image = handle_data_to_pil_image(synthetic_dmi.getvalue())
+    assert image.size == (96, 96)
+    assert image.getpixel((0, 0)) == (0, 0, 200, 255)
+
+
+def _sprite() -> Image.Image:
+    image = Image.new("RGBA", (64, 64))
+    for i in range(20):
+        image.paste((i * 10, 50, 60, 255 if i % 3 else 128), (i * 3, i * 2, i * 3 + 10, i * 2 + 10))
+    return image
+
+
+def test_encode_png_profiles_are_lossless():
+    image = _sprite()
+    for profile in PNG_PROFILES:
+        encoded = encode_png(image, profile)
+        assert Image.open(BytesIO(encoded.data)).convert("RGBA").tobytes() == image.tobytes()
+    small = encode_png(image, "small")
+    assert len(small.data) <= small.default_size
+
+
+def test_palette_image_too_many_colours():
+    image = Image.frombytes("RGBA", (64, 64), b"".join(bytes((i % 256, i // 256, 0, 255)) for i in range(64 * 64)))
+    assert palette_image(image) is None
+    assert palette_image(_sprite()).mode == "P"
+
+
+def test_palette_image_without_numpy(monkeypatch):
+    image = _sprite()
+    with_numpy = palette_image(image)
+    monkeypatch.setattr(png, "numpy", None)
+    without_numpy = palette_image(image)
+    assert with_numpy.tobytes() == without_numpy.tobytes()
+    assert without_numpy.convert("RGBA").tobytes() == image.tobytes()
@@ -0,0 +1,122 @@
+import json
+import os
+import yaml
+from tempfile import TemporaryDirectory
+from src.cli import main
+from src.prototypes import (
+    PrototypeIndex,
+    append_to_file,
+    create_hat_prototype,
+    generate_prototypes,
+    route_rsi,
+)
+from tests.test_fixtures import temporary_directory
+
+
+def _output(temporary_directory: TemporaryDirectory) -> str:
+    path = os.path.join(temporary_directory.name, "hats.yml")
+    with open(path, "w") as f:
+        f.write("")
+    return path
+
+
+def test_append_to_file(temporary_directory: TemporaryDirectory):
+    output = _output(temporary_directory)
+    assert append_to_file([create_hat_prototype("beret.rsi"), create_hat_prototype("fez.rsi")], output) == []
+    with open(output, "r") as f:
+        text = f.read()
+    assert text.startswith("\n- type: entity\n  parent: HatBase\n  id: HatBeret\n")
+    assert text.count("\n\n- type:") == 1
+    assert append_to_file([create_hat_prototype("fez.rsi"), create_hat_prototype("cap.rsi")], output) == ["HatFez"]
+    with open(output, "rb") as f:
+        prototypes = yaml.safe_load(f)
+    assert [x["id"] for x in prototypes] == ["HatBeret", "HatFez", "HatCap"]
+
+
+def test_prototype_index_sidecar(temporary_directory: TemporaryDirectory):
+    output = _output(temporary_directory)
+    append_to_file([create_hat_prototype("beret.rsi")], output)
+    assert os.path.isfile(f"{output}.ids.json")
+    assert "HatBeret" in PrototypeIndex(output)
+    # Something else editing the file means the sidecar is stale and it gets re-read
+    with open(output, "a") as f:
+        f.write("\n- type: entity\n  id: HatManual\n")
+    index = PrototypeIndex(output)
+    assert {"HatBeret", "HatManual"} == index.ids
+    assert append_to_file([create_hat_prototype("beret.rsi")], output, index=index) == ["HatBeret"]
+
+
+def test_append_to_file_matches_safe_dumper(temporary_directory: TemporaryDirectory):
+    output = _output(temporary_directory)
+    prototype = create_hat_prototype("beret.rsi")
+    prototype.description = " ".join(["A long description that needs wrapping."] * 4)
+    append_to_file([prototype], output)
+    expected = yaml.dump([prototype.to_dict()], Dumper=yaml.SafeDumper, default_flow_style=False, sort_keys=False)
+    with open(output, "r") as f:
+        assert f.read() == f"\n{expected}"
+
+
+def test_prototype_index_directory(temporary_directory: TemporaryDirectory):
+    output = _output(temporary_directory)
+    index_directory = os.path.join(temporary_directory.name, "index")
+    append_to_file([create_hat_prototype("beret.rsi")], output, index_directory=index_directory)
+    assert sorted(os.listdir(temporary_directory.name)) == ["hats.yml", "index"]
+    assert len(os.listdir(index_directory)) == 1
+    assert "HatBeret" in PrototypeIndex(output, index_directory=index_directory)
+
+
+def _rsi(directory: str, *parts: str, states=("icon",)):
+    path = os.path.join(directory, *parts)
+    os.makedirs(path)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"version": 1, "states": [{"name": x} for x in states]}, f)
+
+
+def test_route_rsi():
+    assert route_rsi("Clothing/Head") == "hats"
+    assert route_rsi("Clothing/Head/Hardhats") == "hats"
+    assert route_rsi("Clothing/Headsets") is None
+    assert route_rsi("Objects/Tools", routes=[("Objects/*", "food")]) == "food"
+
+
+def test_generate_prototypes(temporary_directory: TemporaryDirectory):
+    textures = os.path.join(temporary_directory.name, "Textures")
+    output = os.path.join(temporary_directory.name, "Prototypes")
+    _rsi(textures, "Clothing", "Head", "beret.rsi")
+    _rsi(textures, "Clothing", "Head", "Hardhats", "hard_hat.rsi", states=("on", "off"))
+    _rsi(textures, "Clothing", "Gloves", "latex.rsi")
+    _rsi(textures, "Objects", "Food", "burger.rsi")
+    _rsi(textures, "Objects", "Tools", "wrench.rsi")
+    # Not an .rsi so it's ignored
+    os.makedirs(os.path.join(textures, "Clothing", "Head", "notes"))
+    with open(os.path.join(textures, "Clothing", "Head", "readme.txt"), "w") as f:
+        f.write("")
+
+    written = generate_prototypes(textures, output, inspect_meta=True)
+    assert {x: [y.id for y in prototypes] for x, prototypes in written.items()} == {
+        "food": ["FoodBurger"],
+        "gloves": ["GlovesLatex"],
+        "hats": ["HatBeret", "HatHardHat"],
+    }
+    with open(os.path.join(output, "hats.yml"), "rb") as f:
+        hats = yaml.safe_load(f)
+    assert hats[0]["components"][0]["state"] == "icon"
+    assert hats[1]["components"][0] == {"type": "Sprite", "sprite": "Clothing/Head/Hardhats/hard_hat.rsi",
+                                        "state": "on"}
+    # Running again doesn't add anything
+    assert main(["prototypes", textures, output]) == 0
+    with open(os.path.join(output, "hats.yml"), "rb") as f:
+        assert len(yaml.safe_load(f)) == 2
+
+
+def test_generate_prototypes_symlinks_and_duplicates(temporary_directory: TemporaryDirectory, caplog):
+    textures = os.path.join(temporary_directory.name, "Textures")
+    _rsi(textures, "Clothing", "Head", "beret.rsi")
+    _rsi(textures, "Clothing", "Head", "Fancy", "beret.rsi")
+    # Would loop forever if it got followed
+    os.symlink(textures, os.path.join(textures, "Clothing", "Head", "loop"))
+    written = generate_prototypes(textures, os.path.join(temporary_directory.name, "Prototypes"))
+    assert [x.id for x in written["hats"]] == ["HatBeret"]
+    # Shallowest wins
+    assert written["hats"][0].components[0].kwargs["sprite"] == "Clothing/Head/beret.rsi"
+    assert "Clothing/Head/Fancy/beret.rsi" in caplog.text
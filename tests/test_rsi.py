@@ -7,6 +7,8 @@ from src.rsi import (
 from tempfile import TemporaryDirectory
 import os
 from io import BytesIO
+from src.internal_utils import ImagePool
+import pytest
 from tests.test_fixtures import (
     rsi_state,
     textures_repository,
@@ -43,3 +45,121 @@ def test_save_rsi(textures_repository: str, temporary_directory: TemporaryDirect
 
 def test_save_rsi_state_image_to_buffer(rsi_state: RSIState):
     assert isinstance(rsi_state.image_buffer(), BytesIO) is True
+
+
+def _synthetic_rsi(colours: dict) -> RSI:
+    return RSI(states=[RSIState(name=name, data=Image.new("RGBA", (32, 32), colour)) for name, colour in colours.items()])
+
+
+def test_save_rsi_over_existing(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    _synthetic_rsi({"a": "red", "b": "blue"}).save_to(path)
+    _synthetic_rsi({"a": "green"}).save_to(path)
+    assert sorted(os.listdir(path)) == ["a.png", "meta.json"]
+
+
+def test_save_rsi_incremental(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    _synthetic_rsi({"a": "red", "b": "blue", "c": "white"}).save_to(path)
+    for file in os.listdir(path):
+        os.utime(os.path.join(path, file), (0, 0))
+
+    _synthetic_rsi({"a": "red", "b": "green"}).save_to(path, incremental=True)
+    assert sorted(os.listdir(path)) == ["a.png", "b.png", "meta.json"]
+    assert os.path.getmtime(os.path.join(path, "a.png")) == 0
+    assert os.path.getmtime(os.path.join(path, "b.png")) != 0
+    assert os.path.getmtime(os.path.join(path, "meta.json")) != 0
+    assert RSI(path).states[1].image.convert("RGBA").getpixel((0, 0)) == (0, 128, 0, 255)
+
+    os.utime(os.path.join(path, "meta.json"), (0, 0))
+    _synthetic_rsi({"a": "red", "b": "green"}).save_to(path, incremental=True)
+    assert os.path.getmtime(os.path.join(path, "meta.json")) == 0
+
+
+def test_save_rsi_failure_keeps_old_version(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    _synthetic_rsi({"a": "red"}).save_to(path)
+    broken = _synthetic_rsi({"a": "blue", "b": "green"})
+    broken.states[1].image = None
+    with pytest.raises(AttributeError):
+        broken.save_to(path)
+    assert sorted(os.listdir(path)) == ["a.png", "meta.json"]
+    assert RSI(path).states[0].image.convert("RGBA").getpixel((0, 0)) == (255, 0, 0, 255)
+    # Nothing left over from staging
+    assert os.listdir(temporary_directory.name) == ["synthetic.rsi"]
+
+
+def test_save_rsi_permissions(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    umask = os.umask(0o022)
+    try:
+        _synthetic_rsi({"a": "red"}).save_to(path)
+    finally:
+        os.umask(umask)
+    assert os.stat(path).st_mode & 0o777 == 0o755
+
+
+def test_save_rsi_recovers_interrupted_save(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    _synthetic_rsi({"a": "red"}).save_to(path)
+    # Died between the renames with a half written staging directory
+    os.rename(path, os.path.join(temporary_directory.name, ".synthetic.rsi.old"))
+    os.mkdir(os.path.join(temporary_directory.name, ".synthetic.rsi.tmp"))
+    _synthetic_rsi({"b": "blue"}).save_to(path, incremental=True)
+    assert sorted(os.listdir(temporary_directory.name)) == ["synthetic.rsi"]
+    assert sorted(os.listdir(path)) == ["b.png", "meta.json"]
+
+
+def test_save_rsi_parallel_matches_serial(temporary_directory: TemporaryDirectory):
+    colours = {f"state{i}": (i * 20, 255 - i * 20, 0, 255) for i in range(10)}
+    serial = os.path.join(temporary_directory.name, "serial.rsi")
+    parallel = os.path.join(temporary_directory.name, "parallel.rsi")
+    _synthetic_rsi(colours).save_to(serial)
+    _synthetic_rsi(colours).save_to(parallel, workers=4)
+    assert sorted(os.listdir(serial)) == sorted(os.listdir(parallel))
+    for file in os.listdir(serial):
+        with open(os.path.join(serial, file), "rb") as a, open(os.path.join(parallel, file), "rb") as b:
+            assert a.read() == b.read()
+
+
+def test_save_rsi_small_profile(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    report = _synthetic_rsi({"a": "red", "b": "blue"}).save_to(path, profile="small")
+    assert report.states_written == 2
+    assert report.bytes_saved >= 0
+    assert RSI(path).states[0].image.convert("RGBA").getpixel((0, 0)) == (255, 0, 0, 255)
+
+
+def test_open_rsi_lazily(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    _synthetic_rsi({"a": "red", "b": "blue", "c": "white"}).save_to(path)
+    pool = ImagePool(maxsize=1)
+    rsi = RSI(path, lazy=True, pool=pool)
+    assert len(pool) == 0
+    rsi.validate_states()
+    assert len(pool) == 0
+    assert [x.image.getpixel((0, 0)) for x in rsi.states] == [(255, 0, 0, 255), (0, 0, 255, 255), (255, 255, 255, 255)]
+    assert len(pool) == 1
+    rsi.states[0].image = Image.new("RGBA", (32, 32), "green")
+    rsi.save_to(path)
+    assert RSI(path).states[0].image.getpixel((0, 0)) == (0, 128, 0, 255)
+
+
+def test_lazy_rsi_sees_rewrites(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    pool = ImagePool()
+    _synthetic_rsi({"a": "red"}).save_to(path)
+    assert RSI(path, lazy=True, pool=pool).states[0].image.getpixel((0, 0)) == (255, 0, 0, 255)
+    _synthetic_rsi({"a": "blue"}).save_to(path)
+    assert RSI(path, lazy=True, pool=pool).states[0].image.getpixel((0, 0)) == (0, 0, 255, 255)
+
+
+def test_lazy_rsi_images_are_not_shared(temporary_directory: TemporaryDirectory):
+    path = os.path.join(temporary_directory.name, "synthetic.rsi")
+    pool = ImagePool()
+    _synthetic_rsi({"a": "red"}).save_to(path)
+    first = RSI(path, lazy=True, pool=pool).states[0]
+    second = RSI(path, lazy=True, pool=pool).states[0]
+    first.image.putpixel((0, 0), (0, 0, 0, 255))
+    assert second.image.getpixel((0, 0)) == (255, 0, 0, 255)
+    assert first.content_hash == second.content_hash
@@ -0,0 +1,69 @@
+from PIL import Image
+import random
+import pytest
+import src.smoothing
+from src.smoothing import WALL_SOURCES, cornerise_image, wall_junction_images
+
+
+def _reference_cornerise(original: Image.Image) -> Image.Image:
+    # What the wall mode used to do
+    whole_image = Image.new(mode="RGBA", size=(64, 64))
+    whole_image.paste(original.copy().crop((16, 16, 32, 32)), box=(16, 16, 32, 32))
+    whole_image.paste(original.copy().crop((0, 0, 16, 16)), box=(32, 0, 48, 16))
+    whole_image.paste(original.copy().crop((16, 0, 32, 16)), box=(16, 32, 32, 48))
+    whole_image.paste(original.copy().crop((0, 16, 16, 32)), box=(32, 48, 48, 64))
+    return whole_image
+
+
+def _reference_junction(nw: Image.Image, ne: Image.Image, se: Image.Image, sw: Image.Image) -> Image.Image:
+    whole_image = Image.new(mode="RGBA", size=(64, 64), color=255)
+    whole_image.paste(nw.crop(box=(0, 0, 16, 16)), box=(0, 0, 16, 16))
+    whole_image.paste(se.crop(box=(16, 16, 32, 32)), box=(16, 16, 32, 32))
+    whole_image.paste(ne.crop(box=(16, 0, 32, 16)), box=(16, 0, 32, 16))
+    whole_image.paste(sw.crop(box=(0, 16, 16, 32)), box=(0, 16, 16, 32))
+    return _reference_cornerise(whole_image)
+
+
+def _noise(seed: int, size: tuple = (32, 128)) -> Image.Image:
+    rng = random.Random(seed)
+    return Image.frombytes("RGBA", size, bytes(rng.randrange(256) for _ in range(size[0] * size[1] * 4)))
+
+
+@pytest.fixture(params=["numpy", "pillow"])
+def backend(request, monkeypatch):
+    if request.param == "pillow":
+        monkeypatch.setattr(src.smoothing, "numpy", None)
+    elif src.smoothing.numpy is None:
+        pytest.skip("numpy isn't installed")
+    return request.param
+
+
+def test_cornerise_matches_reference(backend):
+    image = _noise(1)
+    assert cornerise_image(image).tobytes() == _reference_cornerise(image).tobytes()
+    # Too small gets padded with transparency like crop does
+    small = _noise(2, (20, 20))
+    assert cornerise_image(small).tobytes() == _reference_cornerise(small).tobytes()
+
+
+def test_wall_junctions_match_reference(backend):
+    sources = {x: _noise(x) for x in WALL_SOURCES}
+    junctions = wall_junction_images(sources)
+    expected = {
+        0: _reference_cornerise(sources[0]),
+        1: _reference_junction(sources[14], sources[11], sources[13], sources[7]),
+        4: _reference_junction(sources[7], sources[14], sources[11], sources[13]),
+        5: _reference_cornerise(sources[15]),
+    }
+    expected[2], expected[3], expected[6], expected[7] = expected[0], expected[1], expected[4], expected[5]
+    assert sorted(junctions) == list(range(8))
+    for junction, image in expected.items():
+        assert junctions[junction].tobytes() == image.tobytes(), junction
+    # Duplicates get built once
+    assert junctions[0] is junctions[2]
+    assert junctions[5] is junctions[7]
+
+
+def test_wall_junctions_missing_source():
+    with pytest.raises(AttributeError):
+        wall_junction_images({0: _noise(0)})
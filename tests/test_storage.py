@@ -0,0 +1,84 @@
+from src.rsi import RSI, RSIState
+from src.storage import (
+    DirectoryStorage,
+    MemoryStorage,
+    ZipStorage,
+)
+from src import rsi as rsi_module
+from src.utils import convert_dmi_to_many_rsi, convert_dmi_to_rsi
+from io import BytesIO
+from PIL import Image
+from tempfile import TemporaryDirectory
+import os
+from tests.test_fixtures import (
+    synthetic_dmi,
+    temporary_directory,
+)
+
+
+def _synthetic_rsi() -> RSI:
+    return RSI(states=[
+        RSIState(name="a", data=Image.new("RGBA", (32, 32), "red")),
+        RSIState(name="b", data=Image.new("RGBA", (32, 64), "blue")),
+    ])
+
+
+def test_memory_storage_round_trip():
+    storage = MemoryStorage()
+    report = _synthetic_rsi().save_to(storage)
+    assert report.states_written == 2
+    assert sorted(storage.names()) == ["a.png", "b.png", "meta.json"]
+    loaded = RSI(storage)
+    assert [x.name for x in loaded.states] == ["a", "b"]
+    assert loaded.states[1].image.size == (32, 64)
+
+
+def test_zip_storage_round_trip():
+    buffer = BytesIO()
+    with ZipStorage(buffer, mode="w") as storage:
+        _synthetic_rsi().save_to(storage)
+    loaded = RSI(BytesIO(buffer.getvalue()))
+    assert loaded.states[0].image.convert("RGBA").getpixel((0, 0)) == (255, 0, 0, 255)
+
+
+def test_stored_pngs_pass_through(monkeypatch):
+    source = MemoryStorage()
+    _synthetic_rsi().save_to(source)
+    loaded = RSI(source)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("Shouldn't re-encode")
+
+    monkeypatch.setattr(rsi_module, "encode_png", _fail)
+    target = MemoryStorage()
+    loaded.save_to(target)
+    assert target.mapping == source.mapping
+
+
+def test_convert_into_storage(synthetic_dmi, temporary_directory: TemporaryDirectory):
+    storage = MemoryStorage()
+    convert_dmi_to_rsi(synthetic_dmi, storage)
+    assert sorted(storage.names()) == ["base-open.png", "base.png", "blink.png", "meta.json"]
+
+    storage = MemoryStorage()
+    convert_dmi_to_many_rsi(synthetic_dmi, storage)
+    assert "base.rsi/meta.json" in storage.mapping
+    assert "blink.rsi/blink.png" in storage.mapping
+
+    directory = DirectoryStorage(os.path.join(temporary_directory.name, "out.rsi"))
+    convert_dmi_to_rsi(synthetic_dmi, directory)
+    assert RSI(directory.path).states[0].name == "base"
+
+
+def test_convert_door_into_storage(synthetic_dmi, temporary_directory: TemporaryDirectory):
+    storage = MemoryStorage()
+    convert_dmi_to_many_rsi(BytesIO(synthetic_dmi.getvalue()), storage, mode="door")
+    assert sorted(storage.mapping) == ["door.rsi/base-open.png", "door.rsi/base.png", "door.rsi/blink.png",
+                                       "door.rsi/meta.json"]
+    storage = MemoryStorage()
+    convert_dmi_to_many_rsi(BytesIO(synthetic_dmi.getvalue()), storage, mode="door", group_name="airlock")
+    assert "airlock.rsi/meta.json" in storage.mapping
+
+    directory = DirectoryStorage(os.path.join(temporary_directory.name, "Doors"))
+    convert_dmi_to_many_rsi(BytesIO(synthetic_dmi.getvalue()), directory, mode="door")
+    assert os.listdir(directory.path) == ["doors.rsi"]